@@ -0,0 +1,197 @@
+from __future__ import annotations
+import hashlib, io, json, os, threading
+from pathlib import Path
+from typing import Any, Dict, Tuple
+import numpy as np
+from PIL import Image
+
+from .detect import colorize_array, rgb_luminance
+from .lazytiles import lazy_tile
+from .pyramides import read_dzi
+from .tilepack import PACK_SUFFIX, open_pack
+
+# Comparaison avant/après de deux pyramides sur la même grille DZI, tuile par tuile.
+#   diff   : |A - B| par canal (RGB opaque)
+#   change : |ΔL| colorisé (palette heatmap), transparent sous le seuil → calque superposable
+COMPARE_MODES = ("diff", "change")
+CACHE_DIRNAME = ".compare"
+# Cache disque borné: au-delà, les fichiers les moins récemment servis (mtime) sont
+# supprimés jusqu'à repasser sous CACHE_LOW_BYTES
+CACHE_MAX_BYTES = 256 * 2 ** 20
+CACHE_LOW_BYTES = CACHE_MAX_BYTES * 3 // 4
+
+_cache_lock = threading.Lock()
+_cache_bytes: Dict[Path, int] = {}  # racine .compare -> taille connue (parcourue une fois)
+
+def pyramid_info(tiles_dir: Path, stem: str) -> Dict[str, Any] | None:
+    """Descripteur d'une pyramide, qu'elle soit en fichiers (éventuellement paresseuse) ou empaquetée."""
+    dzi = tiles_dir / f"{stem}.dzi"
+    if dzi.exists():
+        return read_dzi(dzi)
+    pack = tiles_dir / f"{stem}{PACK_SUFFIX}"
+    if pack.exists():
+        return dict(open_pack(pack).dzi)
+    return None
+
+def pyramid_stamp(tiles_dir: Path, stem: str) -> str:
+    """Empreinte de la pyramide (.dzi ou .dzpack, réécrit à chaque génération)."""
+    for path in (tiles_dir / f"{stem}.dzi", tiles_dir / f"{stem}{PACK_SUFFIX}"):
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        return f"{path.name}:{st.st_mtime_ns}:{st.st_size}"
+    return ""
+
+def same_grid(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    return all(a[k] == b[k] for k in ("width", "height", "tile_size", "overlap"))
+
+def read_tile(tiles_dir: Path, stem: str, info: Dict[str, Any], level: int, col: int, row: int) -> Tuple[bytes, str] | None:
+    """(octets, empreinte) d'une tuile: fichier, rendu paresseux ou archive .dzpack."""
+    base = tiles_dir / stem
+    path = Path(f"{base}_files") / str(level) / f"{col}_{row}.{info['format']}"
+    if not path.exists():
+        try:
+            path = lazy_tile(base, level, col, row) if (tiles_dir / f"{stem}.dzi").exists() else None
+        except FileNotFoundError:  # source d'une pyramide paresseuse supprimée
+            path = None
+    if path is not None:
+        st = path.stat()
+        return path.read_bytes(), f"{path}:{st.st_mtime_ns}:{st.st_size}"
+    pack_path = tiles_dir / f"{stem}{PACK_SUFFIX}"
+    if not pack_path.exists():
+        return None
+    data = open_pack(pack_path).get(level, col, row)
+    if data is None:
+        return None
+    st = pack_path.stat()
+    body = bytes(data)
+    data.release()
+    return body, f"{pack_path}:{st.st_mtime_ns}:{st.st_size}:{level}/{col}_{row}"
+
+def _decode_rgb(data: bytes) -> np.ndarray:
+    with Image.open(io.BytesIO(data)) as im:
+        return np.asarray(im.convert("RGB"))
+
+def change_tile(a: np.ndarray, b: np.ndarray, mode: str = "change", threshold: float = 0.1,
+                alpha: int = 200) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """Tuile RGBA de différence entre deux tuiles RGB uint8 + statistiques de changement.
+
+    Les statistiques portent sur la luminance (0..1): écart absolu moyen/max, RMSE,
+    écart signé moyen (B - A) et fraction de pixels dont |ΔL| dépasse `threshold`.
+    """
+    h, w = min(a.shape[0], b.shape[0]), min(a.shape[1], b.shape[1])
+    a, b = a[:h, :w], b[:h, :w]
+    la, lb = rgb_luminance(a), rgb_luminance(b)
+    delta = lb - la
+    d = np.abs(delta)
+    changed = d > threshold
+    stats = {
+        "width": w, "height": h,
+        "mean_abs_diff": float(d.mean()),
+        "max_abs_diff": float(d.max()),
+        "rmse": float(np.sqrt(np.mean(delta * delta))),
+        "mean_signed_diff": float(delta.mean()),
+        "changed_fraction": float(changed.mean()),
+        "threshold": threshold,
+    }
+    if mode == "diff":
+        rgba = np.empty((h, w, 4), dtype=np.uint8)
+        rgba[..., :3] = np.abs(a.astype(np.int16) - b.astype(np.int16)).astype(np.uint8)
+        rgba[..., 3] = 255
+    else:
+        rgba = colorize_array(np.clip(d, 0.0, 1.0), alpha)
+        rgba[..., 3] = np.where(changed, alpha, 0)
+    return rgba, stats
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp = path.with_name(f".{path.name}.part")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+def _cache_files(root: Path):
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            path = Path(dirpath) / name
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            yield st.st_mtime_ns, st.st_size, path
+
+def prune_cache(root: Path, max_bytes: int | None = None) -> int:
+    """Supprime les entrées les plus anciennes (mtime) jusqu'à `max_bytes`; renvoie la taille restante.
+
+    PNG et stats d'une entrée peuvent partir séparément: l'une sans l'autre est un défaut de cache.
+    """
+    files = sorted(_cache_files(root))
+    total = sum(size for _, size, _ in files)
+    limit = CACHE_LOW_BYTES if max_bytes is None else max_bytes
+    for _, size, path in files:
+        if total <= limit:
+            break
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
+
+def _account(root: Path, added: int) -> None:
+    with _cache_lock:
+        if root not in _cache_bytes:
+            _cache_bytes[root] = sum(size for _, size, _ in _cache_files(root))
+        else:
+            _cache_bytes[root] += added
+        if _cache_bytes[root] > CACHE_MAX_BYTES:
+            _cache_bytes[root] = prune_cache(root)
+
+def compare_tile(tiles_dir, a: str, b: str, level: int, col: int, row: int, mode: str = "change",
+                 threshold: float = 0.1) -> Tuple[bytes, Dict[str, Any]] | None:
+    """PNG de comparaison + stats, mis en cache disque sous <tiles>/.compare/.
+
+    Le cache est indexé par les empreintes des deux pyramides et des deux tuiles
+    sources: il est invalidé dès que l'une des pyramides est régénérée. Il est borné
+    à CACHE_MAX_BYTES (LRU par mtime, rafraîchi à chaque lecture). None si une tuile
+    est absente.
+    Lève ValueError si le mode est inconnu ou si les grilles diffèrent.
+    """
+    if mode not in COMPARE_MODES:
+        raise ValueError(f"Mode de comparaison inconnu: {mode} (disponibles: {', '.join(COMPARE_MODES)})")
+    tiles_dir = Path(tiles_dir)
+    info_a, info_b = pyramid_info(tiles_dir, a), pyramid_info(tiles_dir, b)
+    if info_a is None or info_b is None:
+        return None
+    if not same_grid(info_a, info_b):
+        raise ValueError("Pyramides sur des grilles différentes (taille, tuile ou recouvrement)")
+    ta = read_tile(tiles_dir, a, info_a, level, col, row)
+    tb = read_tile(tiles_dir, b, info_b, level, col, row) if ta is not None else None
+    if ta is None or tb is None:
+        return None
+
+    stamps = [pyramid_stamp(tiles_dir, a), pyramid_stamp(tiles_dir, b)]
+    key = hashlib.blake2b(json.dumps([*stamps, ta[1], tb[1], mode, threshold]).encode("utf-8"),
+                          digest_size=16).hexdigest()
+    root = tiles_dir / CACHE_DIRNAME
+    cache = root / f"{a}~{b}" / str(level)
+    png_path, stats_path = cache / f"{col}_{row}.{mode}.png", cache / f"{col}_{row}.{mode}.json"
+    try:
+        stats = json.loads(stats_path.read_text(encoding="utf-8"))
+        if stats.get("key") == key:
+            png = png_path.read_bytes()
+            os.utime(png_path)
+            os.utime(stats_path)
+            return png, stats["stats"]
+    except (OSError, ValueError):
+        pass
+
+    rgba, stats = change_tile(_decode_rgb(ta[0]), _decode_rgb(tb[0]), mode, threshold)
+    buf = io.BytesIO()
+    Image.fromarray(rgba, mode="RGBA").save(buf, format="PNG")
+    cache.mkdir(parents=True, exist_ok=True)
+    # PNG d'abord, stats (avec la clé) ensuite: une clé valide implique un PNG complet
+    meta = json.dumps({"key": key, "stats": stats}).encode("utf-8")
+    _write_atomic(png_path, buf.getvalue())
+    _write_atomic(stats_path, meta)
+    _account(root, len(buf.getvalue()) + len(meta))
+    return buf.getvalue(), stats
@@ -1,48 +1,185 @@
 from __future__ import annotations
+import time
+from typing import Callable, Sequence
 import numpy as np
 from PIL import Image
 from skimage.filters import laplace, gaussian
 from skimage.exposure import rescale_intensity
+from .raster import is_native_raster, is_windowed, open_raster, raster_size, read_resampled
 
-def to_gray(arr: np.ndarray) -> np.ndarray:
-    """Convertit RGB/RGBA → L (float32 0..1)."""
+# Paramètres de run_detector_on_image_path (repris dans les empreintes de l'orchestrateur)
+DETECTOR_PARAMS = {"sigma_low": 1.2, "sigma_high": 2.5, "alpha": 160}
+
+# Mémoire de travail (pic RSS net, mesuré) de run_detector_on_image_path: décodage
+# Pillow complet de la source ~8 o/pixel source, puis ~34 o/pixel du niveau (gris,
+# gaussiennes float64, score, RGBA). Le chemin par bandes ne garde que le score
+# float32 et la heatmap RGBA du niveau (+ copie d'encodage PNG); pour une source
+# flottante, le gris du niveau (4 o/pixel) ne coexiste qu'avec le score, sous ce plafond.
+DECODE_BYTES_PER_PX = 9
+DETECT_BYTES_PER_PX = 36
+TILED_BYTES_PER_PX = 10
+TILE_ROWS = 256
+
+# Hook de chronométrage optionnel: appelé avec (étape, secondes) à la fin de chaque étape
+StageHook = Callable[[str, float], None]
+
+def _lap(hook: StageHook | None, stage: str, t0: float) -> float:
+    """Signale la durée de `stage` (commencée à t0) et renvoie l'instant courant."""
+    t = time.perf_counter()
+    if hook is not None:
+        hook(stage, t - t0)
+    return t
+
+def _gray_units(arr: np.ndarray, bands: Sequence[int] | None = None) -> np.ndarray:
+    """Gris float32 dans les unités de la source (sans normalisation), cf. to_gray."""
     if arr.ndim == 3:
-        arr = arr[..., :3]
-        arr = 0.2126*arr[...,0] + 0.7152*arr[...,1] + 0.0722*arr[...,2]
-    arr = arr.astype(np.float32)
-    arr = (arr - arr.min()) / (np.ptp(arr) + 1e-8)
-    return arr
+        if bands is not None:
+            arr = arr[..., list(bands)]
+        elif arr.shape[-1] in (2, 4):
+            arr = arr[..., :-1]
+        arr = arr.astype(np.float32)
+        if arr.shape[-1] == 3:
+            arr = 0.2126*arr[...,0] + 0.7152*arr[...,1] + 0.0722*arr[...,2]
+        else:
+            arr = arr.mean(axis=-1)
+    return arr.astype(np.float32)
 
-def detect_loglike(gray_01: np.ndarray, sigma_low=1.2, sigma_high=2.5) -> np.ndarray:
-    """Anomalies par Difference of Gaussians + Laplacien (rapide, robuste)."""
-    g1 = gaussian(gray_01, sigma=sigma_low, preserve_range=True)
-    g2 = gaussian(gray_01, sigma=sigma_high, preserve_range=True)
+def to_gray(arr: np.ndarray, bands: Sequence[int] | None = None) -> np.ndarray:
+    """Convertit (H, W) ou (H, W, bandes) → L (float32 0..1).
+
+    Sans `bands`: RGB/RGBA → luminance (alpha ignoré), gris+alpha → gris, autres
+    nombres de bandes → moyenne. Avec `bands`: 3 bandes → luminance, sinon moyenne.
+    La normalisation min/max se fait sur la plage réelle (16 bits, flottants); NaN → 0.
+    """
+    arr = _gray_units(arr, bands)
+    lo, hi = np.nanmin(arr), np.nanmax(arr)
+    arr = (arr - lo) / (hi - lo + 1e-8)
+    return np.nan_to_num(arr, nan=0.0, copy=False)
+
+def raw_score(gray: np.ndarray, sigma_low=1.2, sigma_high=2.5, hook: StageHook | None = None) -> np.ndarray:
+    """Score DoG + Laplacien non normalisé (linéaire en gray, à normaliser ensuite)."""
+    t = time.perf_counter()
+    g1 = gaussian(gray, sigma=sigma_low, preserve_range=True)
+    g2 = gaussian(gray, sigma=sigma_high, preserve_range=True)
     dog = np.abs(g1 - g2)
-    lap = np.abs(laplace(gray_01, ksize=3))
-    score = 0.6*dog + 0.4*lap
+    t = _lap(hook, "gaussian", t)
+    lap = np.abs(laplace(gray, ksize=3))
+    _lap(hook, "laplacian", t)
+    return 0.6*dog + 0.4*lap
+
+def detect_loglike(gray_01: np.ndarray, sigma_low=1.2, sigma_high=2.5, hook: StageHook | None = None) -> np.ndarray:
+    """Anomalies par Difference of Gaussians + Laplacien (rapide, robuste)."""
+    score = raw_score(gray_01, sigma_low, sigma_high, hook)
+    t = time.perf_counter()
     score = rescale_intensity(score, out_range=(0, 1)).astype(np.float32)
+    _lap(hook, "normalize", t)
     return score
 
-def colorize_heatmap(score_01: np.ndarray, alpha: int = 160) -> Image.Image:
-    """Map simple: bleu→rouge (BGRA)."""
+def score_halo(sigma_high=2.5) -> int:
+    """Marge (lignes) nécessaire pour qu'un calcul par bandes égale le calcul global."""
+    return int(4.0*sigma_high + 0.5) + 1  # troncature gaussienne (4σ) + Laplacien 3×3
+
+def iter_raw_score_strips(strips, sigma_low=1.2, sigma_high=2.5, luminance=None, hook: StageHook | None = None):
+    """Score brut bande par bande (bandes RGB/RGBA uint8 successives), avec recouvrement.
+
+    Produit des bandes de score de mêmes hauteurs que l'entrée; la normalisation
+    min/max étant linéaire, elle peut être appliquée globalement à la fin.
+    `luminance` remplace la conversion des bandes en gris (défaut: RGB 8 bits → 0..1).
+    """
+    luminance = luminance or rgb_luminance
+    halo = score_halo(sigma_high)
+    ctx = None        # lignes de gris déjà vues, conservées pour le halo
+    pending = []      # hauteurs des bandes en attente de score
+    done = 0          # lignes de ctx déjà émises
+    for strip in strips:
+        g = luminance(strip)
+        ctx = g if ctx is None else np.concatenate([ctx, g])
+        pending.append(g.shape[0])
+        # émet les bandes dont le halo inférieur est disponible
+        while pending and done + pending[0] + halo <= ctx.shape[0]:
+            h = pending.pop(0)
+            lo = max(0, done - halo)
+            sc = raw_score(ctx[lo:done + h + halo], sigma_low, sigma_high, hook)
+            yield sc[done - lo:done - lo + h].astype(np.float32)
+            done += h
+            drop = max(0, done - halo)
+            ctx, done = ctx[drop:], done - drop
+    while pending:
+        h = pending.pop(0)
+        lo = max(0, done - halo)
+        sc = raw_score(ctx[lo:], sigma_low, sigma_high, hook)
+        yield sc[done - lo:done - lo + h].astype(np.float32)
+        done += h
+
+def rgb_luminance(arr: np.ndarray) -> np.ndarray:
+    """Luminance 0..1 (Rec. 709) d'un tableau RGB/RGBA uint8; gris: simple mise à l'échelle."""
+    if arr.ndim == 3:
+        arr = arr[..., :3].astype(np.float32)
+        return (0.2126*arr[...,0] + 0.7152*arr[...,1] + 0.0722*arr[...,2]) / 255.0
+    return arr.astype(np.float32) / 255.0
+
+def colorize_array(score_01: np.ndarray, alpha: int = 160) -> np.ndarray:
+    """Même palette que colorize_heatmap, en tableau RGBA uint8."""
     s = (score_01*255).astype(np.uint8)
     rgba = np.zeros((s.shape[0], s.shape[1], 4), dtype=np.uint8)
     rgba[...,0] = s            # R
     rgba[...,1] = 0            # G
     rgba[...,2] = 255 - s      # B
     rgba[...,3] = alpha        # A
-    return Image.fromarray(rgba, mode='RGBA')
-
-def run_detector_on_image_path(src_path: str, level_scale: float = 1.0) -> tuple[Image.Image, dict]:
-    """Charge image, redimensionne selon level_scale, calcule heatmap RGBA et stats."""
-    im = Image.open(src_path).convert("RGB")
-    if level_scale != 1.0:
-        w, h = im.size
-        im = im.resize((max(8, int(w/level_scale)), max(8, int(h/level_scale))))
-    arr = np.asarray(im)
-    gray = to_gray(arr)
-    score = detect_loglike(gray)
-    heat = colorize_heatmap(score, alpha=160)
+    return rgba
+
+def colorize_heatmap(score_01: np.ndarray, alpha: int = 160) -> Image.Image:
+    """Map simple: bleu→rouge (BGRA)."""
+    return Image.fromarray(colorize_array(score_01, alpha), mode='RGBA')
+
+def _load_for_detection(src_path: str, level_scale: float, bands: Sequence[int] | None,
+                        hook: StageHook | None = None) -> np.ndarray:
+    """Tableau source à l'échelle demandée.
+
+    Images 8 bits usuelles: chemin Pillow historique (RGB, BICUBIC). TIFF, 16 bits,
+    flottants ou sélection de bandes: lecteur raster, types natifs conservés et, hors
+    échelle 1, rééchantillonnage par fenêtres (mémoire bornée par le résultat); lecture
+    et rééchantillonnage étant entrelacés, ce chemin compte tout dans l'étape "decode".
+
+    Changement voulu pour ces sources (TIFF 8 bits compris): le filtre est la moyenne
+    boîte, pas le BICUBIC de Pillow. Elle conserve les moyennes radiométriques et se
+    calcule fenêtre par fenêtre sans halo; les stats du détecteur à échelle ≠ 1 diffèrent
+    donc légèrement de l'ancien chemin Pillow (voir test_raster).
+    """
+    t = time.perf_counter()
+    if bands is None and not is_native_raster(src_path):
+        im = Image.open(src_path).convert("RGB")
+        t = _lap(hook, "decode", t)
+        if level_scale != 1.0:
+            w, h = im.size
+            im = im.resize((max(8, int(w/level_scale)), max(8, int(h/level_scale))))
+            _lap(hook, "resize", t)
+        return np.asarray(im)
+    with open_raster(src_path) as reader:
+        if level_scale == 1.0:
+            arr = reader.read(0, 0, reader.width, reader.height, bands)
+        else:
+            size = (max(8, int(reader.width/level_scale)), max(8, int(reader.height/level_scale)))
+            arr = read_resampled(reader, size, bands)
+    _lap(hook, "decode", t)
+    return arr
+
+def run_detector_on_image_path(src_path: str, level_scale: float = 1.0, bands: Sequence[int] | None = None,
+                               hook: StageHook | None = None) -> tuple[Image.Image, dict]:
+    """Charge image, redimensionne selon level_scale, calcule heatmap RGBA et stats.
+
+    `bands` choisit les bandes d'une source multi-bandes (indices à partir de 0).
+    `hook(étape, secondes)` reçoit la durée de chaque étape: decode, resize, gray,
+    gaussian, laplacian, normalize, colorize.
+    """
+    arr = _load_for_detection(src_path, level_scale, bands, hook)
+    t = time.perf_counter()
+    gray = to_gray(arr, None if bands is None else range(arr.shape[-1]))
+    _lap(hook, "gray", t)
+    score = detect_loglike(gray, DETECTOR_PARAMS["sigma_low"], DETECTOR_PARAMS["sigma_high"], hook)
+    t = time.perf_counter()
+    heat = colorize_heatmap(score, alpha=DETECTOR_PARAMS["alpha"])
+    _lap(hook, "colorize", t)
     stats = {
         "min": float(score.min()),
         "max": float(score.max()),
@@ -53,3 +190,119 @@ def run_detector_on_image_path(src_path: str, level_scale: float = 1.0) -> tuple
         "scale": level_scale
     }
     return heat, stats
+
+def _level_size(width: int, height: int, level_scale: float) -> tuple[int, int]:
+    return max(8, int(width/level_scale)), max(8, int(height/level_scale))
+
+def estimate_detection_memory(src_path: str, level_scale: float = 1.0, tile_rows: int = TILE_ROWS) -> dict:
+    """Mémoire de travail prévue (Mo) d'une détection, d'après l'en-tête seul.
+
+    "full_mb": run_detector_on_image_path; "tiled_mb": run_detector_tiled. Le
+    décodage complet de la source compte pour les formats non fenêtrés.
+    """
+    w, h = raster_size(src_path)
+    lw, lh = _level_size(w, h, level_scale)
+    decode = 0 if is_windowed(src_path) else w * h * DECODE_BYTES_PER_PX
+    strip = min(lh, tile_rows + 2 * score_halo(DETECTOR_PARAMS["sigma_high"])) * lw * DETECT_BYTES_PER_PX
+    mb = 2 ** 20
+    return {"width": w, "height": h, "level_width": lw, "level_height": lh,
+            "full_mb": round(max(decode, lw * lh * DETECT_BYTES_PER_PX) / mb, 1),
+            "tiled_mb": round((decode + lw * lh * TILED_BYTES_PER_PX + strip) / mb, 1)}
+
+def run_detector_tiled(src_path: str, level_scale: float = 1.0, bands: Sequence[int] | None = None,
+                       hook: StageHook | None = None, tile_rows: int = TILE_ROWS) -> tuple[Image.Image, dict]:
+    """Comme run_detector_on_image_path, par bandes de `tile_rows` lignes du niveau.
+
+    Seuls le score float32 et la heatmap RGBA du niveau sont gardés entiers; gris et
+    gaussiennes sont calculés par bandes avec halo (iter_raw_score_strips). La
+    normalisation min/max du gris s'annulant dans celle du score, le résultat est le
+    même (à l'arrondi près) que le calcul global.
+    """
+    if bands is None and not is_native_raster(src_path):
+        reader = None  # chemin historique: source décodée en RGB, rééchantillonnée par Pillow
+        src = Image.open(src_path).convert("RGB")
+        width, height = src.size
+    else:
+        reader = open_raster(src_path)
+        width, height = reader.width, reader.height
+    try:
+        lw, lh = _level_size(width, height, level_scale)
+        sel = None if reader is None else list(range(reader.bands)) if bands is None else list(bands)
+        gray_bands = None if bands is None else range(len(sel))
+        ry = height / lh
+
+        def read(y0: int, y1: int) -> np.ndarray:
+            box = (0.0, y0 * ry, float(width), y1 * ry)
+            if reader is None:
+                # resize fenêtré: même filtre et mêmes pixels de support que Image.resize global
+                return np.asarray(src.crop((0, y0, lw, y1)) if (lw, lh) == (width, height)
+                                  else src.resize((lw, y1 - y0), box=box))
+            if (lw, lh) == (width, height):
+                return reader.read(0, y0, lw, y1 - y0, sel)
+            return read_resampled(reader, (lw, y1 - y0), sel, box=box)
+
+        def gray_strips():
+            for y0 in range(0, lh, tile_rows):
+                t = time.perf_counter()
+                win = read(y0, min(lh, y0 + tile_rows))
+                t = _lap(hook, "decode", t)
+                g = _gray_units(win, gray_bands)
+                _lap(hook, "gray", t)
+                yield g
+
+        strips = gray_strips()
+        gray = None
+        if reader is not None and reader.dtype.kind == "f":
+            # NaN → minimum du gris (comme to_gray), connu seulement en fin de lecture: le gris
+            # du niveau est gardé (4 o/px, libéré avant la heatmap) pendant l'unique passe de
+            # décodage, puis les NaN sont remplis bande par bande au moment du score.
+            gray = np.empty((lh, lw), dtype=np.float32)
+            fill = np.inf
+            for y0, g in zip(range(0, lh, tile_rows), strips):
+                gray[y0:y0 + g.shape[0]] = g
+                if not np.isnan(g).all():
+                    fill = min(fill, float(np.nanmin(g)))
+            fill = fill if np.isfinite(fill) else 0.0
+            strips = (np.nan_to_num(gray[y0:y0 + tile_rows], nan=fill) for y0 in range(0, lh, tile_rows))
+
+        score = np.empty((lh, lw), dtype=np.float32)
+        y = 0
+        for sc in iter_raw_score_strips(strips, DETECTOR_PARAMS["sigma_low"], DETECTOR_PARAMS["sigma_high"],
+                                        luminance=lambda g: g, hook=hook):
+            score[y:y + sc.shape[0]] = sc
+            y += sc.shape[0]
+        gray = strips = None
+    finally:
+        if reader is not None:
+            reader.close()
+
+    t = time.perf_counter()
+    lo, hi = float(score.min()), float(score.max())
+    total = total_sq = 0.0
+    for y0 in range(0, lh, tile_rows):
+        band = score[y0:y0 + tile_rows]
+        if hi > lo:
+            band -= lo
+            band /= hi - lo
+        else:  # score constant: même convention que rescale_intensity
+            np.clip(band, 0.0, 1.0, out=band)
+        total += float(band.sum(dtype=np.float64))
+        total_sq += float(np.square(band, dtype=np.float64).sum())
+    t = _lap(hook, "normalize", t)
+    rgba = np.empty((lh, lw, 4), dtype=np.uint8)
+    for y0 in range(0, lh, tile_rows):
+        rgba[y0:y0 + tile_rows] = colorize_array(score[y0:y0 + tile_rows], DETECTOR_PARAMS["alpha"])
+    heat = Image.fromarray(rgba, mode="RGBA")
+    _lap(hook, "colorize", t)
+    n = lw * lh
+    mean = total / n
+    stats = {
+        "min": float(score.min()),
+        "max": float(score.max()),
+        "mean": mean,
+        "std": float(np.sqrt(max(0.0, total_sq / n - mean * mean))),
+        "width": lw,
+        "height": lh,
+        "scale": level_scale
+    }
+    return heat, stats
@@ -0,0 +1,249 @@
+from __future__ import annotations
+import argparse, io, json, os, platform, shutil, socket, statistics, sys, tempfile, time, tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+import numpy as np
+from PIL import Image
+
+from .detect import (DETECT_BYTES_PER_PX, DETECTOR_PARAMS, colorize_heatmap, detect_loglike,
+                     run_detector_on_image_path, to_gray)
+from .levels import code_version
+from .orchestrator import memory_info_mb
+
+# Banc d'essai du détecteur: étapes isolées (micro) et chaîne complète depuis un fichier
+# (macro), débit en Mpx/s et pic mémoire net. Les résultats servent de référence JSON;
+# une comparaison à une référence échoue au-delà d'un seuil de régression.
+# Le pic mémoire est celui des allocations (tracemalloc, exécution séparée non chronométrée):
+# reproductible d'une exécution à l'autre, contrairement au RSS; les tampons internes
+# de Pillow (décodage/encodage) n'y figurent pas.
+
+DEFAULT_SIZES = (512, 1024, 2048, 4096, 8192, 16384)
+DEFAULT_LEVELS = (0, 1, 2)
+MICRO_STAGES = ("to_gray", "detect_loglike", "colorize_heatmap", "png_encode")
+
+def make_scene(size: int, seed: int = 0) -> np.ndarray:
+    """Scène RGB uint8 déterministe (structures + bruit), construite par bandes."""
+    rng = np.random.default_rng(seed)
+    out = np.empty((size, size, 3), dtype=np.uint8)
+    x = np.arange(size, dtype=np.float32)
+    for y0 in range(0, size, 1024):
+        y = np.arange(y0, min(size, y0 + 1024), dtype=np.float32)[:, None]
+        base = np.sin(x / 23.0) * np.cos(y / 17.0) * 80 + 128 + rng.normal(0, 12, (y.shape[0], size))
+        out[y0:y0 + y.shape[0]] = np.clip(np.stack([base, base * 0.8, 255 - base], -1), 0, 255)
+    return out
+
+def _available_mb() -> float | None:
+    """Mémoire disponible (Mo): psutil si installé, sinon MemAvailable de /proc/meminfo,
+    sinon pages physiques libres (sysconf); None si rien n'est lisible."""
+    try:
+        import psutil  # type: ignore
+    except Exception:
+        psutil = None
+    if psutil is not None:
+        return psutil.virtual_memory().available / 2 ** 20
+    try:
+        with open("/proc/meminfo", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (AttributeError, OSError, ValueError):
+        return None
+
+MIN_TIME_S = 0.5   # mesures courtes répétées jusqu'à cette durée cumulée (meilleur temps retenu)
+MAX_REPS = 50
+
+def _measure(fn: Callable[[], Any], reps: int, min_time: float = MIN_TIME_S) -> Tuple[List[float], float]:
+    """Durées d'au moins `reps` exécutions (davantage jusqu'à `min_time` s cumulées) et pic
+    des allocations (Mo) d'une exécution de plus."""
+    times: List[float] = []
+    while len(times) < reps or (sum(times) < min_time and len(times) < MAX_REPS):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    try:
+        fn()
+        peak = (tracemalloc.get_traced_memory()[1] - base) / 2 ** 20
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    return times, peak
+
+def _row(times: List[float], peak: float, mpx: float) -> Dict[str, Any]:
+    best = min(times)
+    return {"seconds": round(best, 5), "median_s": round(statistics.median(times), 5), "reps": len(times),
+            "mpx": round(mpx, 4), "mpx_per_s": round(mpx / best, 3) if best > 0 else None,
+            "peak_mb": round(peak, 1)}
+
+def _reps_for(size: int, reps: int) -> int:
+    return reps if size <= 2048 else 1
+
+def run_benchmarks(sizes: Sequence[int] = DEFAULT_SIZES, levels: Sequence[int] = DEFAULT_LEVELS, reps: int = 3,
+                   workdir=None, log: Callable[[str], None] | None = None,
+                   min_time: float = MIN_TIME_S, only: Iterable[str] | None = None) -> Dict[str, Any]:
+    """Mesures micro (étapes sur un tableau en mémoire) et macro (run_detector_on_image_path
+    sur un PNG, par niveau). Les tailles dont la détection ne tiendrait pas dans la
+    mémoire disponible sont sautées (consigné dans "skipped"). `only`: limite aux clés
+    données ("detect_loglike@2048", "run_detector@4096/L1"…)."""
+    only = None if only is None else set(only)
+    wanted = lambda key: only is None or key in only
+    results: Dict[str, Dict[str, Any]] = {}
+    skipped: Dict[str, str] = {}
+    own_dir = workdir is None
+    root = Path(tempfile.mkdtemp(prefix="detect-bench-")) if own_dir else Path(workdir)
+    avail = _available_mb()
+    try:
+        for size in sizes:
+            if only is not None and not any(k.split("@")[1].split("/")[0] == str(size) for k in only):
+                continue
+            need_mb = size * size * DETECT_BYTES_PER_PX / 2 ** 20
+            if avail is not None and need_mb > 0.8 * avail:
+                skipped[str(size)] = f"mémoire insuffisante ({need_mb:.0f} Mo prévus, {avail:.0f} Mo disponibles)"
+                continue
+            n = _reps_for(size, reps)
+            mpx = size * size / 1e6
+            arr = make_scene(size)
+            gray = to_gray(arr)
+            score = detect_loglike(gray, DETECTOR_PARAMS["sigma_low"], DETECTOR_PARAMS["sigma_high"])
+            heat = colorize_heatmap(score, DETECTOR_PARAMS["alpha"])
+            stages = {
+                "to_gray": lambda: to_gray(arr),
+                "detect_loglike": lambda: detect_loglike(gray, DETECTOR_PARAMS["sigma_low"], DETECTOR_PARAMS["sigma_high"]),
+                "colorize_heatmap": lambda: colorize_heatmap(score, DETECTOR_PARAMS["alpha"]),
+                "png_encode": lambda: heat.save(io.BytesIO(), format="PNG"),
+            }
+            for name in MICRO_STAGES:
+                if not wanted(f"{name}@{size}"):
+                    continue
+                results[f"{name}@{size}"] = _row(*_measure(stages[name], n, min_time), mpx)
+                if log:
+                    log(f"{name}@{size}: {results[f'{name}@{size}']['mpx_per_s']} Mpx/s")
+            del gray, score, heat
+            macro = [lv for lv in levels if wanted(f"run_detector@{size}/L{lv}")]
+            if not macro:
+                continue
+            src = root / f"scene_{size}.png"
+            Image.fromarray(arr).save(src, compress_level=1)
+            del arr
+            for lv in macro:
+                scale = float(2 ** lv)
+                key = f"run_detector@{size}/L{lv}"
+                # débit exprimé en Mpx source: c'est ce que coûte une entrée de manifeste
+                results[key] = _row(*_measure(lambda: run_detector_on_image_path(str(src), level_scale=scale), n, min_time), mpx)
+                if log:
+                    log(f"{key}: {results[key]['mpx_per_s']} Mpx/s")
+            src.unlink()
+    finally:
+        if own_dir:
+            shutil.rmtree(root, ignore_errors=True)
+    return {"meta": machine_info(), "results": results, "skipped": skipped}
+
+def machine_info() -> Dict[str, Any]:
+    import skimage
+    return {"host": socket.gethostname(), "platform": platform.platform(), "python": platform.python_version(),
+            "numpy": np.__version__, "skimage": skimage.__version__, "cpus": os.cpu_count(),
+            "code": code_version(), "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "rss_mb": None if memory_info_mb() is None else round(memory_info_mb(), 1)}
+
+def compare_to_baseline(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.15,
+                        mem_threshold: float | None = None) -> List[Dict[str, Any]]:
+    """Régressions: débit inférieur de plus de `threshold` (fraction) ou pic mémoire
+    supérieur de plus de `mem_threshold` (défaut: `threshold`) à la référence.
+    Seules les mesures présentes des deux côtés sont comparées."""
+    mem_threshold = threshold if mem_threshold is None else mem_threshold
+    out: List[Dict[str, Any]] = []
+    for key, cur in current["results"].items():
+        ref = baseline.get("results", {}).get(key)
+        if ref is None:
+            continue
+        if ref.get("mpx_per_s") and cur.get("mpx_per_s") is not None:
+            change = cur["mpx_per_s"] / ref["mpx_per_s"] - 1
+            if change < -threshold:
+                out.append({"key": key, "metric": "mpx_per_s", "baseline": ref["mpx_per_s"],
+                            "current": cur["mpx_per_s"], "change": round(change, 3)})
+        # pics sous 1 Mo: bruit de mesure
+        if ref.get("peak_mb") and ref["peak_mb"] >= 1 and cur.get("peak_mb") is not None:
+            change = cur["peak_mb"] / ref["peak_mb"] - 1
+            if change > mem_threshold:
+                out.append({"key": key, "metric": "peak_mb", "baseline": ref["peak_mb"],
+                            "current": cur["peak_mb"], "change": round(change, 3)})
+    return out
+
+def format_table(report: Dict[str, Any], baseline: Dict[str, Any] | None = None) -> str:
+    head = f"{'mesure':<30}{'s':>10}{'Mpx/s':>10}{'pic Mo':>9}" + (f"{'réf Mpx/s':>11}{'Δ':>8}" if baseline else "")
+    lines = [head, "-" * len(head)]
+    for key, r in report["results"].items():
+        line = f"{key:<30}{r['seconds']:>10.4f}{r['mpx_per_s'] or 0:>10.2f}{r['peak_mb'] if r['peak_mb'] is not None else '-':>9}"
+        ref = (baseline or {}).get("results", {}).get(key)
+        if baseline:
+            line += (f"{ref['mpx_per_s']:>11.2f}{(r['mpx_per_s'] / ref['mpx_per_s'] - 1) * 100:>+7.1f}%"
+                     if ref and ref.get("mpx_per_s") and r.get("mpx_per_s") else f"{'-':>11}{'':>8}")
+        lines.append(line)
+    for size, why in report.get("skipped", {}).items():
+        lines.append(f"{size}² sauté: {why}")
+    return "\n".join(lines)
+
+def _ints(text: str) -> List[int]:
+    return [int(x) for x in text.split(",") if x.strip()]
+
+def main(argv: Iterable[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Banc d'essai du détecteur (micro + macro) avec références JSON.")
+    ap.add_argument("--sizes", type=str, default=",".join(map(str, DEFAULT_SIZES)), help="Côtés des scènes (px).")
+    ap.add_argument("--levels", type=str, default=",".join(map(str, DEFAULT_LEVELS)),
+                    help="Niveaux de la chaîne complète (échelle 2**niveau).")
+    ap.add_argument("--reps", type=int, default=3, help="Répétitions par mesure (1 au-delà de 2048²).")
+    ap.add_argument("--save-baseline", type=str, default=None, metavar="JSON", help="Enregistre les résultats comme référence.")
+    ap.add_argument("--baseline", type=str, default=None, metavar="JSON", help="Compare à une référence.")
+    ap.add_argument("--threshold", type=float, default=0.15, help="Perte de débit tolérée (fraction, défaut 0.15).")
+    ap.add_argument("--mem-threshold", type=float, default=None, help="Hausse de pic mémoire tolérée (défaut: --threshold).")
+    ap.add_argument("--confirm", type=int, default=2,
+                    help="Nouvelles mesures des seules régressions suspectes avant d'échouer (meilleur résultat gardé).")
+    ap.add_argument("--json", action="store_true", help="Sortie JSON au lieu du tableau.")
+    args = ap.parse_args(list(argv) if argv is not None else None)
+
+    baseline = None
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+    report = run_benchmarks(_ints(args.sizes), _ints(args.levels), args.reps,
+                            log=None if args.json else lambda m: print(m, file=sys.stderr))
+    regressions: List[Dict[str, Any]] = []
+    if baseline is not None:
+        regressions = compare_to_baseline(report, baseline, args.threshold, args.mem_threshold)
+        for _ in range(args.confirm):
+            if not regressions:
+                break
+            # une machine chargée ralentit toute une passe: on ne conclut qu'après re-mesure
+            again = run_benchmarks(_ints(args.sizes), _ints(args.levels), args.reps,
+                                   only={r["key"] for r in regressions})
+            for key, row in again["results"].items():
+                best = report["results"][key]
+                report["results"][key] = dict(row if (row["mpx_per_s"] or 0) > (best["mpx_per_s"] or 0) else best,
+                                              peak_mb=min(row["peak_mb"], best["peak_mb"]))
+            regressions = compare_to_baseline(report, baseline, args.threshold, args.mem_threshold)
+        report["regressions"] = regressions
+        if baseline.get("meta", {}).get("host") != report["meta"]["host"]:
+            print("⚠️  référence mesurée sur une autre machine: comparaison indicative", file=sys.stderr)
+    print(json.dumps(report, indent=2, ensure_ascii=False) if args.json else format_table(report, baseline))
+    if args.save_baseline:
+        path = Path(args.save_baseline)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps({k: report[k] for k in ("meta", "results", "skipped")}, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+    if regressions:
+        for r in regressions:
+            print(f"❌ régression {r['key']} {r['metric']}: {r['baseline']} → {r['current']} ({r['change']:+.1%})",
+                  file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+from __future__ import annotations
+import threading, time, traceback, uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import Any, Callable, Dict, Iterator
+
+# Exécution en arrière-plan des générations de tuiles (registre en mémoire du processus)
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tiles")
+_jobs: Dict[str, "BackgroundJob"] = {}
+_active: Dict[str, "BackgroundJob"] = {}  # clé (ex. pyramide de sortie) → tâche en cours
+_lock = threading.Lock()
+JOB_TTL_S = 3600     # tâches terminées conservées pour consultation du statut
+MAX_JOBS = 1000
+
+@dataclass
+class BackgroundJob:
+    job_id: str
+    kind: str
+    key: str | None = None
+    status: str = "queued"  # queued | running | done | error
+    progress: Dict[str, Any] = field(default_factory=dict)
+    result: Dict[str, Any] | None = None
+    error: str | None = None
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+
+    def update_progress(self, p: Dict[str, Any]) -> None:
+        """Met à jour les compteurs et estime l'ETA au débit moyen observé."""
+        p = dict(p)
+        done, total = p.get("tiles_written", 0), p.get("tiles_total", 0)
+        elapsed = time.time() - (self.started_at or time.time())
+        p["eta_s"] = round(elapsed / done * (total - done), 2) if done and total else None
+        self.progress = p  # remplacement atomique, lu par l'endpoint de statut
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+def _evict(now: float) -> None:
+    """Oublie les tâches terminées depuis plus de JOB_TTL_S, puis les plus anciennes au-delà de MAX_JOBS."""
+    finished = sorted((j for j in _jobs.values() if j.finished_at is not None), key=lambda j: j.finished_at)
+    excess = len(_jobs) - MAX_JOBS
+    for j in finished:
+        if now - j.finished_at > JOB_TTL_S or excess > 0:
+            del _jobs[j.job_id]
+            excess -= 1
+
+class JobBusy(Exception):
+    """Une tâche est déjà active sur la clé demandée (attribut `job`)."""
+
+    def __init__(self, job: BackgroundJob):
+        super().__init__(f"Tâche {job.kind} en cours ({job.job_id})")
+        self.job = job
+
+def _register(kind: str, key: str | None) -> tuple[BackgroundJob, bool]:
+    """(tâche, créée?): la tâche active sur `key` si elle existe, sinon une nouvelle tâche."""
+    with _lock:
+        if key is not None and key in _active:
+            return _active[key], False
+        _evict(time.time())
+        job = BackgroundJob(job_id=uuid.uuid4().hex, kind=kind, key=key)
+        _jobs[job.job_id] = job
+        if key is not None:
+            _active[key] = job
+        return job, True
+
+def _finish(job: BackgroundJob, status: str, result: Dict[str, Any] | None, error: str | None) -> None:
+    with _lock:
+        # statut terminal et libération de la clé visibles ensemble
+        job.result, job.error, job.finished_at = result, error, time.time()
+        job.status = status
+        if job.key is not None and _active.get(job.key) is job:
+            del _active[job.key]
+
+def submit(kind: str, fn: Callable[..., Dict[str, Any]], key: str | None = None, **kwargs) -> BackgroundJob:
+    """Lance fn(**kwargs, progress=...) en arrière-plan et renvoie le job aussitôt.
+
+    Avec `key` (ex. nom de base de la pyramide), une tâche encore en file ou en cours sur
+    la même clé est renvoyée telle quelle au lieu d'en lancer une concurrente.
+    """
+    job, created = _register(kind, key)
+    if not created:
+        return job
+
+    def run() -> None:
+        job.status, job.started_at = "running", time.time()
+        status, result, error = "done", None, None
+        try:
+            result = fn(**kwargs, progress=job.update_progress)
+        except Exception as e:
+            status, error = "error", "".join(traceback.format_exception_only(type(e), e)).strip()
+        _finish(job, status, result, error)
+
+    _executor.submit(run)
+    return job
+
+@contextmanager
+def exclusive(kind: str, key: str) -> Iterator[BackgroundJob]:
+    """Exécution synchrone réservant `key` comme submit: lève JobBusy si une tâche
+    (en arrière-plan ou synchrone) est déjà active sur cette clé."""
+    job, created = _register(kind, key)
+    if not created:
+        raise JobBusy(job)
+    job.status, job.started_at = "running", time.time()
+    try:
+        yield job
+    except BaseException as e:
+        _finish(job, "error", None, "".join(traceback.format_exception_only(type(e), e)).strip())
+        raise
+    _finish(job, "done", None, None)
+
+def get_job(job_id: str) -> BackgroundJob | None:
+    with _lock:
+        return _jobs.get(job_id)
@@ -0,0 +1,231 @@
+from __future__ import annotations
+import json, os, shutil, threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple
+import numpy as np
+from PIL import Image
+
+from .pyramides import (box_reduce_levels, level_grid, level_size, max_level, pil_save_args, pyramid_is_current,
+                        save_tile, source_fingerprint, split_suffix, tile_window, vips_shrink_levels, write_dzi)
+from .raster import display_params, is_native_raster, open_raster, raster_size, read_resampled, to_display
+
+# Pyramide « paresseuse »: le .dzi et les niveaux grossiers sont écrits tout de suite,
+# les tuiles profondes sont rendues depuis la source à la première demande puis
+# conservées dans <base>_files/ (servies ensuite comme n'importe quelle tuile statique).
+LAZY_META = "lazy.json"
+EAGER_SIZE = 1024  # niveaux dont le plus grand côté tient dans EAGER_SIZE px: générés d'emblée
+SOURCE_CACHE_BYTES = 512 * 2 ** 20
+# Source PNG/JPEG décodée plus grosse que SOURCE_CACHE_BYTES: convertie une fois en
+# tableau brut (.npy, lu par memmap) dans <base>_files/, caché aux fichiers statiques
+INTERMEDIATE = ".source.npy"
+WINDOW_BYTES = 64 * 2 ** 20  # lignes source lues à la fois pour une grande fenêtre
+
+_sources: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+_sources_bytes = 0
+_inflight: Dict[str, list] = {}  # clé → [verrou, nombre de demandeurs]
+_lock = threading.Lock()
+
+def _single_flight(key: str, fn: Callable[[], Any]) -> Any:
+    """Un seul rendu par clé à la fois: les requêtes concurrentes attendent le premier."""
+    with _lock:
+        entry = _inflight.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            return fn()
+    finally:
+        with _lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _inflight[key]
+
+def _decoded_source(input_path) -> np.ndarray:
+    """Source PNG/JPEG décodée entière (Pillow n'a pas de lecture fenêtrée pour ces formats).
+
+    Gardée en cache LRU tant qu'elle tient dans SOURCE_CACHE_BYTES. Les sources plus
+    grosses passent par INTERMEDIATE; ne restent ici que les pyramides préparées avant
+    lui, servies requête par requête sans être épinglées au-delà du budget.
+    """
+    st = os.stat(input_path)
+    key = (str(Path(input_path).resolve()), st.st_mtime_ns, st.st_size)
+
+    def load() -> np.ndarray:
+        global _sources_bytes
+        with _lock:
+            if key in _sources:
+                _sources.move_to_end(key)
+                return _sources[key]
+        with Image.open(input_path) as im:
+            arr = np.asarray(im.convert("RGBA" if "A" in im.getbands() else "RGB"))
+        if arr.nbytes <= SOURCE_CACHE_BYTES:
+            with _lock:
+                _sources[key] = arr
+                _sources_bytes += arr.nbytes
+                while _sources_bytes > SOURCE_CACHE_BYTES:
+                    _, old = _sources.popitem(last=False)
+                    _sources_bytes -= old.nbytes
+        return arr
+
+    return _single_flight(f"source:{key}", load)
+
+def _write_intermediate(input_path, path: Path) -> None:
+    """Décode la source une fois dans un .npy lisible par fenêtres (memmap); conversion
+    de mode par bandes pour ne pas doubler le pic mémoire."""
+    with Image.open(input_path) as im:
+        mode = "RGBA" if "A" in im.getbands() else "RGB"
+        w, h = im.size
+        tmp = path.with_name(path.name + ".part")
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.uint8, shape=(h, w, len(mode)))
+        step = max(1, WINDOW_BYTES // (w * len(mode)))
+        for y0 in range(0, h, step):
+            out[y0:y0 + step] = np.asarray(im.crop((0, y0, w, min(h, y0 + step))).convert(mode))
+        out.flush()
+        del out
+    os.replace(tmp, path)
+
+def _reduce_window(src: np.ndarray, left: int, top: int, cw: int, ch: int, k: int) -> np.ndarray:
+    """box_reduce_levels d'une fenêtre source, par paquets de lignes alignés sur 2**k
+    (mêmes pixels qu'en une fois; mémoire bornée pour une source memmap)."""
+    f = 2 ** k
+    step = f * max(1, WINDOW_BYTES // (f * cw * src.shape[2] * 2))
+    parts = [box_reduce_levels(src[y:min(top + ch, y + step), left:left + cw], k)
+             for y in range(top, top + ch, step)]
+    return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+def _read_level_window(input_path, width: int, height: int, level: int,
+                       window: Tuple[int, int, int, int], display: dict | None = None,
+                       intermediate: Path | None = None) -> np.ndarray:
+    """Fenêtre (x, y, w, h) du niveau `level`, rendue depuis la source.
+
+    `display` (cf. raster.display_params): source lue par le lecteur raster, seuls les
+    segments TIFF couvrant la fenêtre sont décodés puis étirés en 8 bits. Sinon, comme
+    les moteurs de pyramides: fenêtre source alignée sur 2**k puis k réductions 2×2,
+    lue dans `intermediate` (memmap) s'il existe.
+    """
+    lw, lh = level_size(width, height, level)
+    x, y, tw, th = window
+    if display is not None:
+        rx, ry = width / lw, height / lh
+        with open_raster(input_path) as reader:
+            region = read_resampled(reader, (tw, th), display["bands"],
+                                    box=(x * rx, y * ry, (x + tw) * rx, (y + th) * ry))
+        return to_display(region, display["ranges"])
+    k = max_level(width, height) - level
+    f = 2 ** k
+    left, top = x * f, y * f
+    cw, ch = min(width, (x + tw) * f) - left, min(height, (y + th) * f) - top
+    if intermediate is not None:
+        return _reduce_window(np.load(intermediate, mmap_mode="r"), left, top, cw, ch, k)[:th, :tw]
+    try:
+        import pyvips  # type: ignore
+    except Exception:
+        pyvips = None
+    if pyvips is not None:
+        # lecture réellement fenêtrée (TIFF tuilé, JPEG avec shrink-on-load), réductions 2×2
+        # moyennes comme dzsave, bords impairs répliqués comme le moteur NumPy
+        region = pyvips.Image.new_from_file(str(input_path), access="random").crop(left, top, cw, ch)
+        if region.bands < 3:
+            region = region.colourspace("srgb")
+        region = vips_shrink_levels(region, k)
+        return np.ndarray(buffer=region.write_to_memory(), dtype=np.uint8,
+                          shape=(region.height, region.width, region.bands))[:th, :tw]
+    return _reduce_window(_decoded_source(input_path), left, top, cw, ch, k)[:th, :tw]
+
+def _write_tile(tile: np.ndarray, final: Path, fmt: str, kwargs: dict) -> None:
+    final.parent.mkdir(parents=True, exist_ok=True)
+    tmp = final.with_name(f".{final.stem}.part{final.suffix}")
+    save_tile(tile, tmp, fmt, kwargs)
+    os.replace(tmp, final)
+
+def _load_meta(files_dir: Path) -> Dict[str, Any] | None:
+    try:
+        return json.loads((files_dir / LAZY_META).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+def prepare_lazy_pyramid(input_path, output_basename, tile_size: int = 256, overlap: int = 0, suffix: str = ".jpg",
+                         eager_size: int = EAGER_SIZE) -> dict:
+    """Écrit le .dzi et les niveaux grossiers; les niveaux profonds seront rendus à la demande.
+
+    Une pyramide complète et à jour est laissée telle quelle. Si la source ou les
+    paramètres ont changé, les tuiles déjà rendues sont supprimées. Une source PNG/JPEG
+    dont le décodage dépasse SOURCE_CACHE_BYTES est convertie une fois en tableau brut
+    (INTERMEDIATE, ~3-4 o/pixel sur disque): chaque tuile n'en lit que sa fenêtre.
+    """
+    if pyramid_is_current(input_path, output_basename, tile_size, overlap, suffix):
+        return {"up_to_date": True, "eager_levels": [], "tiles_written": 0}
+    files_dir = Path(f"{output_basename}_files")
+    src = source_fingerprint(input_path)
+    params = {"tile_size": tile_size, "overlap": overlap, "suffix": suffix}
+    w, h = raster_size(input_path)  # en-tête seulement
+    top = max_level(w, h)
+    eager = [lv for lv in range(top + 1) if max(level_size(w, h, lv)) <= eager_size] or [0]
+    meta = {"source": src, "params": params, "width": w, "height": h, "eager_levels": len(eager)}
+    old = _load_meta(files_dir)
+    if old is not None and {k: old.get(k) for k in meta} == meta:
+        return {"up_to_date": True, "eager_levels": [], "tiles_written": 0}
+    if files_dir.exists():
+        shutil.rmtree(files_dir)
+    display = display_params(input_path) if is_native_raster(input_path) else None
+    intermediate = None
+    if display is None and w * h * 4 > SOURCE_CACHE_BYTES:  # 4 bandes au pire
+        files_dir.mkdir(parents=True, exist_ok=True)
+        intermediate = files_dir / INTERMEDIATE
+        _write_intermediate(input_path, intermediate)
+
+    ext, opts = split_suffix(suffix)
+    fmt, kwargs = pil_save_args(ext, opts)
+    written = 0
+    arr = _read_level_window(input_path, w, h, eager[-1], (0, 0, *level_size(w, h, eager[-1])), display,
+                             intermediate)
+    for lv in reversed(eager):
+        lw, lh = level_size(w, h, lv)
+        if lv != eager[-1]:
+            arr = box_reduce_levels(arr, 1)
+        cols, rows = level_grid(w, h, lv, tile_size)
+        for r in range(rows):
+            for c in range(cols):
+                x, y, tw, th = tile_window(lw, lh, tile_size, overlap, c, r)
+                _write_tile(arr[y:y + th, x:x + tw], files_dir / str(lv) / f"{c}_{r}{ext}", fmt, kwargs)
+                written += 1
+    # méta écrite en dernier: sa présence garantit que les niveaux grossiers sont complets
+    tmp = files_dir / (LAZY_META + ".tmp")
+    tmp.write_text(json.dumps(dict(meta, display=display, intermediate=intermediate is not None), indent=2),
+                   encoding="utf-8")
+    os.replace(tmp, files_dir / LAZY_META)
+    write_dzi(output_basename, w, h, tile_size, overlap, ext.lstrip('.'))
+    return {"up_to_date": False, "eager_levels": eager, "tiles_written": written}
+
+def lazy_tile(output_basename, level: int, col: int, row: int) -> Path | None:
+    """Chemin de la tuile, rendue et mise en cache disque si absente; None si hors grille.
+
+    Lève ValueError si la source a changé depuis prepare_lazy_pyramid.
+    """
+    files_dir = Path(f"{output_basename}_files")
+    meta = _load_meta(files_dir)
+    if meta is None:
+        return None
+    ext, opts = split_suffix(meta["params"]["suffix"])
+    final = files_dir / str(level) / f"{col}_{row}{ext}"
+    if final.exists():
+        return final
+    w, h, ts = meta["width"], meta["height"], meta["params"]["tile_size"]
+    cols, rows = level_grid(w, h, level, ts) if 0 <= level <= max_level(w, h) else (0, 0)
+    if not (0 <= col < cols and 0 <= row < rows):
+        return None
+    input_path = meta["source"]["path"]
+    if source_fingerprint(input_path) != meta["source"]:
+        raise ValueError("Source modifiée depuis la préparation de la pyramide")
+
+    def render() -> Path:
+        if final.exists():  # rendue entre-temps par une requête concurrente
+            return final
+        lw, lh = level_size(w, h, level)
+        window = tile_window(lw, lh, ts, meta["params"]["overlap"], col, row)
+        tile = _read_level_window(input_path, w, h, level, window, meta.get("display"),
+                                  files_dir / INTERMEDIATE if meta.get("intermediate") else None)
+        _write_tile(tile, final, *pil_save_args(ext, opts))
+        return final
+
+    return _single_flight(str(final), render)
@@ -0,0 +1,82 @@
+from __future__ import annotations
+import hashlib, json, os
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import List
+
+from .detect import DETECTOR_PARAMS, estimate_detection_memory
+
+# Niveaux d'un job (échelle, empreinte, sortie à jour, mémoire prévue): partagé par
+# l'orchestrateur, qui exécute, et le planificateur, qui prévoit.
+
+@dataclass
+class Job:
+    image_id: str
+    source: Path
+    levels: List[int]
+    base_scale: float | None  # si connu (ex: niveau max DZI → 2**n)
+    save_png: bool
+
+def estimate_level_scale(level: int, ref_level: int | None) -> float:
+    """
+    Renvoie un facteur 'scale' pour simuler la résolution d’un niveau.
+    Si ref_level est fourni, on prend scale = 2**(ref_level - level).
+    Par défaut, scale = 2**level (niveau 0 = pleine résolution, 1 = /2, etc.).
+    """
+    if ref_level is not None:
+        return float(2 ** (ref_level - level))
+    return float(2 ** level)
+
+@lru_cache(maxsize=1)
+def code_version() -> str:
+    """Empreinte du code de détection (detect.py + raster.py): toute modification invalide les sorties."""
+    h = hashlib.blake2b(digest_size=8)
+    for name in ("detect.py", "raster.py"):
+        h.update((Path(__file__).parent / name).read_bytes())
+    return h.hexdigest()
+
+@lru_cache(maxsize=256)
+def _content_hash(path: str, size: int, mtime_ns: int) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def level_fingerprint(job: Job, lv: int, scale: float, checksum: bool = False) -> dict:
+    """Empreinte d'une sortie de niveau: source (taille+mtime, ou contenu), paramètres, version du code."""
+    st = os.stat(job.source)
+    source = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if checksum:
+        source = {"blake2b": _content_hash(str(job.source), st.st_size, st.st_mtime_ns)}
+    return {"source": source, "level": lv, "scale": scale, "png": job.save_png,
+            "params": DETECTOR_PARAMS, "code": code_version()}
+
+def current_output(job: Job, lv: int, outdir: Path, fingerprint: dict) -> dict | None:
+    """Contenu du JSON de niveau s'il a été produit avec la même empreinte (et le PNG présent)."""
+    try:
+        data = json.loads((outdir / f"{job.image_id}_L{lv}.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if data.get("fingerprint") != fingerprint:
+        return None
+    if job.save_png and not (outdir / f"{job.image_id}_L{lv}.png").exists():
+        return None
+    return data
+
+def level_scale(job: Job, lv: int) -> float:
+    return estimate_level_scale(lv, None if job.base_scale is None else int(job.base_scale))
+
+def plan_level_memory(job: Job, lv: int, mem_budget_mb: float | None) -> tuple[bool, float]:
+    """(détection par bandes ?, mémoire de travail prévue en Mo), d'après l'en-tête de la source.
+
+    Le chemin par bandes est choisi quand le calcul global dépasserait le budget.
+    Source illisible: (False, 0), l'erreur sera rapportée par run_level.
+    """
+    try:
+        est = estimate_detection_memory(str(job.source), level_scale(job, lv))
+    except (OSError, ValueError):
+        return False, 0.0
+    tiled = mem_budget_mb is not None and est["full_mb"] > mem_budget_mb
+    return tiled, est["tiled_mb" if tiled else "full_mb"]
@@ -1,24 +1,50 @@
 from __future__ import annotations
-from fastapi import FastAPI, Response, UploadFile, File, HTTPException
+from fastapi import FastAPI, Request, Response, UploadFile, File, HTTPException, Query
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from typing import Literal
-import io, numpy as np, os, uuid
+import asyncio, io, json, numpy as np, os, uuid
 from PIL import Image, ImageFilter
 from pathlib import Path
-from .store import load_annotations, save_annotation, clear_annotations
+from .store import (load_annotations, load_annotations_page, save_annotation, clear_annotations,
+                    subscribe, events_since, snapshot)
 from .detect import run_detector_on_image_path
-from .pyramides import generate_deepzoom
+from .pyramides import (generate_deepzoom, generate_deepzoom_with_heatmap, heatmap_is_current, read_dzi,
+                        level_grid, level_size, max_level, tile_window, tiling_preset, TILING_PRESETS)
+from .overlay import rasterize_annotations, composite_annotations, annotation_tile
+from .jobs import JobBusy, exclusive, submit, get_job
+from .tilepack import PACK_SUFFIX, pack_pyramid, pack_is_current, open_pack
+from .recompress import recompress_pyramid
+from .lazytiles import prepare_lazy_pyramid, lazy_tile
+from .compare import compare_tile
 
 app = FastAPI()
-app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"],
+                   expose_headers=["X-Next-Cursor", "X-Change-Stats"])
+
+class _PublicStaticFiles(StaticFiles):
+    """Tuiles statiques sans les entrées cachées ('.'): dossiers de travail dzsave,
+    tuiles partielles, blobs, cache de comparaison."""
+
+    def lookup_path(self, path: str):
+        if any(part.startswith('.') for part in Path(path).parts):
+            return "", None
+        return super().lookup_path(path)
 
 # Monte le dossier des tuiles avec un chemin absolu et le crée au besoin
 REPO_ROOT = Path(__file__).resolve().parents[2]
 TILES_DIR = REPO_ROOT / 'tiles'
 TILES_DIR.mkdir(parents=True, exist_ok=True)
-app.mount('/static', StaticFiles(directory=str(TILES_DIR)), name='static')
+
+app.mount('/static', _PublicStaticFiles(directory=str(TILES_DIR)), name='static')
+# Magasin de blobs partagé par toutes les pyramides dédupliquées (liens durs)
+BLOB_STORE = TILES_DIR / '.blobs'
+# Événements en attente par client SSE; au-delà (client lent), il est resynchronisé
+STREAM_QUEUE_MAX = 256
+
 
 class Point(BaseModel):
     type: Literal['point']
@@ -37,13 +63,85 @@ def health():
     return {"ok": True}
 
 @app.get('/annotations')
-def get_annotations():
-    return load_annotations()
+def get_annotations(after: int | None = None, limit: int | None = Query(None, ge=1, le=10000),
+                    fields: str | None = None):
+    """Liste paginée par curseur (?after=id&limit=) avec projection (?fields=id,x,y)."""
+    proj = [f for f in fields.split(',') if f] if fields else None
+    page, next_cursor = load_annotations_page(after=after, limit=limit, fields=proj)
+    # Données du store de confiance: sérialisation directe, sans validation Pydantic par item
+    headers = {} if next_cursor is None else {"X-Next-Cursor": str(next_cursor)}
+    body = json.dumps(page, ensure_ascii=False, separators=(',', ':'))
+    return Response(body, media_type='application/json', headers=headers)
 
 @app.post('/annotations')
 def post_annotation(item: Point | Rect):
     return save_annotation(item.model_dump())
 
+def _sse(event: str, data, event_id: str | None = None) -> str:
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+@app.get('/annotations/stream')
+async def stream_annotations(request: Request, token: str | None = None):
+    """Flux SSE des changements (insert/clear). Reprise via Last-Event-ID ou ?token=.
+
+    Si le jeton est inconnu ou trop ancien, un événement 'snapshot' renvoie la liste complète.
+    File d'attente bornée (STREAM_QUEUE_MAX): un client trop lent reçoit un nouveau
+    'snapshot' au lieu des événements perdus.
+    """
+    resume = request.headers.get('last-event-id') or token
+
+    async def gen():
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_MAX)
+        overflow = False
+
+        def push(ev):
+            nonlocal overflow
+            try:
+                queue.put_nowait(ev)
+            except asyncio.QueueFull:
+                overflow = True
+
+        # abonnement dans le générateur (désabonné dans le finally, même jamais itéré au-delà)
+        # et avant lecture du backlog: aucun événement perdu, doublons filtrés par seq
+        unsubscribe = subscribe(lambda ev: loop.call_soon_threadsafe(push, ev))
+        try:
+            backlog = events_since(resume)
+            if backlog is None:
+                items, tok = snapshot()
+                last = int(tok.rsplit(':', 1)[1])
+                yield _sse("snapshot", {"items": items, "token": tok}, tok)
+            else:
+                last = int(resume.rsplit(':', 1)[1])
+                for ev in backlog:
+                    last = ev["seq"]
+                    yield _sse(ev["type"], ev, ev["token"])
+            while not await request.is_disconnected():
+                if overflow:
+                    # file saturée: on la vide et on renvoie l'état complet (doublons filtrés par seq)
+                    overflow = False
+                    while not queue.empty():
+                        queue.get_nowait()
+                    items, tok = snapshot()
+                    last = int(tok.rsplit(':', 1)[1])
+                    yield _sse("snapshot", {"items": items, "token": tok}, tok)
+                    continue
+                try:
+                    ev = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if ev["seq"] <= last:
+                    continue
+                last = ev["seq"]
+                yield _sse(ev["type"], ev, ev["token"])
+        finally:
+            unsubscribe()
+
+    return StreamingResponse(gen(), media_type='text/event-stream',
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.delete('/annotations')
 def delete_annotations():
     clear_annotations()
@@ -128,6 +226,39 @@ async def upload_image(file: UploadFile = File(...)):
         "size": len(content)
     }
 
+def _int_field(request: dict, name: str, default: int, lo: int | None = None, hi: int | None = None) -> int:
+    """Champ entier d'une requête JSON, borné; 400 si absent de type ou non numérique."""
+    try:
+        value = int(request.get(name, default))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Champ {name} invalide: entier attendu")
+    value = value if lo is None else max(lo, value)
+    return value if hi is None else min(hi, value)
+
+def _packing(generator):
+    """Enchaîne génération puis empaquetage (<base>.dzpack; dossier de tuiles et .dzi libre supprimés).
+
+    Archive à jour (manifeste embarqué, heatmap éventuelle à jour) → no-op, sans régénérer.
+    """
+    def run(input_path, output_basename, **kwargs):
+        grid = {k: kwargs[k] for k in ("tile_size", "overlap")}
+        current = not kwargs.get("force") and pack_is_current(output_basename, input_path, suffix=kwargs["suffix"], **grid)
+        if current and kwargs.get("heatmap_basename"):
+            current = heatmap_is_current(input_path, kwargs["heatmap_basename"], **grid)
+        pack = f"{output_basename}{PACK_SUFFIX}"
+        if current:
+            empty = {"levels_built": [], "tiles_written": 0}
+            if kwargs.get("heatmap_basename"):
+                return {"up_to_date": True, "image": empty, "heatmap": dict(empty), "pack": pack}
+            return {"up_to_date": True, **empty, "pack": pack}
+        report = generator(input_path, output_basename, **kwargs)
+        report["pack"] = str(pack_pyramid(output_basename, remove_files=True))
+        return report
+    return run
+
+def _busy(job) -> HTTPException:
+    return HTTPException(status_code=409, detail=f"Tâche {job.kind} en cours sur cette pyramide ({job.job_id})")
+
 @app.post('/generate-tiles')
 async def generate_tiles(request: dict):
     """Génération de tuiles DZI pour une image"""
@@ -135,19 +266,148 @@ async def generate_tiles(request: dict):
     if not image_path or not Path(image_path).exists():
         raise HTTPException(status_code=400, detail="Chemin d'image invalide")
     
+    stem = Path(image_path).stem
+    output_base = TILES_DIR / stem
     try:
-        # Génère les tuiles DZI dans le répertoire monté par /static
-        stem = Path(image_path).stem
-        output_base = TILES_DIR / stem
-        generate_deepzoom(image_path, str(output_base), tile_size=256, suffix=".jpg")
-        # Retourne des chemins relatifs à /static pour simplifier le front
-        return {
-            "success": True,
-            "dzi_path": f"{stem}.dzi",
-            "tiles_path": f"{stem}_files/"
-        }
+        params = tiling_preset(str(request.get("preset", "standard")))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    params.update(force=bool(request.get("force", False)),
+                  workers=_int_field(request, "workers", 1, 1, os.cpu_count() or 1))
+    if request.get("dedupe"):
+        params["dedupe_store"] = str(BLOB_STORE)
+    paths = {"dzi_path": f"{stem}.dzi", "tiles_path": f"{stem}_files/"}
+    if request.get("lazy"):
+        # .dzi + niveaux grossiers tout de suite, tuiles profondes rendues à la demande via /lazy/
+        if request.get("heatmap") or request.get("pack") or request.get("dedupe"):
+            raise HTTPException(status_code=400, detail="Mode lazy incompatible avec heatmap/pack/dedupe")
+        params = {k: params[k] for k in ("tile_size", "overlap", "suffix")}
+        try:
+            with exclusive("generate-tiles", str(output_base)):
+                report = prepare_lazy_pyramid(image_path, str(output_base), **params)
+        except JobBusy as e:
+            raise _busy(e.job)
+        return {"success": True, **paths, "lazy_dzi_url": f"/lazy/{stem}.dzi", **report}
+    generator = generate_deepzoom
+    if request.get("heatmap"):
+        # Image + heatmap co-générées, même grille de tuiles
+        generator = generate_deepzoom_with_heatmap
+        params["heatmap_basename"] = str(TILES_DIR / f"{stem}_heatmap")
+        paths.update(heatmap_dzi_path=f"{stem}_heatmap.dzi", heatmap_tiles_path=f"{stem}_heatmap_files/")
+    if request.get("pack"):
+        # Archive unique <stem>.dzpack servie par /packed/<stem>.dzi
+        generator = _packing(generator)
+        paths.update(packed_dzi_url=f"/packed/{stem}.dzi")
+    if request.get("background"):
+        # Retour immédiat; progression via GET /jobs/{job_id}
+        job = submit("generate-tiles", generator, key=str(output_base), input_path=image_path,
+                     output_basename=str(output_base), **params)
+        if job.kind != "generate-tiles":
+            raise _busy(job)
+        return {"success": True, "job_id": job.job_id, "status_url": f"/jobs/{job.job_id}", **paths}
+    try:
+        # Génère les tuiles DZI dans le répertoire monté par /static, sous la même clé
+        # que les tâches de fond: jamais deux écrivains sur une même pyramide.
+        # Incrémental: no-op si la pyramide existante est à jour, reprise sinon
+        with exclusive("generate-tiles", str(output_base)):
+            report = generator(image_path, str(output_base), **params)
+    except JobBusy as e:
+        raise _busy(e.job)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur lors de la génération: {str(e)}")
+    # Retourne des chemins relatifs à /static pour simplifier le front
+    levels_built = report["image"]["levels_built"] if "image" in report else report["levels_built"]
+    # moteur et workers effectifs: libvips ignore "workers" (threads gérés par libvips)
+    engine = {k: report[k] for k in ("engine", "workers") if k in report}
+    return {"success": True, **paths, "up_to_date": report["up_to_date"], "levels_built": levels_built, **engine}
+
+@app.post('/recompress-tiles')
+async def recompress_tiles(request: dict):
+    """Ré-encode une pyramide existante (jpg optimisé, webp, png) et rapporte les octets gagnés par niveau."""
+    stem = request.get("stem") or Path(str(request.get("dzi_path", ""))).stem
+    base = TILES_DIR / stem
+    if not stem or not Path(f"{base}.dzi").exists():
+        raise HTTPException(status_code=404, detail="Pyramide introuvable")
+    params = dict(target=str(request.get("format", "jpg")), quality=_int_field(request, "quality", 80, 1, 100),
+                  png_level=_int_field(request, "png_level", 9, 0, 9),
+                  workers=_int_field(request, "workers", 1, 1, os.cpu_count() or 1))
+    if request.get("background"):
+        job = submit("recompress-tiles", recompress_pyramid, key=str(base), output_basename=str(base), **params)
+        if job.kind != "recompress-tiles":
+            raise _busy(job)
+        return {"success": True, "job_id": job.job_id, "status_url": f"/jobs/{job.job_id}"}
+    try:
+        with exclusive("recompress-tiles", str(base)):
+            return {"success": True, "dzi_path": f"{stem}.dzi", **recompress_pyramid(str(base), **params)}
+    except JobBusy as e:
+        raise _busy(e.job)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _pack_for(stem: str):
+    path = TILES_DIR / f"{stem}{PACK_SUFFIX}"
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="Archive de tuiles introuvable")
+    return open_pack(path)
+
+@app.get('/packed/{stem}.dzi')
+def packed_dzi(stem: str):
+    """Descripteur DZI d'une pyramide empaquetée (OpenSeadragon en déduit <stem>_files/)."""
+    return Response(_pack_for(stem).dzi_xml(), media_type='application/xml')
+
+@app.get('/packed/{stem}_files/{level}/{col}_{row}.{ext}')
+def packed_tile(stem: str, level: int, col: int, row: int, ext: str):
+    """Tuile lue dans l'archive: une recherche d'index + une tranche du mmap, envoyée sans copie."""
+    pack = _pack_for(stem)
+    if ext != pack.dzi["format"]:
+        raise HTTPException(status_code=404, detail="Tuile introuvable")
+    data = pack.get(level, col, row)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Tuile introuvable")
+    media = {"jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp"}.get(ext, "application/octet-stream")
+    # la vue sur le mmap est le corps de la réponse; libérée une fois la réponse envoyée
+    return Response(data, media_type=media, headers={"Cache-Control": "public, max-age=86400"},
+                    background=BackgroundTask(_release_view, data))
+
+def _release_view(view: memoryview) -> None:
+    try:
+        view.release()
+    except BufferError:  # encore exportée (tampon du transport): le GC la libérera
+        pass
+
+@app.get('/lazy/{stem}.dzi')
+def lazy_dzi(stem: str):
+    """Descripteur d'une pyramide paresseuse (OpenSeadragon en déduit /lazy/<stem>_files/)."""
+    dzi = TILES_DIR / f"{stem}.dzi"
+    if not dzi.exists():
+        raise HTTPException(status_code=404, detail="DZI introuvable")
+    return FileResponse(dzi, media_type='application/xml')
+
+@app.get('/lazy/{stem}_files/{level}/{col}_{row}.{ext}')
+def lazy_dzi_tile(stem: str, level: int, col: int, row: int, ext: str):
+    """Tuile servie depuis le disque, rendue depuis la source à la première demande."""
+    try:
+        path = lazy_tile(str(TILES_DIR / stem), level, col, row)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except FileNotFoundError:
+        raise HTTPException(status_code=410, detail="Image source introuvable")
+    if path is None or path.suffix != f".{ext}":
+        raise HTTPException(status_code=404, detail="Tuile introuvable")
+    return FileResponse(path, headers={"Cache-Control": "public, max-age=86400"})
+
+@app.get('/tiling-presets')
+def list_tiling_presets():
+    """Préréglages de tuilage acceptés par /generate-tiles (champ "preset")."""
+    return TILING_PRESETS
+
+@app.get('/jobs/{job_id}')
+def job_status(job_id: str):
+    """Statut et progression d'une tâche d'arrière-plan (tuiles, niveaux prêts, octets, ETA)."""
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Tâche inconnue")
+    return job.to_dict()
 
 @app.get('/images')
 def list_images():
@@ -160,7 +420,7 @@ def list_images():
     # Images d'exemple
     if samples_dir.exists():
         for img_path in samples_dir.glob("*"):
-            if img_path.is_file() and img_path.suffix.lower() in ['.jpg', '.jpeg', '.png', '.tiff']:
+            if img_path.is_file() and img_path.suffix.lower() in ['.jpg', '.jpeg', '.png', '.tif', '.tiff']:
                 images.append({
                     "id": img_path.stem,
                     "name": img_path.name,
@@ -171,7 +431,7 @@ def list_images():
     # Images uploadées
     if uploads_dir.exists():
         for img_path in uploads_dir.glob("*"):
-            if img_path.is_file() and img_path.suffix.lower() in ['.jpg', '.jpeg', '.png', '.tiff']:
+            if img_path.is_file() and img_path.suffix.lower() in ['.jpg', '.jpeg', '.png', '.tif', '.tiff']:
                 images.append({
                     "id": img_path.stem,
                     "name": img_path.name,
@@ -188,9 +448,73 @@ async def detect_on_path(request: dict, level: int = 0):
     if not image_path or not Path(image_path).exists():
         raise HTTPException(status_code=400, detail="Chemin d'image invalide")
     try:
-        heatmap, _ = run_detector_on_image_path(str(image_path), level_scale=2**level)
+        heatmap, _ = run_detector_on_image_path(str(image_path), level_scale=2**level,
+                                                bands=request.get("bands"))
         buf = io.BytesIO()
         heatmap.save(buf, format='PNG')
         return Response(buf.getvalue(), media_type='image/png')
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erreur détection: {str(e)}")
+
+@app.post('/detect-on-path/annotated')
+async def detect_on_path_annotated(request: dict, level: int = 0, fill: bool = False):
+    """Heatmap de détection + annotations incrustées, en un seul PNG."""
+    image_path = request.get("image_path")
+    if not image_path or not Path(image_path).exists():
+        raise HTTPException(status_code=400, detail="Chemin d'image invalide")
+    try:
+        heatmap, _ = run_detector_on_image_path(str(image_path), level_scale=2**level,
+                                                bands=request.get("bands"))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erreur détection: {str(e)}")
+    mask = rasterize_annotations(load_annotations(), heatmap.size, scale=heatmap.size[0],
+                                 thickness=None if fill else 2)
+    buf = io.BytesIO()
+    composite_annotations(heatmap, mask).save(buf, format='PNG')
+    return Response(buf.getvalue(), media_type='image/png')
+
+@app.get('/overlay/{stem}/{level}/{col}_{row}.png')
+def annotation_overlay_tile(stem: str, level: int, col: int, row: int, fill: bool = False):
+    """Tuile transparente des annotations, alignée sur la grille DZI de tiles/<stem>.dzi."""
+    dzi = TILES_DIR / f"{stem}.dzi"
+    if not dzi.exists():
+        raise HTTPException(status_code=404, detail="DZI introuvable")
+    info = read_dzi(dzi)
+    if not 0 <= level <= max_level(info["width"], info["height"]):
+        raise HTTPException(status_code=404, detail="Niveau hors de la pyramide")
+    cols, rows = level_grid(info["width"], info["height"], level, info["tile_size"])
+    if not (0 <= col < cols and 0 <= row < rows):
+        raise HTTPException(status_code=404, detail="Tuile hors de l'image")
+    lw, lh = level_size(info["width"], info["height"], level)
+    x, y, w, h = tile_window(lw, lh, info["tile_size"], info["overlap"], col, row)
+    tile = annotation_tile(load_annotations(), (x, y, w, h), scale=lw, thickness=None if fill else 2)
+    buf = io.BytesIO()
+    tile.save(buf, format='PNG')
+    return Response(buf.getvalue(), media_type='image/png')
+
+def _compare(a: str, b: str, level: int, col: int, row: int, mode: str, threshold: float):
+    try:
+        result = compare_tile(TILES_DIR, a, b, level, col, row, mode=mode, threshold=threshold)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Pyramide ou tuile introuvable")
+    return result
+
+@app.get('/compare/{a}/{b}/{level}/{col}_{row}.png')
+def compare_tiles(a: str, b: str, level: int, col: int, row: int, mode: str = "change",
+                  threshold: float = Query(0.1, ge=0.0, le=1.0)):
+    """Tuile de différence avant/après (A = référence, B = nouvelle scène), calculée puis mise en cache.
+
+    mode=change: calque transparent des pixels changés; mode=diff: |A - B| par canal.
+    Les statistiques de la tuile sont dans l'en-tête X-Change-Stats (JSON).
+    """
+    png, stats = _compare(a, b, level, col, row, mode, threshold)
+    return Response(png, media_type='image/png',
+                    headers={"X-Change-Stats": json.dumps(stats), "Cache-Control": "public, max-age=3600"})
+
+@app.get('/compare/{a}/{b}/{level}/{col}_{row}.json')
+def compare_tile_stats(a: str, b: str, level: int, col: int, row: int, mode: str = "change",
+                       threshold: float = Query(0.1, ge=0.0, le=1.0)):
+    """Statistiques de changement d'une tuile (partagent le cache de la tuile PNG)."""
+    return _compare(a, b, level, col, row, mode, threshold)[1]
@@ -1,44 +1,66 @@
 from __future__ import annotations
 import json, time, os, math, argparse, sys
 from pathlib import Path
-from typing import Any, Dict, List
-from dataclasses import dataclass
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from typing import Any, Dict, Iterable, Iterator, List
 from PIL import Image
 import traceback
+import tracemalloc
 
 try:
     import psutil
 except Exception:
     psutil = None  # mémoire max optionnelle
 
-from .detect import run_detector_on_image_path
+from .detect import run_detector_on_image_path, run_detector_tiled
+from .levels import Job, current_output, estimate_level_scale, level_fingerprint, level_scale, plan_level_memory
+from .planner import COST_MODEL_NAME, format_plan, load_or_calibrate, plan_batch
+from .resultstore import RESULTS_NAME, ResultsStore
+from .workqueue import DEFAULT_LEASE_S, QUEUE_NAME, LeaseKeeper, WorkQueue, default_worker_id
 
 DEFAULT_OUT = Path("backend/outputs")
+JOURNAL_NAME = "journal.ndjson"
 
-@dataclass
-class Job:
-    image_id: str
-    source: Path
-    levels: List[int]
-    base_scale: float | None  # si connu (ex: niveau max DZI → 2**n)
-    save_png: bool
+NDJSON_SUFFIXES = (".ndjson", ".jsonl")
 
 def load_manifest(p: Path) -> dict:
     with open(p, "r", encoding="utf-8") as f:
         if p.suffix.lower() in (".yml", ".yaml"):
             import yaml  # facultatif si YAML
             return yaml.safe_load(f)
+        if p.suffix.lower() in NDJSON_SUFFIXES:
+            settings, images = open_manifest(p)
+            return {**settings, "images": list(images)}
         return json.load(f)
 
-def estimate_level_scale(level: int, ref_level: int | None) -> float:
-    """
-    Renvoie un facteur 'scale' pour simuler la résolution d’un niveau.
-    Si ref_level est fourni, on prend scale = 2**(ref_level - level).
-    Par défaut, scale = 2**level (niveau 0 = pleine résolution, 1 = /2, etc.).
+def open_manifest(p: Path) -> tuple[dict, Iterator[dict]]:
+    """(réglages, entrées images) d'un manifeste.
+
+    NDJSON (.ndjson/.jsonl): une image par ligne, lue à la demande (mémoire constante);
+    une première ligne sans "id" porte les réglages (ex. {"base_level": 8}).
+    JSON/YAML: chargé en entier, comme load_manifest.
     """
-    if ref_level is not None:
-        return float(2 ** (ref_level - level))
-    return float(2 ** level)
+    if p.suffix.lower() not in NDJSON_SUFFIXES:
+        manifest = load_manifest(p)
+        return {k: v for k, v in manifest.items() if k != "images"}, iter(manifest.get("images", []))
+    f = open(p, "r", encoding="utf-8")
+    first = ""
+    for line in f:
+        if line.strip():
+            first = line
+            break
+    head = json.loads(first) if first else None
+    settings = head if head is not None and "id" not in head else {}
+
+    def images() -> Iterator[dict]:
+        with f:
+            if head is not None and "id" in head:
+                yield head
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    return settings, images()
 
 def memory_info_mb() -> float | None:
     if psutil is None:
@@ -46,90 +68,569 @@ def memory_info_mb() -> float | None:
     proc = psutil.Process(os.getpid())
     return proc.memory_info().rss / (1024*1024)
 
-def run_job(job: Job, outdir: Path, retries: int = 2, backoff: float = 0.7) -> dict:
+class PeakMemory:
+    """Pic mémoire pendant un bloc `with`, en Mo (attribut `mb`, méthode dans `method`).
+
+    Linux: vrai pic RSS du processus (VmHWM remis à zéro via /proc/self/clear_refs).
+    Ailleurs: pic des allocations suivies par tracemalloc (Python + NumPy), sans le
+    socle déjà résident.
+    """
+
+    def __init__(self):
+        self.mb: float | None = None
+        self.method: str | None = None
+        self._tracing = False
+
+    @staticmethod
+    def _vmhwm_mb() -> float | None:
+        try:
+            with open("/proc/self/status", "r", encoding="ascii") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return None
+
+    def __enter__(self) -> "PeakMemory":
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+            if self._vmhwm_mb() is not None:
+                self.method = "vmhwm"
+                return self
+        except OSError:
+            pass
+        self.method = "tracemalloc"
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        tracemalloc.reset_peak()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self.method == "vmhwm":
+            self.mb = self._vmhwm_mb()
+        else:
+            self.mb = tracemalloc.get_traced_memory()[1] / (1024*1024)
+            if self._tracing:
+                tracemalloc.stop()
+
+def run_level(job: Job, lv: int, outdir: Path, retries: int = 2, backoff: float = 0.7,
+              force: bool = False, checksum: bool = False, tiled: bool = False) -> dict:
+    """Un niveau d'un job (avec retries): écrit <id>_L<lv>.json (+ PNG) et renvoie son enregistrement.
+
+    Si le JSON existant porte la même empreinte, le niveau est sauté (sauf `force`).
+    `tiled`: détection par bandes (mémoire bornée, même résultat à l'arrondi près).
+    """
     outdir.mkdir(parents=True, exist_ok=True)
-    results = {"image_id": job.image_id, "source": str(job.source), "levels": []}
-    for lv in job.levels:
-        attempt, ok = 0, False
-        while attempt <= retries and not ok:
-            t0 = time.perf_counter()
-            mem0 = memory_info_mb()
-            err_text = None
-            try:
-                scale = estimate_level_scale(lv, None if job.base_scale is None else int(job.base_scale))
-                heat, stats = run_detector_on_image_path(str(job.source), level_scale=scale)
-                # Sauvegardes
-                record = {
-                    "level": lv,
-                    "scale": scale,
-                    "stats": stats,
-                    "elapsed_ms": None,
-                    "mem_mb_before": mem0,
-                    "mem_mb_after": None,
-                    "error": None,
-                    "heatmap_png": None
-                }
+    attempt = 0
+    while True:
+        t0 = time.perf_counter()
+        mem0 = memory_info_mb()
+        err_text = None
+        try:
+            scale = level_scale(job, lv)
+            fingerprint = level_fingerprint(job, lv, scale, checksum)
+            current = None if force else current_output(job, lv, outdir, fingerprint)
+            if current is not None:
+                png = outdir / f"{job.image_id}_L{lv}.png"
+                return {"level": lv, "scale": scale, "stats": current["stats"], "elapsed_ms": 0,
+                        "mem_mb_before": mem0, "mem_mb_after": mem0, "error": None,
+                        "heatmap_png": str(png) if job.save_png else None, "skipped": True}
+            stages: Dict[str, float] = {}
+
+            def hook(stage: str, seconds: float) -> None:
+                stages[stage] = stages.get(stage, 0.0) + seconds * 1000
+
+            # étapes du détecteur + écritures; pic mémoire sur l'ensemble du niveau
+            with PeakMemory() as peak:
+                detector = run_detector_tiled if tiled else run_detector_on_image_path
+                heat, stats = detector(str(job.source), level_scale=scale, hook=hook)
+                png_path = None
                 if job.save_png:
+                    t = time.perf_counter()
                     png_path = outdir / f"{job.image_id}_L{lv}.png"
                     heat.save(png_path, "PNG")
-                    record["heatmap_png"] = str(png_path)
-                # JSON minimal par niveau
+                    hook("png_encode", time.perf_counter() - t)
+                # JSON minimal par niveau, écrit en dernier (atomique): il atteste une sortie complète
+                t = time.perf_counter()
                 lvl_json = outdir / f"{job.image_id}_L{lv}.json"
-                with open(lvl_json, "w", encoding="utf-8") as jf:
-                    json.dump({"image_id": job.image_id, "level": lv, "stats": stats}, jf, indent=2, ensure_ascii=False)
-                # temps/mémoire
-                record["elapsed_ms"] = int((time.perf_counter() - t0)*1000)
-                record["mem_mb_after"] = memory_info_mb()
-                results["levels"].append(record)
-                ok = True
-            except Exception as e:
-                err_text = "".join(traceback.format_exception(e))
-                attempt += 1
-                if attempt <= retries:
-                    time.sleep(backoff * attempt)  # backoff simple
-                if attempt > retries:
-                    results["levels"].append({
-                        "level": lv,
-                        "error": f"Failed after {retries} retries: {str(e)}",
-                        "traceback": err_text
-                    })
-    # journal global
-    with open(outdir / f"{job.image_id}_summary.json", "w", encoding="utf-8") as f:
+                tmp = lvl_json.with_name(lvl_json.name + ".tmp")
+                with open(tmp, "w", encoding="utf-8") as jf:
+                    json.dump({"image_id": job.image_id, "level": lv, "stats": stats, "fingerprint": fingerprint},
+                              jf, indent=2, ensure_ascii=False)
+                os.replace(tmp, lvl_json)
+                hook("json_write", time.perf_counter() - t)
+            record = {
+                "level": lv,
+                "scale": scale,
+                "stats": stats,
+                "elapsed_ms": None,
+                "mem_mb_before": mem0,
+                "mem_mb_after": None,
+                "error": None,
+                "heatmap_png": None if png_path is None else str(png_path),
+                "skipped": False,
+                "stages_ms": {k: round(v, 3) for k, v in stages.items()},
+                "peak_mem_mb": None if peak.mb is None else round(peak.mb, 2),
+                "peak_mem_method": peak.method,
+                "tiled": tiled,
+            }
+            # temps/mémoire
+            record["elapsed_ms"] = int((time.perf_counter() - t0)*1000)
+            record["mem_mb_after"] = memory_info_mb()
+            return record
+        except Exception as e:
+            err_text = "".join(traceback.format_exception(e))
+            attempt += 1
+            if attempt > retries:
+                return {
+                    "level": lv,
+                    "error": f"Failed after {retries} retries: {str(e)}",
+                    "traceback": err_text
+                }
+            time.sleep(backoff * attempt)  # backoff simple
+
+def write_job_summary(results: dict, outdir: Path) -> None:
+    with open(outdir / f"{results['image_id']}_summary.json", "w", encoding="utf-8") as f:
         json.dump(results, f, indent=2, ensure_ascii=False)
+
+def run_job(job: Job, outdir: Path, retries: int = 2, backoff: float = 0.7,
+            force: bool = False, checksum: bool = False, mem_budget_mb: float | None = None) -> dict:
+    outdir.mkdir(parents=True, exist_ok=True)
+    results = {"image_id": job.image_id, "source": str(job.source),
+               "levels": [run_level(job, lv, outdir, retries, backoff, force, checksum,
+                                    plan_level_memory(job, lv, mem_budget_mb)[0]) for lv in job.levels]}
+    # journal global
+    write_job_summary(results, outdir)
     return results
 
+def _level_task(task: tuple) -> tuple:
+    """Côté worker: (index du job, position du niveau, enregistrement)."""
+    idx, pos, job, lv, outdir, retries, backoff, force, checksum, tiled = task
+    return idx, pos, run_level(job, lv, outdir, retries, backoff, force, checksum, tiled)
+
+class Journal:
+    """Journal append-only des jobs terminés: une ligne NDJSON par job, fsync après chaque ligne.
+
+    Les jobs y sont inscrits dans l'ordre du manifeste: le journal est toujours un
+    préfixe du manifeste et une reprise repart simplement de son nombre de lignes.
+    Une ligne tronquée par un crash (la dernière) est supprimée à la réouverture.
+    """
+
+    def __init__(self, path: Path, resume: bool = False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if not resume:
+            self.path.write_text("", encoding="utf-8")
+        elif self.path.exists():
+            self._drop_torn_tail()
+        self._f = open(self.path, "a", encoding="utf-8")
+
+    def _drop_torn_tail(self) -> None:
+        with open(self.path, "rb") as f:
+            valid = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    json.loads(line)
+                except ValueError:
+                    break
+                valid += len(line)
+        with open(self.path, "r+b") as f:
+            f.truncate(valid)
+
+    def entries(self) -> Iterator[dict]:
+        try:
+            f = open(self.path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    return  # ligne incomplète (crash pendant l'écriture)
+
+    def resume_point(self) -> tuple[int, str | None]:
+        """(nombre de jobs journalisés, image_id du dernier) — sans tout charger."""
+        n, last = 0, None
+        for e in self.entries():
+            n, last = n + 1, e["image_id"]
+        return n, last
+
+    def append(self, index: int, result: dict) -> None:
+        self._f.write(json.dumps({"index": index, **result}, ensure_ascii=False) + "\n")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def results(self) -> Iterator[dict]:
+        """Résultats par job, dans l'ordre du manifeste, un à la fois."""
+        for e in self.entries():
+            e.pop("index", None)
+            yield e
+
+    def close(self) -> None:
+        self._f.close()
+
+class _Counters:
+    """Compteurs de niveaux + profil agrégé par étape (niveaux recalculés seulement)."""
+
+    def __init__(self):
+        self.levels_skipped = self.levels_computed = self.levels_failed = self.levels_tiled = 0
+        self._stages: Dict[str, float] = {}
+        self._peak_mb: float | None = None
+        self._peak_methods: set = set()
+
+    def add(self, res: dict) -> None:
+        for r in res["levels"]:
+            self.levels_skipped += bool(r.get("skipped"))
+            self.levels_computed += r.get("skipped") is False
+            self.levels_failed += bool(r.get("error"))
+            self.levels_tiled += bool(r.get("tiled"))
+            for stage, ms in (r.get("stages_ms") or {}).items():
+                self._stages[stage] = self._stages.get(stage, 0.0) + ms
+            if r.get("peak_mem_mb") is not None:
+                self._peak_mb = max(self._peak_mb or 0.0, r["peak_mem_mb"])
+                self._peak_methods.add(r.get("peak_mem_method"))
+
+    def profile(self) -> Dict[str, Any]:
+        total = sum(self._stages.values())
+        n = max(1, self.levels_computed)
+        return {
+            "stages_ms": {k: round(v, 1) for k, v in sorted(self._stages.items(), key=lambda kv: -kv[1])},
+            "stages_pct": {k: round(100 * v / total, 1) if total else 0.0 for k, v in self._stages.items()},
+            "mean_level_ms": {k: round(v / n, 2) for k, v in self._stages.items()},
+            "peak_mem_mb_max": None if self._peak_mb is None else round(self._peak_mb, 2),
+            "peak_mem_method": "/".join(sorted(m for m in self._peak_methods if m)) or None,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"levels_skipped": self.levels_skipped, "levels_computed": self.levels_computed,
+                "levels_failed": self.levels_failed, "levels_tiled": self.levels_tiled, "profile": self.profile()}
+
+def write_batch_summary(path: Path, results: Iterable[dict], extra: Dict[str, Any]) -> Dict[str, Any]:
+    """Écrit batch_summary.json en flux (un job à la fois) et renvoie les compteurs + `extra`."""
+    c = _Counters()
+    # nom temporaire propre au processus: plusieurs hôtes d'une même file peuvent l'écrire
+    tmp = path.with_name(f"{path.name}.{default_worker_id().replace(':', '-')}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write('{\n  "jobs": [')
+        for i, res in enumerate(results):
+            c.add(res)
+            body = json.dumps(res, indent=2, ensure_ascii=False).replace("\n", "\n    ")
+            f.write(("," if i else "") + "\n    " + body)
+        tail = {**c.to_dict(), **extra}
+        f.write("\n  ],\n  " + json.dumps(tail, indent=2, ensure_ascii=False)[1:].lstrip("\n").lstrip())
+    os.replace(tmp, path)
+    return tail
+
+def run_batch(jobs: Iterable[Job], out_root: Path, retries: int = 2, workers: int = 1,
+              backoff: float = 0.7, force: bool = False, checksum: bool = False,
+              journal: Journal | None = None, results: ResultsStore | None = None,
+              mem_budget_mb: float | None = None) -> Dict[str, Any]:
+    """Exécute tous les jobs; renvoie les compteurs, le débit et, sans journal, {"jobs": [...]}.
+
+    workers > 1: chaque (image, niveau) est une tâche d'un pool de processus, avec au
+    plus quelques tâches en vol par worker. Les niveaux d'un job sont rangés dans
+    l'ordre du manifeste et son <id>_summary.json est écrit dès son dernier niveau.
+    Les jobs terminés sont émis dans l'ordre du manifeste (tampon de réordonnancement
+    borné: la soumission attend si trop de jobs précèdent un job lent). Avec un
+    `journal`, ils y sont ajoutés aussitôt et rien n'est gardé en mémoire; les jobs déjà
+    journalisés (reprise) sont sautés. Avec `results`, les statistiques de chaque job
+    terminé y sont aussi inscrites.
+
+    `mem_budget_mb`: mémoire de travail prévue (plan_level_memory) de chaque niveau; un
+    niveau n'est soumis que si la somme des niveaux en vol tient dans le budget (un
+    niveau seul est toujours admis) et passe en détection par bandes s'il ne tient
+    pas seul dans le budget.
+    """
+    t0 = time.perf_counter()
+    start, last_id = journal.resume_point() if journal is not None else (0, None)
+    kept: List[dict] = []
+    counters = _Counters()
+    ready: Dict[int, dict] = {}
+    state = {"next": start, "images": 0}
+    n_levels = 0
+
+    def finish(idx: int, res: dict) -> None:
+        write_job_summary(res, out_root / res["image_id"])
+        ready[idx] = res
+        while state["next"] in ready:
+            i = state["next"]
+            done_res = ready.pop(i)
+            counters.add(done_res)
+            if results is not None:
+                results.add([done_res])
+            if journal is not None:
+                journal.append(i, done_res)
+            else:
+                kept.append(done_res)
+            state["next"] += 1
+            state["images"] += 1
+
+    def todo() -> Iterator[tuple]:
+        for idx, job in enumerate(jobs):
+            if idx < start:
+                if idx == start - 1 and job.image_id != last_id:
+                    raise ValueError(f"Journal incompatible avec le manifeste (entrée {idx}: {last_id} ≠ {job.image_id})")
+                continue
+            yield idx, job
+
+    if workers <= 1:
+        for idx, job in todo():
+            outdir = out_root / job.image_id
+            outdir.mkdir(parents=True, exist_ok=True)
+            finish(idx, {"image_id": job.image_id, "source": str(job.source),
+                         "levels": [run_level(job, lv, outdir, retries, backoff, force, checksum,
+                                              plan_level_memory(job, lv, mem_budget_mb)[0])
+                                    for lv in job.levels]})
+            n_levels += len(job.levels)
+    else:
+        pending: Dict[int, dict] = {}  # index → {"results", "remaining"}
+        in_flight = set()
+        reserved: Dict[Any, float] = {}  # tâche en vol → mémoire prévue (Mo)
+
+        def collect(futures) -> None:
+            for fut in futures:
+                reserved.pop(fut, None)
+                idx, pos, record = fut.result()
+                entry = pending[idx]
+                entry["results"]["levels"][pos] = record
+                entry["remaining"] -= 1
+                if entry["remaining"] == 0:
+                    finish(idx, pending.pop(idx)["results"])
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for idx, job in todo():
+                outdir = out_root / job.image_id
+                outdir.mkdir(parents=True, exist_ok=True)
+                job_res = {"image_id": job.image_id, "source": str(job.source), "levels": [None] * len(job.levels)}
+                if not job.levels:
+                    finish(idx, job_res)
+                    continue
+                pending[idx] = {"results": job_res, "remaining": len(job.levels)}
+                for pos, lv in enumerate(job.levels):
+                    tiled, cost = plan_level_memory(job, lv, mem_budget_mb) if mem_budget_mb is not None else (False, 0.0)
+                    while in_flight and (len(in_flight) >= workers * 4 or len(ready) >= workers * 64
+                                         or sum(reserved.values()) + cost > (mem_budget_mb or math.inf)):
+                        finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        collect(finished)
+                    task = (idx, pos, job, lv, outdir, retries, backoff, force, checksum, tiled)
+                    fut = pool.submit(_level_task, task)
+                    reserved[fut] = cost
+                    in_flight.add(fut)
+                    n_levels += 1
+            collect(as_completed(in_flight))
+    elapsed = time.perf_counter() - t0
+    images = state["images"]
+    out = {} if journal is not None else {"jobs": kept}
+    return {
+        **out,
+        **counters.to_dict(),
+        "throughput": {
+            "workers": max(1, workers),
+            "images": images,
+            "images_resumed": start,
+            "levels": n_levels,
+            "elapsed_s": round(elapsed, 3),
+            "images_per_s": round(images / elapsed, 3) if elapsed > 0 else None,
+            "levels_per_s": round(n_levels / elapsed, 3) if elapsed > 0 else None,
+        },
+    }
+
+def job_payload(job: Job) -> Dict[str, Any]:
+    return {"image_id": job.image_id, "source": str(job.source), "levels": list(job.levels),
+            "base_scale": job.base_scale, "save_png": job.save_png}
+
+def job_from_payload(d: Dict[str, Any]) -> Job:
+    return Job(d["image_id"], Path(d["source"]), list(d["levels"]), d["base_scale"], d["save_png"])
+
+def run_queue_worker(queue_path: Path, out_root: Path, worker_id: str | None = None,
+                     lease_s: float = DEFAULT_LEASE_S, retries: int = 2, backoff: float = 0.7,
+                     force: bool = False, checksum: bool = False, poll_s: float | None = None,
+                     results_path: Path | None = None, mem_budget_mb: float | None = None) -> Dict[str, Any]:
+    """Traite les jobs de la file partagée jusqu'à ce qu'elle soit vide.
+
+    Un job à la fois: réservation (bail de `lease_s` secondes, renouvelé en tâche de
+    fond), run_job, puis résultat inscrit dans la file. Tant que d'autres workers
+    détiennent des baux, on attend: un bail expiré remet son job en file. Les
+    statistiques sont inscrites dans la table de résultats `results_path` si fournie.
+    Un niveau dont la détection globale dépasserait `mem_budget_mb` passe par bandes.
+    """
+    worker_id = worker_id or default_worker_id()
+    poll_s = min(1.0, lease_s / 4) if poll_s is None else poll_s
+    t0 = time.perf_counter()
+    counters = _Counters()
+    images = levels = 0
+    q = WorkQueue(queue_path)
+    store = ResultsStore(results_path) if results_path is not None else None
+    keeper = LeaseKeeper(queue_path, worker_id, lease_s)
+    keeper.start()
+    try:
+        while True:
+            claimed = q.claim(worker_id, lease_s)
+            if not claimed:
+                if not q.unfinished():
+                    break
+                time.sleep(poll_s)
+                continue
+            idx, payload = claimed[0]
+            job = job_from_payload(payload)
+            keeper.hold(idx)
+            try:
+                res = run_job(job, out_root / job.image_id, retries, backoff, force, checksum, mem_budget_mb)
+            except BaseException:
+                keeper.drop(idx)
+                q.release(worker_id, idx)
+                raise
+            keeper.drop(idx)
+            if q.complete(worker_id, idx, res):
+                if store is not None:
+                    store.add([res])
+                counters.add(res)
+                images += 1
+                levels += len(job.levels)
+    finally:
+        keeper.stop()
+        q.close()
+        if store is not None:
+            store.close()
+    elapsed = time.perf_counter() - t0
+    return {"worker": worker_id, "images": images, "levels": levels, "elapsed_s": round(elapsed, 3),
+            "leases_lost": len(keeper.lost), **counters.to_dict()}
+
+def run_queue(jobs: Iterable[Job], queue_path: Path, out_root: Path, workers: int = 1,
+              lease_s: float = DEFAULT_LEASE_S, retries: int = 2, backoff: float = 0.7,
+              force: bool = False, checksum: bool = False, worker_id: str | None = None,
+              results_path: Path | None = None, mem_budget_mb: float | None = None) -> Dict[str, Any]:
+    """Amorce la file avec le manifeste (sans effet si un autre hôte l'a déjà fait) puis
+    lance `workers` workers locaux. Sur chaque nœud, la même commande ajoute du débit.
+    `mem_budget_mb` est le budget du nœud, partagé à parts égales entre ses workers."""
+    t0 = time.perf_counter()
+    q = WorkQueue(queue_path)
+    try:
+        added = q.enqueue((job.image_id, job_payload(job)) for job in jobs)
+    finally:
+        q.close()
+    base = worker_id or default_worker_id()
+    args = (queue_path, out_root)
+    opts = dict(lease_s=lease_s, retries=retries, backoff=backoff, force=force, checksum=checksum,
+                results_path=results_path,
+                mem_budget_mb=None if mem_budget_mb is None else mem_budget_mb / max(1, workers))
+    if workers <= 1:
+        per_worker = [run_queue_worker(*args, worker_id=base, **opts)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            futures = [ex.submit(run_queue_worker, *args, worker_id=f"{base}/{i}", **opts) for i in range(workers)]
+            per_worker = [f.result() for f in futures]
+    elapsed = time.perf_counter() - t0
+    images, levels = sum(w["images"] for w in per_worker), sum(w["levels"] for w in per_worker)
+    q = WorkQueue(queue_path)
+    try:
+        counts = q.counts()
+    finally:
+        q.close()
+    return {
+        "queue": {"path": str(queue_path), "enqueued": added, **counts},
+        "workers": per_worker,
+        "throughput": {
+            "workers": workers,
+            "images": images,
+            "levels": levels,
+            "elapsed_s": round(elapsed, 3),
+            "images_per_s": round(images / elapsed, 3) if elapsed > 0 else None,
+            "levels_per_s": round(levels / elapsed, 3) if elapsed > 0 else None,
+        },
+    }
+
 def main():
     ap = argparse.ArgumentParser(description="Orchestrateur détection (batch).")
-    ap.add_argument("--manifest", type=str, default="backend/manifest.json", help="Chemin manifest JSON/YAML.")
+    ap.add_argument("--manifest", type=str, default="backend/manifest.json",
+                    help="Chemin manifest JSON/YAML, ou NDJSON (.ndjson/.jsonl) lu en flux.")
     ap.add_argument("--out", type=str, default=str(DEFAULT_OUT), help="Dossier de sortie.")
     ap.add_argument("--png", action="store_true", help="Sauver heatmap PNG par niveau.")
     ap.add_argument("--retries", type=int, default=2, help="Nombre de retries par niveau.")
+    ap.add_argument("--workers", type=int, default=1, help="Processus de détection (images et niveaux en parallèle).")
+    ap.add_argument("--force", action="store_true", help="Recalcule même les niveaux déjà à jour.")
+    ap.add_argument("--checksum", action="store_true", help="Empreinte des sources par contenu (sinon taille+mtime).")
+    ap.add_argument("--resume", action="store_true",
+                    help="Reprend après les jobs déjà inscrits au journal (<out>/journal.ndjson).")
+    ap.add_argument("--queue", nargs="?", const="", default=None, metavar="DB",
+                    help=f"Mode file partagée multi-hôtes (SQLite, défaut <out>/{QUEUE_NAME}): "
+                         "lancer la même commande sur chaque nœud.")
+    ap.add_argument("--lease", type=float, default=DEFAULT_LEASE_S, help="Durée des baux de la file (s).")
+    ap.add_argument("--mem-budget", type=float, default=None, metavar="MB",
+                    help="Mémoire de travail max des détections simultanées (Mo, hors socle des processus); "
+                         "les images trop grandes passent en détection par bandes.")
+    ap.add_argument("--plan", action="store_true",
+                    help="À blanc: lit les en-têtes et affiche niveaux, tailles, temps et mémoire prévus.")
+    ap.add_argument("--plan-json", action="store_true", help="Avec --plan: plan complet en JSON.")
+    ap.add_argument("--calibrate", action="store_true",
+                    help=f"Avec --plan: refait le micro-benchmark du modèle de coût (<out>/{COST_MODEL_NAME}).")
     args = ap.parse_args()
 
-    manifest = load_manifest(Path(args.manifest))
+    settings, images = open_manifest(Path(args.manifest))
     out_root = Path(args.out)
     out_root.mkdir(parents=True, exist_ok=True)
+    base_level = settings.get("base_level")  # optionnel
 
-    images: List[Dict[str, Any]] = manifest.get("images", [])
-    base_level = manifest.get("base_level")  # optionnel
-
-    all_results = {"jobs": []}
-    for it in images:
-        job = Job(
-            image_id=it["id"],
-            source=Path(it["source"]),
-            levels=it.get("levels", [0]),
-            base_scale=base_level,
-            save_png=args.png
-        )
-        job_dir = out_root / job.image_id
-        res = run_job(job, job_dir, retries=args.retries)
-        all_results["jobs"].append(res)
-
-    with open(out_root / "batch_summary.json", "w", encoding="utf-8") as f:
-        json.dump(all_results, f, indent=2, ensure_ascii=False)
+    jobs = (Job(
+        image_id=it["id"],
+        source=Path(it["source"]),
+        levels=it.get("levels", [0]),
+        base_scale=base_level,
+        save_png=args.png
+    ) for it in images)
+    if args.plan:
+        model = load_or_calibrate(out_root / COST_MODEL_NAME, force=args.calibrate)
+        plan = plan_batch(jobs, model, workers=args.workers, mem_budget_mb=args.mem_budget,
+                          out_root=out_root, checksum=args.checksum)
+        print(json.dumps(plan, indent=2, ensure_ascii=False) if args.plan_json else format_plan(plan))
+        return
+    if args.queue is not None:
+        queue_path = Path(args.queue) if args.queue else out_root / QUEUE_NAME
+        run = run_queue(jobs, queue_path, out_root, workers=args.workers, lease_s=args.lease,
+                        retries=args.retries, force=args.force, checksum=args.checksum,
+                        results_path=out_root / RESULTS_NAME, mem_budget_mb=args.mem_budget)
+        tp, qs = run["throughput"], run["queue"]
+        print(f"⏱  {tp['images']} images / {tp['levels']} niveaux traités ici en {tp['elapsed_s']} s "
+              f"({tp['workers']} workers); file: {qs['done']} terminés, {qs['failed']} en échec")
+        # le dernier nœud à finir écrit le résumé global (la file est alors vide)
+        if qs["queued"] == 0 and qs["leased"] == 0:
+            q = WorkQueue(queue_path)
+            try:
+                write_batch_summary(out_root / "batch_summary.json", q.results(), {"queue": qs})
+            finally:
+                q.close()
+        print("✅ Orchestration terminée. Résultats dans:", out_root.resolve())
+        return
+    journal = Journal(out_root / JOURNAL_NAME, resume=args.resume)
+    store = ResultsStore(out_root / RESULTS_NAME)
+    try:
+        run = run_batch(jobs, out_root, retries=args.retries, workers=args.workers,
+                        force=args.force, checksum=args.checksum, journal=journal, results=store,
+                        mem_budget_mb=args.mem_budget)
+    finally:
+        journal.close()
+        store.close()
+    # résumé global reconstruit en flux depuis le journal (inclut les jobs repris)
+    all_results = write_batch_summary(out_root / "batch_summary.json", journal.results(),
+                                      {"throughput": run["throughput"]})
 
+    tp = all_results["throughput"]
+    print(f"⏱  {tp['images']} images / {tp['levels']} niveaux en {tp['elapsed_s']} s "
+          f"({tp['images_per_s']} images/s, {tp['workers']} workers, {tp['images_resumed']} repris du journal)")
+    print(f"   niveaux recalculés: {all_results['levels_computed']}, à jour (sautés): {all_results['levels_skipped']}, "
+          f"en échec: {all_results['levels_failed']}, par bandes: {all_results['levels_tiled']}")
+    prof = all_results["profile"]
+    if prof["stages_pct"]:
+        top = ", ".join(f"{k} {v}%" for k, v in sorted(prof["stages_pct"].items(), key=lambda kv: -kv[1])[:4])
+        print(f"   étapes: {top}; pic mémoire max {prof['peak_mem_mb_max']} Mo ({prof['peak_mem_method']})")
     print("✅ Orchestration terminée. Résultats dans:", out_root.resolve())
+    print(f"   requêtes: python -m app.resultstore {out_root / RESULTS_NAME} --where level=0 --agg count,max(max)")
 
 if __name__ == "__main__":
     main()
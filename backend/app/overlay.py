@@ -0,0 +1,76 @@
+from __future__ import annotations
+import numpy as np
+from PIL import Image
+from typing import Any, Dict, List, Sequence
+
+# Les annotations sont en coordonnées viewport OpenSeadragon (x, y, w, h rapportés
+# à la largeur de l'image); 'scale' = nombre de pixels par unité au niveau voulu.
+
+def annotation_boxes(annotations: Sequence[Dict[str, Any]], scale: float,
+                     point_radius: int = 3) -> tuple[np.ndarray, np.ndarray]:
+    """Boîtes pixels (x0, y0, x1, y1) exclusives, int64 (N, 4) + masque 'point'."""
+    if not annotations:
+        return np.zeros((0, 4), dtype=np.int64), np.zeros(0, dtype=bool)
+    raw = np.array([(a.get('x', 0.0), a.get('y', 0.0), a.get('w', 0.0) or 0.0, a.get('h', 0.0) or 0.0)
+                    for a in annotations], dtype=np.float64).reshape(-1, 4)
+    is_pt = np.array([a.get('type') == 'point' for a in annotations], dtype=bool)
+    eps = 1e-6  # absorbe les erreurs d'arrondi flottant (0.1+0.2)*100
+    x0 = np.floor(raw[:, 0] * scale + eps)
+    y0 = np.floor(raw[:, 1] * scale + eps)
+    x1 = np.maximum(np.ceil((raw[:, 0] + raw[:, 2]) * scale - eps), x0 + 1)
+    y1 = np.maximum(np.ceil((raw[:, 1] + raw[:, 3]) * scale - eps), y0 + 1)
+    boxes = np.stack([x0, y0, x1, y1], axis=1)
+    r = point_radius
+    boxes[is_pt] = np.stack([x0 - r, y0 - r, x0 + r + 1, y0 + r + 1], axis=1)[is_pt]
+    return boxes.astype(np.int64), is_pt
+
+def _coverage(boxes: np.ndarray, w: int, h: int) -> np.ndarray:
+    """Nombre de boîtes couvrant chaque pixel (tableau de différences 2D + cumsum)."""
+    if len(boxes) == 0:
+        return np.zeros((h, w), dtype=np.int32)
+    x0 = np.clip(boxes[:, 0], 0, w); x1 = np.clip(boxes[:, 2], 0, w)
+    y0 = np.clip(boxes[:, 1], 0, h); y1 = np.clip(boxes[:, 3], 0, h)
+    keep = (x1 > x0) & (y1 > y0)
+    x0, x1, y0, y1 = x0[keep], x1[keep], y0[keep], y1[keep]
+    stride = w + 1
+    idx = np.concatenate([y0*stride + x0, y0*stride + x1, y1*stride + x0, y1*stride + x1])
+    n = len(x0)
+    wts = np.concatenate([np.ones(n), -np.ones(n), -np.ones(n), np.ones(n)])
+    diff = np.bincount(idx, weights=wts, minlength=(h + 1)*stride).reshape(h + 1, stride)
+    return diff.cumsum(axis=0).cumsum(axis=1)[:h, :w].astype(np.int32)
+
+def rasterize_annotations(annotations: Sequence[Dict[str, Any]], size: tuple[int, int], scale: float,
+                          origin: tuple[int, int] = (0, 0), thickness: int | None = 2,
+                          point_radius: int = 3) -> np.ndarray:
+    """Masque booléen (h, w) des annotations dans la fenêtre [origin, origin+size).
+
+    thickness=None remplit les rectangles, sinon trace un contour de cette épaisseur.
+    Les points sont toujours des carrés pleins de côté 2*point_radius+1.
+    """
+    w, h = size
+    boxes, is_pt = annotation_boxes(annotations, scale, point_radius)
+    boxes = boxes - np.array([origin[0], origin[1], origin[0], origin[1]], dtype=np.int64)
+    outer = _coverage(boxes, w, h)
+    if thickness is None:
+        return outer > 0
+    # contour = couverture des boîtes - couverture de leurs intérieurs (rectangles seulement)
+    t = int(thickness)
+    inner = boxes[~is_pt] + np.array([t, t, -t, -t], dtype=np.int64)
+    inner = inner[(inner[:, 2] > inner[:, 0]) & (inner[:, 3] > inner[:, 1])]
+    return (outer - _coverage(inner, w, h)) > 0
+
+def composite_annotations(base: Image.Image, mask: np.ndarray,
+                          color: tuple[int, int, int, int] = (0, 255, 0, 255)) -> Image.Image:
+    """Incruste le masque dans une image RGBA (heatmap ou tuile transparente)."""
+    rgba = np.array(base.convert('RGBA'))
+    rgba[mask] = color
+    return Image.fromarray(rgba, mode='RGBA')
+
+def annotation_tile(annotations: List[Dict[str, Any]], window: tuple[int, int, int, int], scale: float,
+                    thickness: int | None = 2) -> Image.Image:
+    """Tuile RGBA transparente contenant uniquement les annotations de la fenêtre."""
+    x, y, w, h = window
+    mask = rasterize_annotations(annotations, (w, h), scale, origin=(x, y), thickness=thickness)
+    rgba = np.zeros((h, w, 4), dtype=np.uint8)
+    rgba[mask] = (0, 255, 0, 255)
+    return Image.fromarray(rgba, mode='RGBA')
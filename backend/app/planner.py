@@ -0,0 +1,188 @@
+from __future__ import annotations
+import heapq, io, json, os, socket, tempfile, time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Sequence
+import numpy as np
+from PIL import Image
+
+from .detect import colorize_heatmap, detect_loglike, estimate_detection_memory, run_detector_tiled, to_gray
+from .levels import code_version, current_output, level_fingerprint, level_scale, plan_level_memory
+from .raster import is_windowed
+
+# Planification à blanc d'un manifeste: en-têtes seuls, niveaux à calculer, tailles de
+# sortie, temps et mémoire prévus. Les coûts par mégapixel viennent d'un court
+# micro-benchmark sur la machine courante (mis en cache, cf. load_or_calibrate).
+COST_MODEL_NAME = "cost_model.json"
+HUGE_LEVEL_MPX = 256       # niveau au-delà duquel une entrée est signalée
+HUGE_DECODE_MPX = 400      # source non fenêtrée décodée en entier au-delà de cette taille
+
+def _best_of(fn, reps: int) -> float:
+    best = float("inf")
+    for _ in range(reps):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+def calibrate(size: int = 1024, reps: int = 3) -> Dict[str, Any]:
+    """Coûts (s/Mpx) de décodage PNG, détection (gris + detect_loglike + colorisation),
+    encodage PNG de la heatmap et surcoût du chemin par bandes, sur une scène synthétique."""
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:size, 0:size].astype(np.float32)
+    base = np.sin(xx / 23.0) * np.cos(yy / 17.0) * 80 + 128 + rng.normal(0, 12, (size, size))
+    arr = np.clip(np.stack([base, base * 0.8, 255 - base], -1), 0, 255).astype(np.uint8)
+    mpx = size * size / 1e6
+    buf = io.BytesIO()
+    Image.fromarray(arr).save(buf, format="PNG")
+    data = buf.getvalue()
+
+    decode_s = _best_of(lambda: Image.open(io.BytesIO(data)).convert("RGB").load(), reps)
+    detect_s = _best_of(lambda: colorize_heatmap(detect_loglike(to_gray(arr)), 160), reps)
+    heat = colorize_heatmap(detect_loglike(to_gray(arr)), 160)
+    out = io.BytesIO()
+    png_s = _best_of(lambda: heat.save(io.BytesIO(), format="PNG"), reps)
+    heat.save(out, format="PNG")
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "calib.png")
+        Path(src).write_bytes(data)
+        tiled_s = _best_of(lambda: run_detector_tiled(src), reps)
+    return {
+        "host": socket.gethostname(),
+        "code": code_version(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "calibration_px": size,
+        "decode_s_per_mpx": decode_s / mpx,
+        "detect_s_per_mpx": detect_s / mpx,
+        "png_s_per_mpx": png_s / mpx,
+        "png_bytes_per_px": len(out.getvalue()) / (size * size),
+        # le chemin par bandes inclut son décodage: on en retire celui de la source
+        "tiled_factor": max(1.0, (tiled_s - decode_s) / max(detect_s, 1e-9)),
+    }
+
+def load_or_calibrate(path: Path | None, force: bool = False, **kwargs) -> Dict[str, Any]:
+    """Modèle de coût en cache (même hôte, même code de détection), sinon recalibré et enregistré."""
+    if path is not None and not force:
+        try:
+            model = json.loads(Path(path).read_text(encoding="utf-8"))
+            if model.get("host") == socket.gethostname() and model.get("code") == code_version():
+                return model
+        except (OSError, ValueError):
+            pass
+    model = calibrate(**kwargs)
+    if path is not None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(model, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+    return model
+
+def plan_level(job, lv: int, model: Dict[str, Any], mem_budget_mb: float | None = None,
+               outdir: Path | None = None, checksum: bool = False) -> Dict[str, Any]:
+    """Prévision pour un (image, niveau): taille de sortie, secondes, Mo, signalements."""
+    row: Dict[str, Any] = {"image_id": job.image_id, "level": lv, "flags": []}
+    scale = level_scale(job, lv)
+    row["scale"] = scale
+    try:
+        est = estimate_detection_memory(str(job.source), scale)
+    except (OSError, ValueError) as e:
+        row.update(action="error", seconds=0.0, mem_mb=0.0, flags=["unreadable"], error=str(e))
+        return row
+    tiled, mem_mb = plan_level_memory(job, lv, mem_budget_mb)
+    src_mpx = est["width"] * est["height"] / 1e6
+    lvl_px = est["level_width"] * est["level_height"]
+    up_to_date = False
+    if outdir is not None:
+        try:
+            up_to_date = current_output(job, lv, outdir, level_fingerprint(job, lv, scale, checksum)) is not None
+        except OSError:
+            pass
+    seconds = (src_mpx * model["decode_s_per_mpx"]
+               + lvl_px / 1e6 * model["detect_s_per_mpx"] * (model["tiled_factor"] if tiled else 1.0)
+               + (lvl_px / 1e6 * model["png_s_per_mpx"] if job.save_png else 0.0))
+    flags = row["flags"]
+    if scale < 1:
+        flags.append("upsampled")
+    if lvl_px / 1e6 > HUGE_LEVEL_MPX:
+        flags.append("huge_level")
+    if not is_windowed(job.source) and src_mpx > HUGE_DECODE_MPX:
+        flags.append("full_decode")
+    if mem_budget_mb is not None and mem_mb > mem_budget_mb:
+        flags.append("over_budget")
+    row.update(
+        action="skip" if up_to_date else "tiled" if tiled else "run",
+        source_px=[est["width"], est["height"]],
+        output_px=[est["level_width"], est["level_height"]],
+        png_mb=round(lvl_px * model["png_bytes_per_px"] / 2 ** 20, 2) if job.save_png else 0.0,
+        seconds=0.0 if up_to_date else round(seconds, 3),
+        mem_mb=0.0 if up_to_date else mem_mb,
+    )
+    return row
+
+def makespan(durations: Sequence[float], workers: int) -> float:
+    """Durée totale prévue sur `workers` processus (plus longues tâches d'abord)."""
+    loads = [0.0] * max(1, workers)
+    for d in sorted(durations, reverse=True):
+        heapq.heapreplace(loads, loads[0] + d)
+    return max(loads)
+
+def plan_batch(jobs: Iterable, model: Dict[str, Any], workers: int = 1, mem_budget_mb: float | None = None,
+               out_root: Path | None = None, checksum: bool = False) -> Dict[str, Any]:
+    """Plan complet: lignes par niveau + totaux (temps séquentiel, durée par nombre de workers,
+    pic mémoire prévu, workers conseillés sous le budget)."""
+    rows: List[Dict[str, Any]] = []
+    for job in jobs:
+        outdir = None if out_root is None else Path(out_root) / job.image_id
+        rows.extend(plan_level(job, lv, model, mem_budget_mb, outdir, checksum) for lv in job.levels)
+    todo = [r for r in rows if r["action"] in ("run", "tiled")]
+    durations = [r["seconds"] for r in todo]
+    mems = sorted((r["mem_mb"] for r in todo), reverse=True)
+    cpus = os.cpu_count() or 1
+    counts = sorted({1, 2, 4, 8, 16, cpus, max(1, workers)})
+    peak = sum(mems[:max(1, workers)])
+    if mem_budget_mb is not None:
+        peak = min(peak, max(mem_budget_mb, mems[0] if mems else 0.0))
+    suggested = cpus
+    if mem_budget_mb is not None and mems:
+        # chaque worker doit pouvoir tenir une tâche typique (médiane) sous le budget
+        suggested = max(1, min(cpus, int(mem_budget_mb // max(mems[len(mems) // 2], 1e-3))))
+    by_action: Dict[str, int] = {}
+    for r in rows:
+        by_action[r["action"]] = by_action.get(r["action"], 0) + 1
+    return {
+        "levels": rows,
+        "totals": {
+            "levels": len(rows),
+            **{f"levels_{k}": v for k, v in sorted(by_action.items())},
+            "flagged": sum(bool(r["flags"]) for r in rows),
+            "cpu_seconds": round(sum(durations), 1),
+            "wall_seconds": {str(w): round(makespan(durations, w), 1) for w in counts},
+            "workers": max(1, workers),
+            "peak_mem_mb": round(peak, 1),
+            "largest_level_mem_mb": mems[0] if mems else 0.0,
+            "suggested_workers": suggested,
+            "png_mb": round(sum(r.get("png_mb", 0.0) for r in todo), 1),
+        },
+        "model": model,
+    }
+
+def format_plan(plan: Dict[str, Any], limit: int = 50) -> str:
+    rows = plan["levels"]
+    head = f"{'image':<24}{'lv':>4}{'action':>8}{'sortie':>14}{'s':>9}{'Mo':>9}  signalements"
+    lines = [head, "-" * len(head)]
+    # les plus coûteuses d'abord: c'est là qu'on cherche les entrées pathologiques
+    for r in sorted(rows, key=lambda r: (-len(r["flags"]), -r["seconds"]))[:limit]:
+        size = "x".join(map(str, r.get("output_px", []))) or "-"
+        lines.append(f"{r['image_id'][:23]:<24}{r['level']:>4}{r['action']:>8}{size:>14}{r['seconds']:>9.2f}"
+                     f"{r['mem_mb']:>9.1f}  {','.join(r['flags'])}")
+    if len(rows) > limit:
+        lines.append(f"… {len(rows) - limit} autres niveaux")
+    t = plan["totals"]
+    walls = ", ".join(f"{w}w {s}s" for w, s in t["wall_seconds"].items())
+    lines += ["", f"{t['levels']} niveaux ({', '.join(f'{k[7:]}: {v}' for k, v in t.items() if k.startswith('levels_'))}), "
+                  f"{t['flagged']} signalés",
+              f"temps CPU prévu {t['cpu_seconds']} s; durée: {walls}",
+              f"pic mémoire prévu {t['peak_mem_mb']} Mo à {t['workers']} workers "
+              f"(plus gros niveau {t['largest_level_mem_mb']} Mo); workers conseillés: {t['suggested_workers']}",
+              f"heatmaps PNG ~{t['png_mb']} Mo"]
+    return "\n".join(lines)
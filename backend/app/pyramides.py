@@ -1,15 +1,821 @@
-def generate_deepzoom(input_path, output_basename, tile_size=32, overlap=0, suffix=".jpg"):
+from __future__ import annotations
+import argparse, errno, hashlib, json, math, os, shutil, tempfile, threading
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_all_start_methods, get_context
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable
+import numpy as np
+from PIL import Image
+
+from .raster import display_strips, is_native_raster, is_windowed, open_raster, raster_size
+
+DZI_NS = "http://schemas.microsoft.com/deepzoom/2008"
+MANIFEST_NAME = "manifest.json"
+STAGING_PREFIX = ".staging-"  # dossiers de travail (dzsave, score de heatmap), non servis: préfixe '.'
+
+
+# Préréglages de tuilage sélectionnables par requête (cf. app.tiling_bench pour les mesurer)
+TILING_PRESETS: Dict[str, Dict[str, Any]] = {
+    "legacy": {"tile_size": 32, "overlap": 0, "suffix": ".jpg"},            # ancien défaut de generate_deepzoom
+    "standard": {"tile_size": 256, "overlap": 0, "suffix": ".jpg"},         # défaut historique de /generate-tiles
+    "osd": {"tile_size": 254, "overlap": 1, "suffix": ".jpg[Q=85]"},        # 256 px avec recouvrement (OpenSeadragon)
+    "large": {"tile_size": 512, "overlap": 0, "suffix": ".jpg[Q=85]"},      # moins de requêtes, tuiles plus lourdes
+    "webp": {"tile_size": 256, "overlap": 0, "suffix": ".webp[Q=80]"},
+    "lossless": {"tile_size": 256, "overlap": 0, "suffix": ".png"},         # heatmaps / données scientifiques
+}
+
+def tiling_preset(name: str) -> Dict[str, Any]:
+    """Paramètres (tile_size, overlap, suffix) d'un préréglage nommé."""
+    try:
+        return dict(TILING_PRESETS[name])
+    except KeyError:
+        raise ValueError(f"Préréglage de tuilage inconnu: {name} (disponibles: {', '.join(TILING_PRESETS)})") from None
+
+def split_suffix(suffix: str) -> tuple[str, str]:
+    """'.jpg[Q=90]' → ('.jpg', '[Q=90]')."""
+    ext, sep, opts = suffix.partition('[')
+    return ext, sep + opts
+
+def source_fingerprint(input_path) -> dict:
+    st = os.stat(input_path)
+    return {"path": str(Path(input_path).resolve()), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def dzi_xml(width: int, height: int, tile_size: int, overlap: int, fmt: str) -> str:
+    """Descripteur .dzi au format produit par dzsave."""
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<Image xmlns="{DZI_NS}"\n'
+        f'  Format="{fmt}"\n'
+        f'  Overlap="{overlap}"\n'
+        f'  TileSize="{tile_size}"\n'
+        '  >\n'
+        '  <Size \n'
+        f'    Height="{height}"\n'
+        f'    Width="{width}"\n'
+        '  />\n'
+        '</Image>\n'
+    )
+
+def write_dzi(output_basename, width: int, height: int, tile_size: int, overlap: int, fmt: str) -> Path:
+    """Écrit le descripteur .dzi (écriture atomique)."""
+    dzi = Path(f"{output_basename}.dzi")
+    tmp = dzi.with_name(dzi.name + ".tmp")
+    tmp.write_text(dzi_xml(width, height, tile_size, overlap, fmt), encoding="utf-8")
+    os.replace(tmp, dzi)
+    return dzi
+
+class PyramidManifest:
+    """Manifeste `<base>_files/manifest.json`: source, paramètres et avancement par niveau.
+
+    Chaque niveau enregistre ses propres paramètres et le nombre de lignes de tuiles
+    terminées, ce qui permet de reprendre après un crash et de ne reconstruire que
+    les niveaux dont les paramètres ont changé.
+    """
+
+    def __init__(self, files_dir: Path, data: Dict[str, Any] | None = None):
+        self.files_dir = Path(files_dir)
+        self.path = self.files_dir / MANIFEST_NAME
+        self.data: Dict[str, Any] = data or {"source": None, "width": None, "height": None, "levels": {}}
+
+    @classmethod
+    def load(cls, files_dir) -> "PyramidManifest":
+        p = Path(files_dir) / MANIFEST_NAME
+        try:
+            return cls(Path(files_dir), json.loads(p.read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            return cls(Path(files_dir))
+
+    def save(self) -> None:
+        self.files_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(MANIFEST_NAME + ".tmp")
+        tmp.write_text(json.dumps(self.data, indent=2), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    def reset_for(self, source: dict, width: int, height: int) -> None:
+        """Source modifiée → on oublie tous les niveaux."""
+        if self.data.get("source") != source:
+            self.data = {"source": source, "width": width, "height": height, "levels": {}}
+
+    def level(self, level: int) -> Dict[str, Any] | None:
+        return self.data["levels"].get(str(level))
+
+    def start_level(self, level: int, params: dict, cols: int, rows: int) -> int:
+        """Renvoie la première ligne à (re)générer pour ce niveau."""
+        rec = self.level(level)
+        if rec is None or rec.get("params") != params or rec.get("cols") != cols or rec.get("rows") != rows:
+            rec = {"params": params, "cols": cols, "rows": rows, "rows_done": 0, "done": False}
+            self.data["levels"][str(level)] = rec
+        return rec["rows_done"]
+
+    def mark_row(self, level: int, row: int) -> None:
+        rec = self.data["levels"][str(level)]
+        rec["rows_done"] = row + 1
+        rec["done"] = rec["rows_done"] >= rec["rows"]
+
+    def is_level_current(self, level: int, params: dict, cols: int, rows: int, ext: str) -> bool:
+        """Niveau terminé avec les mêmes paramètres et toutes ses tuiles présentes sur disque."""
+        rec = self.level(level)
+        if not rec or not rec.get("done") or rec.get("params") != params:
+            return False
+        if rec.get("cols") != cols or rec.get("rows") != rows:
+            return False
+        lvl_dir = self.files_dir / str(level)
+        try:
+            n = sum(1 for e in os.scandir(lvl_dir) if e.name.endswith(ext) and e.stat().st_size > 0)
+        except OSError:
+            return False
+        return n >= cols * rows
+
+def read_dzi(dzi_path) -> dict:
+    """Lit un descripteur .dzi → {width, height, tile_size, overlap, format}."""
+    root = ET.parse(dzi_path).getroot()
+    size = root.find(f"{{{DZI_NS}}}Size")
+    if size is None:
+        size = root.find("Size")
+    return {
+        "width": int(size.get("Width")),
+        "height": int(size.get("Height")),
+        "tile_size": int(root.get("TileSize")),
+        "overlap": int(root.get("Overlap")),
+        "format": root.get("Format"),
+    }
+
+def max_level(width: int, height: int) -> int:
+    """Indice du niveau pleine résolution (convention DeepZoom: niveau 0 = 1×1)."""
+    return int(math.ceil(math.log2(max(width, height, 1))))
+
+def level_size(width: int, height: int, level: int) -> tuple[int, int]:
+    """Dimensions (w, h) d'un niveau DZI."""
+    f = 2 ** (max_level(width, height) - level)
+    return max(1, int(math.ceil(width / f))), max(1, int(math.ceil(height / f)))
+
+def level_grid(width: int, height: int, level: int, tile_size: int) -> tuple[int, int]:
+    """Nombre de tuiles (colonnes, lignes) d'un niveau."""
+    lw, lh = level_size(width, height, level)
+    return int(math.ceil(lw / tile_size)), int(math.ceil(lh / tile_size))
+
+def tile_window(level_w: int, level_h: int, tile_size: int, overlap: int, col: int, row: int) -> tuple[int, int, int, int]:
+    """Fenêtre (x, y, w, h) couverte par la tuile col_row, recouvrement inclus."""
+    x = col * tile_size - (overlap if col > 0 else 0)
+    y = row * tile_size - (overlap if row > 0 else 0)
+    x1 = min(level_w, (col + 1) * tile_size + overlap)
+    y1 = min(level_h, (row + 1) * tile_size + overlap)
+    return x, y, x1 - x, y1 - y
+
+def encoding_suffix(manifest: PyramidManifest, suffix: str) -> str:
+    """Encodage réel des tuiles: celui d'un ré-encodage (recompress) s'il y en a eu un.
+
+    Les paramètres de niveau gardent le suffixe demandé à la génération: une même
+    demande reste à jour et les niveaux régénérés suivent l'encodage de la pyramide.
+    """
+    return (manifest.data.get("encoding") or {}).get("suffix") or suffix
+
+def _pyramid_state(input_path, output_basename, tile_size, overlap, suffix, levels, extra: dict | None = None):
+    """Charge le manifeste et liste les niveaux périmés (sans décoder la source)."""
+    files_dir = Path(f"{output_basename}_files")
+    manifest = PyramidManifest.load(files_dir)
+    src = source_fingerprint(input_path)
+    ext, _ = split_suffix(encoding_suffix(manifest, suffix))
+    params = {"tile_size": tile_size, "overlap": overlap, "suffix": suffix, **(extra or {})}
+    if manifest.data.get("source") != src or not Path(f"{output_basename}.dzi").exists():
+        return manifest, src, params, None
+    w, h = manifest.data["width"], manifest.data["height"]
+    wanted = range(max_level(w, h) + 1) if levels is None else levels
+    stale = [lv for lv in wanted
+             if not manifest.is_level_current(lv, params, *level_grid(w, h, lv, tile_size), ext)]
+    return manifest, src, params, stale
+
+def pyramid_is_current(input_path, output_basename, tile_size=256, overlap=0, suffix=".jpg",
+                       levels: Iterable[int] | None = None) -> bool:
+    """Vérification rapide: la pyramide existante correspond-elle à la source et aux paramètres?"""
+    _, _, _, stale = _pyramid_state(input_path, output_basename, tile_size, overlap, suffix, levels)
+    return stale == []
+
+def _heatmap_extra(sigma_low: float, sigma_high: float, alpha: int) -> dict:
+    return {"heatmap": {"sigma_low": sigma_low, "sigma_high": sigma_high, "alpha": alpha}}
+
+def heatmap_is_current(input_path, heatmap_basename, tile_size=256, overlap=0,
+                       sigma_low: float = 1.2, sigma_high: float = 2.5, alpha: int = 160) -> bool:
+    """Équivalent de pyramid_is_current pour une pyramide heatmap co-générée."""
+    _, _, _, stale = _pyramid_state(input_path, heatmap_basename, tile_size, overlap, ".png", None,
+                                    _heatmap_extra(sigma_low, sigma_high, alpha))
+    return stale == []
+
+def _blob_path(store: Path, data: bytes, ext: str) -> Path:
+    h = hashlib.blake2b(data, digest_size=16).hexdigest()
+    return store / h[:2] / f"{h}{ext}"
+
+# Liens durs impossibles (autre système de fichiers, FS sans liens, trop de liens)
+_NO_LINK = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP}
+
+def _link(src, dst) -> bool:
+    """os.link, False si le lien est impossible ici (la tuile reste alors un fichier ordinaire)."""
+    try:
+        os.link(src, dst)
+    except OSError as e:  # FileExistsError (EEXIST) remonte à l'appelant
+        if e.errno not in _NO_LINK:
+            raise
+        return False
+    return True
+
+def _commit_deduplicated(tmp: Path, final: Path, store: Path, ext: str) -> bool:
+    """Publie tmp en final via le magasin de blobs (liens durs); True si contenu déjà connu.
+
+    Les tuiles ne sont jamais réécrites en place (toujours fichier temporaire + os.replace),
+    donc partager un inode entre tuiles identiques est sûr. Si le magasin n'accepte pas
+    de liens (autre système de fichiers…), la tuile est publiée telle quelle, sans partage.
+    """
+    blob = _blob_path(store, tmp.read_bytes(), ext)
+    if blob.exists():
+        link = tmp.with_name(tmp.name + ".lnk")
+        if _link(blob, link):
+            os.replace(link, final)
+            os.remove(tmp)
+            return True
+    os.replace(tmp, final)
+    blob.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        _link(final, blob)
+    except FileExistsError:  # écrit entre-temps par un autre processus
+        pass
+    return False
+
+def dedupe_pyramid(output_basename, store) -> dict:
+    """Déduplique a posteriori une pyramide existante dans le magasin de blobs `store`."""
+    store, stats = Path(store), {"tiles": 0, "duplicates": 0, "bytes_saved": 0}
+    ext = "." + read_dzi(f"{output_basename}.dzi")["format"]
+    for root, _, files in os.walk(f"{output_basename}_files"):
+        for name in files:
+            if not name.endswith(ext) or name.startswith("."):
+                continue
+            path = Path(root, name)
+            data = path.read_bytes()
+            blob = _blob_path(store, data, ext)
+            stats["tiles"] += 1
+            if blob.exists():
+                if not os.path.samefile(blob, path):
+                    link = path.with_name(f".{name}.lnk")
+                    if not _link(blob, link):
+                        continue
+                    os.replace(link, path)
+                    stats["bytes_saved"] += len(data)
+                stats["duplicates"] += 1
+            else:
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                _link(path, blob)
+    return stats
+
+def prune_blob_store(store) -> int:
+    """Supprime les blobs plus référencés par aucune tuile (nombre de liens = 1)."""
+    removed = 0
+    for root, _, files in os.walk(store):
+        for name in files:
+            p = os.path.join(root, name)
+            if os.stat(p).st_nlink <= 1:
+                os.remove(p)
+                removed += 1
+    return removed
+
+class _PyramidWriter:
+    """Écriture atomique des tuiles + suivi manifeste/progression, commun aux moteurs."""
+
+    def __init__(self, output_basename, manifest: PyramidManifest, params: dict, todo: list,
+                 width: int, height: int, progress: Callable[[dict], None] | None = None,
+                 blob_store=None, suffix: str | None = None):
+        self.files_dir = Path(f"{output_basename}_files")
+        self.blob_store = None if blob_store is None else Path(blob_store)
+        self.duplicates, self.bytes_deduplicated = 0, 0
+        self.manifest, self.params, self.todo = manifest, params, set(todo)
+        self.width, self.height, self.tile_size = width, height, params["tile_size"]
+        self.suffix = suffix or params["suffix"]  # encodage effectif (cf. encoding_suffix)
+        self.ext, self.opts = split_suffix(self.suffix)
+        self.progress = progress
+        self.tiles_total = sum(c * r for c, r in (level_grid(width, height, lv, self.tile_size) for lv in todo))
+        self.written, self.nbytes, self.levels_done = 0, 0, []
+        self.start_rows: Dict[int, int] = {}
+
+    def first_row(self, level: int) -> int | None:
+        """Première ligne à écrire pour ce niveau, None s'il n'est pas à (re)générer."""
+        if level not in self.todo:
+            return None
+        if level not in self.start_rows:
+            cols, rows = level_grid(self.width, self.height, level, self.tile_size)
+            self.start_rows[level] = self.manifest.start_level(level, self.params, cols, rows)
+            (self.files_dir / str(level)).mkdir(parents=True, exist_ok=True)
+        return self.start_rows[level]
+
+    def tile_paths(self, level: int, col: int, row: int) -> tuple[Path, Path]:
+        d = self.files_dir / str(level)
+        return d / f".{col}_{row}.part{self.ext}", d / f"{col}_{row}{self.ext}"
+
+    def commit(self, tmp: Path, final: Path) -> None:
+        # écriture atomique: une tuile visible est toujours complète
+        if self.blob_store is not None and _commit_deduplicated(tmp, final, self.blob_store, self.ext):
+            self.duplicates += 1
+            self.bytes_deduplicated += final.stat().st_size
+        elif self.blob_store is None:
+            os.replace(tmp, final)
+        self.written += 1
+        self.nbytes += final.stat().st_size
+
+    def row_done(self, level: int, row: int) -> None:
+        self.manifest.mark_row(level, row)
+        self.manifest.save()
+        rows = self.manifest.level(level)["rows"]
+        if row == rows - 1:
+            self.levels_done.append(level)
+        if self.progress is not None:
+            self.progress({"tiles_written": self.written, "tiles_total": self.tiles_total,
+                           "bytes_written": self.nbytes, "levels_done": sorted(self.levels_done), "level": level})
+
+def vips_shrink_levels(image, k: int):
+    """k réductions 2×2 (moyenne) d'une image pyvips, bords impairs répliqués comme le
+    moteur NumPy: donne le niveau max - k de la pyramide."""
+    for _ in range(k):
+        if image.width % 2 or image.height % 2:
+            image = image.embed(0, 0, image.width + image.width % 2, image.height + image.height % 2,
+                                extend="copy")
+        image = image.shrink(2, 2)
+    return image
+
+def _sweep_staging(files_dir: Path) -> None:
+    """Supprime les dossiers de travail laissés par un arrêt brutal."""
+    for stale in files_dir.glob(f"{STAGING_PREFIX}*"):
+        shutil.rmtree(stale, ignore_errors=True)
+
+def _write_levels_vips(image, writer: _PyramidWriter, overlap: int) -> None:
+    """Moteur libvips: un dzsave (réductions en flux, tuiles encodées par libvips) dans
+    un dossier de travail caché sous <base>_files/, puis publication atomique des seuls
+    niveaux à (re)générer, ligne par ligne, avec le suivi manifeste habituel.
+
+    dzsave part du niveau périmé le plus fin: si seuls des niveaux grossiers sont à
+    refaire, la source est réduite d'autant et la pleine résolution n'est pas retuilée.
+    """
+    if not writer.todo:
+        return
+    top = max(writer.todo)
+    image = vips_shrink_levels(image, max_level(writer.width, writer.height) - top)
+    writer.files_dir.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=writer.files_dir))
+    try:
+        # dzsave numérote ses niveaux depuis 1×1: ceux de l'image réduite coïncident
+        image.dzsave(str(staging / "p"), tile_size=writer.tile_size, overlap=overlap, suffix=writer.suffix)
+        # niveaux grossiers d'abord: le viewer peut les afficher avant la fin
+        for lv in sorted(writer.todo):
+            start = writer.first_row(lv)
+            cols, rows = level_grid(writer.width, writer.height, lv, writer.tile_size)
+            for row in range(start, rows):
+                for col in range(cols):
+                    _, final = writer.tile_paths(lv, col, row)
+                    writer.commit(staging / "p_files" / str(lv) / final.name, final)
+                writer.row_done(lv, row)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+def pil_save_args(ext: str, opts: str) -> tuple[str, dict]:
+    """Traduit un suffixe vips ('.jpg[Q=90]') en format + options Pillow."""
+    fmt = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".webp": "WEBP"}.get(ext.lower())
+    if fmt is None:
+        raise ValueError(f"Format de tuile non supporté sans pyvips: {ext}")
+    kwargs: Dict[str, Any] = {}
+    for opt in filter(None, opts.strip("[]").split(",")):
+        key, _, val = opt.partition("=")
+        key = key.strip().lower()
+        if key == "q":
+            kwargs["quality"] = int(val)
+        elif key == "compression" and fmt == "PNG":
+            kwargs["compress_level"] = int(val)
+    return fmt, kwargs
+
+def save_tile(tile: np.ndarray, path, fmt: str, kwargs: dict) -> None:
+    im = Image.fromarray(tile)
+    if fmt == "JPEG" and im.mode == "RGBA":
+        im = im.convert("RGB")
+    im.save(path, format=fmt, **kwargs)
+
+def _encode_tile_shm(shm_name: str, shape: tuple, x: int, tw: int, path: str, fmt: str, kwargs: dict) -> None:
+    """Côté worker: lit la bande en mémoire partagée, encode et écrit une tuile."""
+    shm = SharedMemory(name=shm_name)
+    try:
+        band = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        tile = np.array(band[:, x:x + tw])
+        del band  # plus aucune vue sur shm.buf avant close()
+        save_tile(tile, path, fmt, kwargs)
+    finally:
+        shm.close()
+
+_pools: Dict[int, ProcessPoolExecutor] = {}
+_pools_lock = threading.Lock()
+
+def shared_process_pool(workers: int) -> ProcessPoolExecutor:
+    """Pool de processus d'encodage, un par taille, créé à la première demande et réutilisé.
+
+    Démarrage forkserver (spawn à défaut): le serveur appelle depuis des threads, et un
+    fork d'un processus multithreadé peut hériter de verrous pris et bloquer ses workers.
+    """
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None or getattr(pool, "_broken", False):  # worker mort: pool inutilisable
+            ctx = get_context("forkserver" if "forkserver" in get_all_start_methods() else "spawn")
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+        return pool
+
+class _TileEncoder:
+    """Encodage des lignes de tuiles: en ligne (workers <= 1) ou sur un pool de processus.
+
+    En mode pool (partagé, cf. shared_process_pool), chaque bande est copiée une fois
+    en mémoire partagée et les tuiles sont encodées en parallèle; les lignes sont validées (commit + manifeste) dans
+    l'ordre de soumission, avec un nombre borné de lignes en vol.
+    """
+
+    def __init__(self, writer: _PyramidWriter, fmt: str, kwargs: dict, workers: int = 1):
+        self.writer, self.fmt, self.kwargs = writer, fmt, kwargs
+        self.pool = shared_process_pool(workers) if workers > 1 else None
+        self.max_pending = 2 * max(1, workers)
+        self.pending: deque = deque()
+
+    def submit_row(self, level: int, row: int, band: np.ndarray, tiles: list) -> None:
+        """tiles = [(col, x, tw), ...] découpées dans la bande."""
+        paths = [self.writer.tile_paths(level, col, row) for col, _, _ in tiles]
+        if self.pool is None:
+            for (col, x, tw), (tmp, final) in zip(tiles, paths):
+                save_tile(band[:, x:x + tw], tmp, self.fmt, self.kwargs)
+                self.writer.commit(tmp, final)
+            self.writer.row_done(level, row)
+            return
+        band = np.ascontiguousarray(band)
+        shm = SharedMemory(create=True, size=max(1, band.nbytes))
+        np.ndarray(band.shape, dtype=band.dtype, buffer=shm.buf)[:] = band
+        futures = [self.pool.submit(_encode_tile_shm, shm.name, band.shape, x, tw, str(tmp), self.fmt, self.kwargs)
+                   for (_, x, tw), (tmp, _) in zip(tiles, paths)]
+        self.pending.append((level, row, shm, futures, paths))
+        while len(self.pending) > self.max_pending:
+            self._finish_oldest()
+
+    def _finish_oldest(self) -> None:
+        level, row, shm, futures, paths = self.pending.popleft()
+        try:
+            for f in futures:
+                f.result()
+            for tmp, final in paths:
+                self.writer.commit(tmp, final)
+            self.writer.row_done(level, row)
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def close(self) -> None:
+        try:
+            while self.pending:
+                self._finish_oldest()
+        finally:
+            for _, _, shm, futures, _ in self.pending:
+                for f in futures:
+                    f.cancel()
+                for f in futures:  # plus aucun worker sur la bande avant unlink
+                    if not f.cancelled():
+                        f.exception()
+                shm.close()
+                shm.unlink()
+            self.pending.clear()
+
+def _box_reduce(rows: np.ndarray) -> np.ndarray:
+    """Réduction 2×2 par moyenne (nombre de lignes pair; largeur impaire → bord répliqué)."""
+    if rows.shape[1] % 2:
+        rows = np.concatenate([rows, rows[:, -1:]], axis=1)
+    a = rows.astype(np.uint16)
+    s = a[0::2, 0::2] + a[1::2, 0::2] + a[0::2, 1::2] + a[1::2, 1::2]
+    return ((s + 2) // 4).astype(np.uint8)
+
+def box_reduce_levels(rows: np.ndarray, k: int) -> np.ndarray:
+    """k réductions 2×2 successives, bords impairs répliqués: même arithmétique que la
+    cascade de _LevelStream (une fenêtre alignée sur 2**k donne les pixels du niveau)."""
+    for _ in range(k):
+        if rows.shape[0] % 2:
+            rows = np.concatenate([rows, rows[-1:]])
+        rows = _box_reduce(rows)
+    return rows
+
+class _LevelStream:
+    """Un niveau de la pyramide en flux: bufferise les lignes reçues, émet ses lignes de
+    tuiles dès qu'elles sont complètes et transmet les lignes réduites au niveau inférieur."""
+
+    def __init__(self, level: int, writer: _PyramidWriter, overlap: int, encoder: _TileEncoder):
+        self.level, self.writer, self.overlap, self.encoder = level, writer, overlap, encoder
+        self.width, self.height = level_size(writer.width, writer.height, level)
+        self.cols, self.rows = level_grid(writer.width, writer.height, level, writer.tile_size)
+        self.buf: np.ndarray | None = None
+        self.buf_y0 = 0        # ordonnée absolue de buf[0]
+        self.next_row = 0      # prochaine ligne de tuiles à émettre
+        self.carry: np.ndarray | None = None  # ligne impaire en attente de réduction
+        # inutile de réduire en dessous du niveau le plus grossier demandé
+        self.child = _LevelStream(level - 1, writer, overlap, encoder) if level > min(writer.todo) else None
+
+    def push(self, rows: np.ndarray) -> None:
+        self.buf = rows if self.buf is None else np.concatenate([self.buf, rows])
+        self._emit(final=False)
+        if self.child is not None:
+            if self.carry is not None:
+                rows = np.concatenate([self.carry, rows])
+            n = rows.shape[0] - rows.shape[0] % 2
+            self.carry = rows[n:] if n < rows.shape[0] else None
+            if n:
+                self.child.push(_box_reduce(rows[:n]))
+
+    def finish(self) -> None:
+        self._emit(final=True)
+        if self.child is not None:
+            if self.carry is not None:
+                self.child.push(_box_reduce(np.concatenate([self.carry, self.carry])))
+                self.carry = None
+            self.child.finish()
+
+    def _emit(self, final: bool) -> None:
+        ts, ov = self.writer.tile_size, self.overlap
+        first = self.writer.first_row(self.level)
+        while self.next_row < self.rows:
+            r = self.next_row
+            _, y0, _, th = tile_window(self.width, self.height, ts, ov, 0, r)
+            y1 = y0 + th
+            if self.buf_y0 + self.buf.shape[0] < y1 and not final:
+                return
+            if first is not None and r >= first:
+                band = self.buf[y0 - self.buf_y0:y1 - self.buf_y0]
+                tiles = []
+                for c in range(self.cols):
+                    x, _, tw, _ = tile_window(self.width, self.height, ts, ov, c, r)
+                    tiles.append((c, x, tw))
+                self.encoder.submit_row(self.level, r, band, tiles)
+            self.next_row += 1
+            # garde seulement les lignes nécessaires à la prochaine ligne de tuiles
+            keep_from = max(0, (r + 1) * ts - ov)
+            drop = keep_from - self.buf_y0
+            if drop > 0:
+                self.buf = self.buf[drop:]
+                self.buf_y0 = keep_from
+
+def _pil_strips(input_path, strip_height: int):
+    """Lecture de la source par bandes horizontales (uint8 RGB/RGBA).
+
+    TIFF (avec tifffile) et sources 16 bits / flottantes passent par le lecteur raster:
+    seuls les segments recouvrant la bande sont décodés. Les autres formats (PNG, JPEG…)
+    n'ont pas d'accès fenêtré dans Pillow: l'image est décodée entière au premier crop,
+    la mémoire est alors celle de la source plus les bandes (cf. estimate_tiling_memory).
+    """
+    if is_native_raster(input_path):
+        # TIFF lu par segments, 16 bits / flottants / multi-bandes étirés en 8 bits
+        yield from display_strips(input_path, strip_height)
+        return
+    with Image.open(input_path) as im:
+        mode = "RGBA" if "A" in im.getbands() else "RGB"
+        w, h = im.size
+        for y0 in range(0, h, strip_height):
+            yield np.asarray(im.crop((0, y0, w, min(h, y0 + strip_height))).convert(mode))
+
+def estimate_tiling_memory(input_path, tile_size: int = 256, workers: int = 1) -> Dict[str, Any]:
+    """Mémoire de travail prévue du moteur sans libvips (en-tête seulement).
+
+    Bandes: ~2 bandes par niveau (série géométrique → 4 bandes du niveau max) plus les
+    lignes en vol de l'encodeur. Source fenêtrée: cache de ~2 rangées de segments;
+    sinon décodage complet de la source.
+    """
+    with open_raster(input_path) as r:
+        w, h, bands, itemsize = r.width, r.height, r.bands, r.dtype.itemsize
+    windowed = is_windowed(input_path)
+    strip_bytes = _strip_height(tile_size) * w * 4
+    work = strip_bytes * (4 + (2 * workers if workers > 1 else 0))
+    decode = 2 * _strip_height(tile_size) * w * bands * itemsize if windowed else w * h * max(bands, 3) * itemsize
+    return {"windowed": windowed, "decode_mb": round(decode / 2 ** 20, 1),
+            "strips_mb": round(work / 2 ** 20, 1), "total_mb": round((decode + work) / 2 ** 20, 1)}
+
+class _StreamingPyramid:
+    """Pyramide alimentée par bandes: niveau max → réductions 2×2 en cascade."""
+
+    def __init__(self, writer: _PyramidWriter, overlap: int, workers: int = 1):
+        self.writer = writer
+        self.encoder = None
+        self.top = None
+        if writer.todo:
+            fmt, kwargs = pil_save_args(writer.ext, writer.opts)
+            self.encoder = _TileEncoder(writer, fmt, kwargs, workers=workers)
+            self.top = _LevelStream(max_level(writer.width, writer.height), writer, overlap, self.encoder)
+
+    def push(self, rows: np.ndarray) -> None:
+        if self.top is not None:
+            self.top.push(rows)
+
+    def finish(self) -> None:
+        if self.top is not None:
+            self.top.finish()
+
+    def close(self) -> None:
+        if self.encoder is not None:
+            self.encoder.close()
+
+def _strip_height(tile_size: int) -> int:
+    return max(2, tile_size + (tile_size % 2))
+
+def _write_levels_numpy(input_path, writer: _PyramidWriter, overlap: int, workers: int = 1) -> None:
+    """Moteur sans libvips: bandes → tuiles du niveau max, puis réductions 2×2 en cascade.
+
+    La pyramide ne garde que quelques bandes par niveau, jamais un niveau entier; la
+    source elle-même n'est lue par fenêtres que si elle est fenêtrable (cf. _pil_strips).
+    """
+    pyramid = _StreamingPyramid(writer, overlap, workers)
+    try:
+        if pyramid.top is not None:
+            for rows in _pil_strips(input_path, _strip_height(writer.tile_size)):
+                pyramid.push(rows)
+            pyramid.finish()
+    finally:
+        pyramid.close()
+
+def _prepare_writer(output_basename, manifest: PyramidManifest, src: dict, params: dict, w: int, h: int,
+                    levels, force: bool, progress, blob_store=None) -> _PyramidWriter:
+    """Sélectionne les niveaux à (re)générer, écrit le .dzi et prépare l'écrivain de tuiles."""
+    tile_size = params["tile_size"]
+    _sweep_staging(manifest.files_dir)
+    manifest.reset_for(src, w, h)
+    suffix = encoding_suffix(manifest, params["suffix"])
+    ext, _ = split_suffix(suffix)
+    todo = list(range(max_level(w, h) + 1)) if levels is None else sorted(set(levels))
+    if not force:
+        todo = [lv for lv in todo if not manifest.is_level_current(lv, params, *level_grid(w, h, lv, tile_size), ext)]
+    for lv in todo:
+        # on ne reprend que les niveaux interrompus; un niveau « terminé » mais périmé repart de zéro
+        rec = manifest.level(lv)
+        if force or (rec is not None and rec.get("done")):
+            manifest.data["levels"].pop(str(lv), None)
+    write_dzi(output_basename, w, h, tile_size, params["overlap"], ext.lstrip('.'))
+    return _PyramidWriter(output_basename, manifest, params, todo, w, h, progress, blob_store, suffix)
+
+def generate_deepzoom(input_path, output_basename, tile_size=32, overlap=0, suffix=".jpg",
+                      levels: Iterable[int] | None = None, force: bool = False,
+                      progress: Callable[[dict], None] | None = None, workers: int = 1,
+                      dedupe_store=None) -> dict:
+    """Génère (ou complète) une pyramide DZI de façon incrémentale.
+
+    Les tuiles sont écrites niveau par niveau, ligne par ligne, de façon atomique; le
+    manifeste est mis à jour après chaque ligne. Un nouvel appel ne refait que les
+    niveaux absents, incomplets ou générés avec d'autres paramètres (no-op sinon).
+    `levels` restreint la génération à certains niveaux. `progress` reçoit après chaque
+    ligne un dict {tiles_written, tiles_total, bytes_written, levels_done, level}.
+    Sans pyvips, un moteur NumPy/Pillow en flux produit la même arborescence; son
+    encodage des tuiles est réparti sur `workers` processus et le rapport inclut sa
+    mémoire prévue ("memory", cf. estimate_tiling_memory). libvips gère lui-même ses
+    threads: `workers` y est sans effet, d'où "engine" et "workers" (effectifs) au rapport. Avec `dedupe_store`, les
+    tuiles identiques (océan, nodata, nuages) partagent un même fichier du magasin de blobs.
+    """
+    manifest, src, params, stale = _pyramid_state(input_path, output_basename, tile_size, overlap, suffix,
+                                                  None if levels is None else list(levels))
+    if stale == [] and not force:
+        return {"up_to_date": True, "levels_built": [], "tiles_written": 0}
+
     # Import paresseux pour éviter d'imposer pyvips si non utilisé au runtime
     try:
         import pyvips  # type: ignore
-    except Exception as e:
-        raise RuntimeError("pyvips est requis pour la génération de tuiles DZI. Veuillez installer libvips et pyvips.") from e
+    except Exception:
+        pyvips = None
+
+    if pyvips is not None:
+        image = pyvips.Image.new_from_file(str(input_path), access="sequential")
+        w, h = image.width, image.height
+    else:
+        w, h = raster_size(input_path)  # en-tête seulement
+    writer = _prepare_writer(output_basename, manifest, src, params, w, h, levels, force, progress, dedupe_store)
+    report: Dict[str, Any] = {"engine": "vips" if pyvips is not None else "numpy",
+                              "workers": 1 if pyvips is not None else workers}
+    if pyvips is not None:
+        _write_levels_vips(image, writer, overlap)
+    else:
+        report["memory"] = estimate_tiling_memory(input_path, tile_size, workers)
+        _write_levels_numpy(input_path, writer, overlap, workers=workers)
+    manifest.save()
+    return {"up_to_date": False, "levels_built": sorted(writer.todo), "tiles_written": writer.written,
+            "tiles_deduplicated": writer.duplicates, "bytes_deduplicated": writer.bytes_deduplicated, **report}
+
+
+def generate_deepzoom_with_heatmap(input_path, output_basename, heatmap_basename, tile_size=256, overlap=0,
+                                   suffix=".jpg", force: bool = False, workers: int = 1,
+                                   progress: Callable[[dict], None] | None = None, dedupe_store=None,
+                                   sigma_low: float = 1.2, sigma_high: float = 2.5, alpha: int = 160) -> dict:
+    """Pyramide image + pyramide heatmap (PNG RGBA) sur la même grille, en une seule lecture.
+
+    Les bandes décodées alimentent à la fois la pyramide image et le calcul du score
+    (par bandes avec halo, cf. detect.iter_raw_score_strips). Le score brut, dont le
+    min/max global n'est connu qu'en fin de lecture, est mis en attente en float16
+    (2 o/pixel) dans un dossier de travail caché sous <heatmap>_files/; il est ensuite
+    relu par bandes, normalisé, colorisé et réduit en pyramide comme l'image. Source
+    décodée et score calculé une seule fois; les deux manifestes restent incrémentaux.
+    """
+    from .detect import iter_raw_score_strips, colorize_array
+
+    heat_extra = _heatmap_extra(sigma_low, sigma_high, alpha)
+    img_m, src, img_params, img_stale = _pyramid_state(input_path, output_basename, tile_size, overlap, suffix, None)
+    heat_m, _, heat_params, heat_stale = _pyramid_state(input_path, heatmap_basename, tile_size, overlap, ".png",
+                                                        None, heat_extra)
+    if img_stale == [] and heat_stale == [] and not force:
+        return {"up_to_date": True, "image": {"levels_built": [], "tiles_written": 0},
+                "heatmap": {"levels_built": [], "tiles_written": 0}}
+
+    w, h = raster_size(input_path)  # en-tête seulement
+
+    def tagged(kind):
+        return None if progress is None else (lambda p: progress(dict(p, pyramid=kind)))
+
+    img_w = _prepare_writer(output_basename, img_m, src, img_params, w, h, None, force, tagged("image"), dedupe_store)
+    heat_w = _prepare_writer(heatmap_basename, heat_m, src, heat_params, w, h, None, force, tagged("heatmap"),
+                             dedupe_store)
+    strip = _strip_height(tile_size)
+
+    image_pyr = _StreamingPyramid(img_w, overlap, workers)
+
+    def tee():
+        for rows in _pil_strips(input_path, strip):
+            image_pyr.push(rows)
+            yield rows
+
+    staging = None
+    try:
+        # 1) unique lecture: pyramide image + score brut mis en attente (float16) et son min/max
+        lo, hi = np.inf, -np.inf
+        if heat_w.todo:
+            heat_w.files_dir.mkdir(parents=True, exist_ok=True)
+            staging = Path(tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=heat_w.files_dir))
+            with open(staging / "score.f16", "wb") as spool:
+                for sc in iter_raw_score_strips(tee(), sigma_low, sigma_high):
+                    lo, hi = min(lo, float(sc.min())), max(hi, float(sc.max()))
+                    spool.write(sc.astype(np.float16).tobytes())
+        elif image_pyr.top is not None:
+            for _ in tee():
+                pass
+        image_pyr.finish()
+        image_pyr.close()
+        img_m.save()
+
+        # 2) score relu par bandes, normalisé, colorisé → pyramide heatmap
+        if staging is not None:
+            heat_pyr = _StreamingPyramid(heat_w, overlap, workers)
+            try:
+                span = hi - lo
+                with open(staging / "score.f16", "rb") as spool:
+                    for y0 in range(0, h, strip):
+                        n = min(strip, h - y0)
+                        sc = np.fromfile(spool, dtype=np.float16, count=n * w).reshape(n, w).astype(np.float32)
+                        sc01 = np.clip((sc - lo) / span, 0.0, 1.0) if span > 0 else np.zeros_like(sc)
+                        heat_pyr.push(colorize_array(sc01, alpha))
+                heat_pyr.finish()
+            finally:
+                heat_pyr.close()
+            heat_m.save()
+    finally:
+        image_pyr.close()
+        if staging is not None:
+            shutil.rmtree(staging, ignore_errors=True)
 
-    image = pyvips.Image.new_from_file(input_path, access="sequential")
-    image.dzsave(output_basename, tile_size=tile_size, overlap=overlap, suffix=suffix)
+    def summary(wr):
+        return {"levels_built": sorted(wr.todo), "tiles_written": wr.written,
+                "tiles_deduplicated": wr.duplicates, "bytes_deduplicated": wr.bytes_deduplicated}
+    return {"up_to_date": False, "engine": "numpy", "workers": workers,
+            "image": summary(img_w), "heatmap": summary(heat_w)}
 
+def main():
+    ap = argparse.ArgumentParser(description="Génération de pyramides DZI (incrémentale).")
+    ap.add_argument("input", type=str, help="Image source.")
+    ap.add_argument("output", type=str, help="Nom de base de sortie (<base>.dzi, <base>_files/).")
+    ap.add_argument("--preset", type=str, default=None, choices=sorted(TILING_PRESETS),
+                    help="Préréglage de tuilage (remplace --tile-size/--overlap/--suffix).")
+    ap.add_argument("--tile-size", type=int, default=256, help="Taille des tuiles.")
+    ap.add_argument("--overlap", type=int, default=0, help="Recouvrement des tuiles.")
+    ap.add_argument("--suffix", type=str, default=".jpg", help="Suffixe vips, ex. .jpg[Q=85].")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processus d'encodage des tuiles.")
+    ap.add_argument("--force", action="store_true", help="Régénère tout, même si à jour.")
+    ap.add_argument("--heatmap", type=str, default=None,
+                    help="Nom de base d'une pyramide heatmap co-générée (même grille).")
+    ap.add_argument("--dedupe-store", type=str, default=None,
+                    help="Magasin de blobs partagé: tuiles identiques stockées une seule fois.")
+    ap.add_argument("--pack", action="store_true", help="Empaquette le résultat dans <base>.dzpack.")
+    args = ap.parse_args()
+    if args.preset:
+        preset = tiling_preset(args.preset)
+        args.tile_size, args.overlap, args.suffix = preset["tile_size"], preset["overlap"], preset["suffix"]
+    if args.heatmap:
+        report = generate_deepzoom_with_heatmap(args.input, args.output, args.heatmap, tile_size=args.tile_size,
+                                                overlap=args.overlap, suffix=args.suffix, force=args.force,
+                                                workers=args.workers, dedupe_store=args.dedupe_store)
+    else:
+        report = generate_deepzoom(args.input, args.output, tile_size=args.tile_size, overlap=args.overlap,
+                                   suffix=args.suffix, force=args.force, workers=args.workers,
+                                   dedupe_store=args.dedupe_store)
+    if args.pack:
+        from .tilepack import pack_pyramid
+        report["pack"] = str(pack_pyramid(args.output, remove_files=True))
+        if args.heatmap:
+            report["heatmap_pack"] = str(pack_pyramid(args.heatmap, remove_files=True))
+    print(json.dumps(report))
 
-#if __name__ == "__main__":
-    #input_image = "backend/data/sydneyflooding_oli.jpg"
-    #output_name = "output/slide"
-    #generate_deepzoom(input_image, output_name, tile_size=256, suffix=".jpg")
+if __name__ == "__main__":
+    main()
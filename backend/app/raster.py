@@ -0,0 +1,247 @@
+from __future__ import annotations
+import abc
+import math
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterator, List, Sequence, Tuple
+import numpy as np
+from PIL import Image
+
+# Lecture fenêtrée des sources raster (TIFF/GeoTIFF tuilés ou en bandes, 16 bits,
+# multi-bandes). Avec tifffile, seuls les segments (tuiles/bandes TIFF) recouvrant la
+# fenêtre demandée sont lus et décodés; sinon repli Pillow (image chargée une fois).
+# Les valeurs restent dans le type natif (uint16, float32…): aucune troncature 8 bits.
+TIFF_SUFFIXES = (".tif", ".tiff")
+# Budget (octets) d'une fenêtre source lue par read_resampled
+WINDOW_BYTES = 64 * 1024 * 1024
+
+def _tifffile():
+    # Import paresseux: tifffile est optionnel (extra "raster")
+    try:
+        import tifffile  # type: ignore
+    except Exception:
+        return None
+    return tifffile
+
+class RasterReader(abc.ABC):
+    """Interface commune: dimensions, nombre de bandes, type natif et lecture par fenêtre."""
+
+    width: int
+    height: int
+    bands: int
+    dtype: np.dtype
+
+    @abc.abstractmethod
+    def read(self, x: int, y: int, w: int, h: int, bands: Sequence[int] | None = None) -> np.ndarray:
+        """Fenêtre (h, w, nb) dans le type natif de la source."""
+
+    def strips(self, strip_height: int, bands: Sequence[int] | None = None) -> Iterator[np.ndarray]:
+        for y0 in range(0, self.height, strip_height):
+            yield self.read(0, y0, self.width, min(strip_height, self.height - y0), bands)
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "RasterReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+class _TiffReader(RasterReader):
+    """Premier niveau de la première série TIFF, lu segment par segment."""
+
+    def __init__(self, path, tifffile, cache_segments: int | None = None):
+        self._tif = tifffile.TiffFile(str(path))
+        page = self._tif.series[0].levels[0].keyframe
+        self._page = page
+        self.height, self.width = int(page.imagelength), int(page.imagewidth)
+        self.bands = int(page.samplesperpixel)
+        self.dtype = np.dtype(page.dtype)
+        self._seg_h = int(page.tilelength) if page.is_tiled else min(int(page.rowsperstrip) or self.height, self.height)
+        self._seg_w = int(page.tilewidth) if page.is_tiled else self.width
+        self._across = math.ceil(self.width / self._seg_w)
+        self._down = math.ceil(self.height / self._seg_h)
+        self._planar = page.planarconfig == 2 and self.bands > 1
+        self._decode = page.decode
+        # ~deux rangées de segments: une lecture par bandes décode chaque segment une fois
+        self._cache: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        self._cache_max = cache_segments or 2 * self._across * (self.bands if self._planar else 1)
+
+    def _segment(self, index: int) -> np.ndarray:
+        seg = self._cache.get(index)
+        if seg is not None:
+            self._cache.move_to_end(index)
+            return seg
+        offset, count = self._page.dataoffsets[index], self._page.databytecounts[index]
+        data = None
+        if count:
+            fh = self._tif.filehandle
+            fh.seek(offset)
+            data = fh.read(count)
+        seg, _, _ = self._decode(data, index)
+        if seg is None:  # segment absent: valeur de remplissage
+            seg = np.zeros((1, self._seg_h, self._seg_w, 1 if self._planar else self.bands), dtype=self.dtype)
+        seg = seg.reshape(seg.shape[-3:])
+        self._cache[index] = seg
+        if len(self._cache) > self._cache_max:
+            self._cache.popitem(last=False)
+        return seg
+
+    def read(self, x, y, w, h, bands=None):
+        sel = list(range(self.bands)) if bands is None else list(bands)
+        out = np.empty((h, w, len(sel)), dtype=self.dtype)
+        r0, r1 = y // self._seg_h, (y + h - 1) // self._seg_h
+        c0, c1 = x // self._seg_w, (x + w - 1) // self._seg_w
+        for r in range(r0, r1 + 1):
+            sy0 = r * self._seg_h
+            ya, yb = max(y, sy0), min(y + h, sy0 + self._seg_h)
+            for c in range(c0, c1 + 1):
+                sx0 = c * self._seg_w
+                xa, xb = max(x, sx0), min(x + w, sx0 + self._seg_w)
+                dst = out[ya - y:yb - y, xa - x:xb - x]
+                if self._planar:
+                    for i, b in enumerate(sel):
+                        seg = self._segment((b * self._down + r) * self._across + c)
+                        dst[..., i] = seg[ya - sy0:yb - sy0, xa - sx0:xb - sx0, 0]
+                else:
+                    seg = self._segment(r * self._across + c)
+                    dst[...] = seg[ya - sy0:yb - sy0, xa - sx0:xb - sx0][..., sel]
+        return out
+
+    def close(self):
+        self._cache.clear()
+        self._tif.close()
+
+class _PilReader(RasterReader):
+    """Repli Pillow: modes 16 bits / flottants conservés, image décodée au premier accès."""
+
+    def __init__(self, path):
+        self._path = str(path)
+        with Image.open(self._path) as im:
+            self.width, self.height = im.size
+            self._mode = im.mode
+            self.bands = len(im.getbands()) if im.mode != "P" else 3
+        self._arr: np.ndarray | None = None
+        self.dtype = np.dtype(np.uint8) if self._mode not in ("I", "F") and not self._mode.startswith("I;16") \
+            else np.dtype({"I": np.int32, "F": np.float32}.get(self._mode, np.uint16))
+
+    def _array(self) -> np.ndarray:
+        if self._arr is None:
+            with Image.open(self._path) as im:
+                if im.mode == "P":
+                    im = im.convert("RGBA" if "transparency" in im.info else "RGB")
+                arr = np.asarray(im)
+            if arr.dtype != self.dtype:
+                arr = arr.astype(self.dtype)
+            self._arr = arr if arr.ndim == 3 else arr[..., None]
+            self.bands = self._arr.shape[-1]
+        return self._arr
+
+    def read(self, x, y, w, h, bands=None):
+        win = self._array()[y:y + h, x:x + w]
+        return win if bands is None else win[..., list(bands)]
+
+    def close(self):
+        self._arr = None
+
+def is_windowed(path) -> bool:
+    """Vrai si la source est lue par fenêtres (TIFF + tifffile disponible)."""
+    return Path(path).suffix.lower() in TIFF_SUFFIXES and _tifffile() is not None
+
+def is_native_raster(path) -> bool:
+    """Vrai si la source doit passer par le lecteur raster plutôt que par un simple
+    Image.convert('RGB'): TIFF fenêtré, ou mode Pillow 16 bits / entier / flottant."""
+    if is_windowed(path):
+        return True
+    with Image.open(path) as im:
+        return im.mode in ("I", "F") or im.mode.startswith("I;16")
+
+def open_raster(path) -> RasterReader:
+    tifffile = _tifffile() if Path(path).suffix.lower() in TIFF_SUFFIXES else None
+    if tifffile is not None:
+        return _TiffReader(path, tifffile)
+    return _PilReader(path)
+
+def raster_size(path) -> Tuple[int, int]:
+    """(largeur, hauteur) sans décoder les pixels."""
+    with open_raster(path) as r:
+        return r.width, r.height
+
+def display_bands(reader: RasterReader, bands: Sequence[int] | None = None) -> List[int]:
+    """Bandes affichées: sélection explicite, sinon RGB(A) ou première bande en gris."""
+    if bands is not None:
+        return list(bands)
+    if reader.bands >= 3:
+        return [0, 1, 2, 3] if reader.bands == 4 and reader.dtype == np.uint8 else [0, 1, 2]
+    return [0]
+
+def band_ranges(reader: RasterReader, bands: Sequence[int], strip_height: int = 512) -> List[Tuple[float, float]]:
+    """Min/max par bande sur toute l'image (une passe par bandes, NaN ignorés)."""
+    lo = np.full(len(bands), np.inf)
+    hi = np.full(len(bands), -np.inf)
+    for strip in reader.strips(strip_height, bands):
+        s = strip.reshape(-1, len(bands))
+        if s.dtype.kind == "f":
+            lo, hi = np.fmin(lo, np.nanmin(s, axis=0)), np.fmax(hi, np.nanmax(s, axis=0))
+        else:
+            lo, hi = np.minimum(lo, s.min(axis=0)), np.maximum(hi, s.max(axis=0))
+    return [(float(a), float(b)) for a, b in zip(lo, hi)]
+
+def to_display(window: np.ndarray, ranges: Sequence[Tuple[float, float]] | None) -> np.ndarray:
+    """Fenêtre native → uint8 RGB/RGBA (étirement linéaire par bande si `ranges`)."""
+    if ranges is not None:
+        lo = np.array([r[0] for r in ranges], dtype=np.float32)
+        span = np.array([max(r[1] - r[0], 1e-12) for r in ranges], dtype=np.float32)
+        out = np.clip((window.astype(np.float32) - lo) / span * 255.0 + 0.5, 0, 255)
+        window = np.nan_to_num(out, nan=0.0).astype(np.uint8)
+    elif window.dtype != np.uint8:  # source 8 bits rééchantillonnée en flottants
+        window = np.clip(np.rint(window), 0, 255).astype(np.uint8)
+    if window.shape[-1] == 1:
+        window = np.repeat(window, 3, axis=-1)
+    return np.ascontiguousarray(window)
+
+def display_params(path, bands: Sequence[int] | None = None) -> dict:
+    """Bandes affichées et plages d'étirement (None pour une source 8 bits)."""
+    with open_raster(path) as reader:
+        sel = display_bands(reader, bands)
+        return {"bands": sel, "ranges": None if reader.dtype == np.uint8 else band_ranges(reader, sel)}
+
+def display_strips(path, strip_height: int, bands: Sequence[int] | None = None) -> Iterator[np.ndarray]:
+    """Bandes horizontales uint8 RGB/RGBA pour le tuilage (2 passes si la source n'est pas 8 bits)."""
+    with open_raster(path) as reader:
+        sel = display_bands(reader, bands)
+        ranges = None if reader.dtype == np.uint8 else band_ranges(reader, sel)
+        for strip in reader.strips(strip_height, sel):
+            yield to_display(strip, ranges)
+
+def read_resampled(reader: RasterReader, size: Tuple[int, int], bands: Sequence[int] | None = None,
+                   box: Tuple[float, float, float, float] | None = None, chunk_rows: int | None = None,
+                   budget: int = WINDOW_BYTES) -> np.ndarray:
+    """Zone `box` (x0, y0, x1, y1 source; image entière par défaut) rééchantillonnée à
+    `size` (filtre boîte), en float32 (h, w, nb).
+
+    La source est lue par fenêtres de `chunk_rows` lignes de sortie, déduites par défaut
+    de `budget` (fenêtre native + copie float32 + une bande contiguë): la mémoire de
+    travail est celle du résultat plus ce budget, quelles que soient la taille de la
+    source et l'échelle.
+    """
+    tw, th = size
+    bx0, by0, bx1, by1 = box if box is not None else (0.0, 0.0, float(reader.width), float(reader.height))
+    x0, x1 = int(math.floor(bx0)), min(reader.width, int(math.ceil(bx1)))
+    sel = list(range(reader.bands)) if bands is None else list(bands)
+    out = np.empty((th, tw, len(sel)), dtype=np.float32)
+    ry = (by1 - by0) / th
+    if chunk_rows is None:
+        row_bytes = (x1 - x0) * (len(sel) * (reader.dtype.itemsize + 4) + 4)
+        chunk_rows = max(1, int(budget // (math.ceil(ry) * row_bytes)))
+    for oy0 in range(0, th, chunk_rows):
+        oy1 = min(th, oy0 + chunk_rows)
+        fy0, fy1 = by0 + oy0 * ry, by0 + oy1 * ry
+        y0, y1 = int(math.floor(fy0)), min(reader.height, int(math.ceil(fy1)))
+        win = reader.read(x0, y0, x1 - x0, y1 - y0, sel).astype(np.float32)
+        sub = (bx0 - x0, fy0 - y0, bx1 - x0, fy1 - y0)
+        for i in range(len(sel)):
+            band = Image.fromarray(np.ascontiguousarray(win[..., i]), mode="F")
+            out[oy0:oy1, :, i] = np.asarray(band.resize((tw, oy1 - oy0), Image.BOX, box=sub))
+    return out
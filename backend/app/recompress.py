@@ -0,0 +1,143 @@
+from __future__ import annotations
+import argparse, io, json, os
+from pathlib import Path
+from typing import Callable, Dict, List
+from PIL import Image
+
+from .pyramides import PyramidManifest, read_dzi, shared_process_pool, write_dzi
+
+# Ré-encodage en lot d'une pyramide DZI existante (remplace py#3/compress_titles.py).
+FORMATS = {"jpg": "JPEG", "jpeg": "JPEG", "webp": "WEBP", "png": "PNG"}
+
+def encode_options(fmt: str, quality: int = 80, png_level: int = 9) -> dict:
+    """Options Pillow par format: JPEG optimisé, WebP méthode lente, PNG zlib réglable."""
+    if fmt == "JPEG":
+        return {"quality": quality, "optimize": True}
+    if fmt == "WEBP":
+        return {"quality": quality, "method": 6}
+    return {"compress_level": png_level}
+
+def encode_suffix(target: str, quality: int = 80, png_level: int = 9) -> str:
+    """Suffixe de tuilage équivalent aux options d'encodage (enregistré dans le manifeste)."""
+    return f".{target}[compression={png_level}]" if FORMATS[target] == "PNG" else f".{target}[Q={quality}]"
+
+def _recompress_tile(task: tuple) -> tuple:
+    """Côté worker: ré-encode une tuile dans un fichier temporaire → (niveau, src, tmp, taille avant, après)."""
+    level, src, tmp, fmt, opts = task
+    with Image.open(src) as im:
+        if fmt == "JPEG":
+            if "A" in im.getbands() or "transparency" in im.info:
+                raise ValueError(f"Tuile avec canal alpha ({src}): conversion JPEG refusée")
+            if im.mode not in ("RGB", "L"):
+                im = im.convert("RGB")
+        buf = io.BytesIO()
+        im.save(buf, format=fmt, **opts)
+    Path(tmp).write_bytes(buf.getvalue())
+    return level, src, tmp, os.path.getsize(src), buf.tell()
+
+def recompress_pyramid(output_basename, target: str = "jpg", quality: int = 80, png_level: int = 9,
+                       workers: int = 1, progress: Callable[[dict], None] | None = None) -> dict:
+    """Ré-encode toutes les tuiles d'une pyramide en parallèle.
+
+    Même format: chaque tuile n'est remplacée (atomiquement) que si la nouvelle version
+    est plus petite. Changement de format: la pyramide entière bascule (le .dzi n'a qu'un
+    Format) et seulement si le total diminue. Les nouvelles tuiles sont d'abord toutes
+    publiées à côté des anciennes, puis le manifeste et le .dzi (point de bascule), et
+    seulement ensuite les anciennes sont supprimées: le viewer ne voit jamais de trou,
+    et un échec en cours de route laisse l'ancienne pyramide intacte.
+    """
+    target = target.lower().lstrip(".")
+    if target not in FORMATS:
+        raise ValueError(f"Format cible non supporté: {target}")
+    info = read_dzi(f"{output_basename}.dzi")
+    old_ext, new_ext = "." + info["format"], "." + target
+    same_format = old_ext == new_ext
+    fmt, opts = FORMATS[target], encode_options(FORMATS[target], quality, png_level)
+    files_dir = Path(f"{output_basename}_files")
+
+    tasks: List[tuple] = []
+    for lvl_dir in sorted((d for d in files_dir.iterdir() if d.is_dir() and d.name.isdigit()), key=lambda d: int(d.name)):
+        for entry in os.scandir(lvl_dir):
+            if entry.name.endswith(old_ext) and not entry.name.startswith("."):
+                stem = entry.name[:-len(old_ext)]
+                tasks.append((int(lvl_dir.name), entry.path, str(lvl_dir / f".{stem}.recomp{new_ext}"), fmt, opts))
+
+    def report(i: int) -> None:
+        if progress is not None and (i % 64 == 0 or i == len(tasks)):
+            progress({"tiles_written": i, "tiles_total": len(tasks)})
+
+    levels: Dict[int, Dict[str, int]] = {}
+    results: List[tuple] = []
+    published: List[str] = []  # nouvelles tuiles visibles (changement de format)
+    commit = False
+    try:
+        if workers > 1:
+            it = shared_process_pool(workers).map(_recompress_tile, tasks,
+                                                  chunksize=max(1, len(tasks) // (workers * 8)))
+            for i, res in enumerate(it, 1):
+                results.append(res)
+                report(i)
+        else:
+            for i, task in enumerate(tasks, 1):
+                results.append(_recompress_tile(task))
+                report(i)
+
+        before_total = sum(r[3] for r in results)
+        after_total = sum(min(r[3], r[4]) if same_format else r[4] for r in results)
+        commit = same_format or after_total < before_total
+        for level, src, tmp, before, after in results:
+            lv = levels.setdefault(level, {"tiles": 0, "replaced": 0, "bytes_before": 0, "bytes_after": 0})
+            lv["tiles"] += 1
+            lv["bytes_before"] += before
+            if commit and (not same_format or after < before):
+                # remplacement atomique (sûr aussi pour les tuiles en liens durs)
+                final = src[:-len(old_ext)] + new_ext
+                os.replace(tmp, final)
+                if not same_format:
+                    published.append(final)
+                lv["replaced"] += 1
+                lv["bytes_after"] += after
+            else:
+                lv["bytes_after"] += before
+
+        if commit and not same_format:
+            manifest = PyramidManifest.load(files_dir)
+            if manifest.data.get("levels"):
+                manifest.data["encoding"] = {"suffix": encode_suffix(target, quality, png_level)}
+                manifest.save()
+            write_dzi(output_basename, info["width"], info["height"], info["tile_size"], info["overlap"], target)
+            published = []  # basculé: les nouvelles tuiles restent
+    finally:
+        for task in tasks:
+            if os.path.exists(task[2]):
+                os.remove(task[2])
+        for path in published:  # échec avant la bascule: on retire les tuiles au nouveau format
+            os.remove(path)
+
+    if commit and not same_format:
+        for _, src, _, _, _ in results:
+            os.remove(src)
+
+    for lv in levels.values():
+        lv["bytes_saved"] = lv["bytes_before"] - lv["bytes_after"]
+    return {
+        "format": target if commit else info["format"],
+        "committed": commit,
+        "bytes_saved": sum(lv["bytes_saved"] for lv in levels.values()),
+        "levels": {str(k): v for k, v in sorted(levels.items())},
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Ré-encodage parallèle d'une pyramide DZI.")
+    ap.add_argument("output", type=str, help="Nom de base de la pyramide (<base>.dzi).")
+    ap.add_argument("--format", type=str, default="jpg", choices=sorted(FORMATS), help="Format cible.")
+    ap.add_argument("--quality", type=int, default=80, help="Qualité JPEG/WebP.")
+    ap.add_argument("--png-level", type=int, default=9, help="Niveau zlib PNG (0-9).")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processus d'encodage.")
+    args = ap.parse_args()
+    report = recompress_pyramid(args.output, target=args.format, quality=args.quality,
+                                png_level=args.png_level, workers=args.workers)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+from __future__ import annotations
+import argparse, json, re, sqlite3, sys, time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Sequence
+
+# Table unique des statistiques par (image, niveau), alimentée par l'orchestrateur en
+# plus des JSON par niveau: les filtres et agrégats sur toute une archive deviennent
+# une requête indexée au lieu de l'ouverture de milliers de petits fichiers.
+RESULTS_NAME = "results.sqlite"
+
+COLUMNS = {
+    "image_id": "TEXT NOT NULL", "level": "INTEGER NOT NULL", "source": "TEXT", "scale": "REAL",
+    "min": "REAL", "max": "REAL", "mean": "REAL", "std": "REAL", "width": "INTEGER", "height": "INTEGER",
+    "elapsed_ms": "REAL", "peak_mem_mb": "REAL", "skipped": "INTEGER", "error": "TEXT", "updated": "REAL",
+}
+_STATS = ("min", "max", "mean", "std", "width", "height")
+_AGGS = {"count": "COUNT", "min": "MIN", "max": "MAX", "mean": "AVG", "avg": "AVG", "sum": "SUM"}
+_OPS = {"=": "=", "!=": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">=", "~": "LIKE"}
+_WHERE_RE = re.compile(r"^\s*(\w+)\s*(<=|>=|!=|=|<|>|~)\s*(.+?)\s*$")
+_AGG_RE = re.compile(r"^\s*(\w+)\s*(?:\(\s*(\w+|\*)?\s*\))?\s*$")
+
+class ResultsStore:
+    def __init__(self, path, timeout: float = 60.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), timeout=timeout)
+        cols = ", ".join(f"{k} {v}" for k, v in COLUMNS.items())
+        with self._db:
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS levels ({cols}, PRIMARY KEY (image_id, level))")
+            self._db.execute("CREATE INDEX IF NOT EXISTS levels_level_max ON levels (level, max)")
+
+    def add(self, results: Iterable[Dict[str, Any]]) -> int:
+        """Insère/remplace les lignes (image, niveau) de résultats de run_job; renvoie le nombre de lignes."""
+        now = time.time()
+        rows = []
+        for res in results:
+            for r in res["levels"]:
+                stats = r.get("stats") or {}
+                rows.append((res["image_id"], r["level"], res.get("source"), r.get("scale"),
+                             *(stats.get(k) for k in _STATS), r.get("elapsed_ms"), r.get("peak_mem_mb"),
+                             None if "skipped" not in r else int(bool(r["skipped"])), r.get("error"), now))
+        marks = ", ".join("?" * len(COLUMNS))
+        with self._db:
+            self._db.executemany(f"INSERT OR REPLACE INTO levels ({', '.join(COLUMNS)}) VALUES ({marks})", rows)
+        return len(rows)
+
+    def query(self, where: Sequence[str] = (), select: Sequence[str] | None = None, aggs: Sequence[str] = (),
+              group_by: Sequence[str] = (), order: Sequence[str] = (), limit: int | None = None) -> List[Dict[str, Any]]:
+        """Lignes (dicts) filtrées par `where` ("max>0.9", "level=4", "image_id~scene%").
+
+        `aggs` ("count", "mean(max)"…) avec éventuellement `group_by`; `order` accepte
+        "-col" pour un tri décroissant. Lève ValueError pour une colonne ou un opérateur inconnu.
+        """
+        params: List[Any] = []
+        clauses = []
+        for w in where:
+            m = _WHERE_RE.match(w)
+            if m is None:
+                raise ValueError(f"Filtre invalide: {w!r} (attendu: colonne<op>valeur)")
+            col, op, raw = m.groups()
+            clauses.append(f"{_column(col)} {_OPS[op]} ?")
+            params.append(_value(raw))
+        if aggs:
+            exprs = [_column(c) for c in group_by]
+            names = list(group_by)
+            for a in aggs:
+                m = _AGG_RE.match(a)
+                fn, col = (m.group(1).lower(), m.group(2)) if m else (None, None)
+                if fn not in _AGGS or (fn != "count" and col in (None, "*")):
+                    raise ValueError(f"Agrégat invalide: {a!r} (count, min/max/mean/sum(colonne))")
+                exprs.append(f"{_AGGS[fn]}({'*' if col in (None, '*') else _column(col)})")
+                names.append(fn if col in (None, "*") else f"{fn}({col})")
+        else:
+            names = list(select) if select else list(COLUMNS)
+            exprs = [_column(c) for c in names]
+        sql = "SELECT " + ", ".join(f'{e} AS "{n}"' for e, n in zip(exprs, names)) + " FROM levels"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        if aggs and group_by:
+            sql += " GROUP BY " + ", ".join(_column(c) for c in group_by)
+        if order:
+            keys = []
+            for o in order:
+                col = o.lstrip("-")
+                keys.append((f'"{col}"' if col in names else _column(col)) + (" DESC" if o.startswith("-") else ""))
+            sql += " ORDER BY " + ", ".join(keys)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        return [dict(zip(names, row)) for row in self._db.execute(sql, params)]
+
+    def close(self) -> None:
+        self._db.close()
+
+def _column(name: str) -> str:
+    if name not in COLUMNS:
+        raise ValueError(f"Colonne inconnue: {name} (disponibles: {', '.join(COLUMNS)})")
+    return f'"{name}"'
+
+def _value(raw: str) -> Any:
+    try:
+        return int(raw)
+    except ValueError:
+        pass
+    try:
+        return float(raw)
+    except ValueError:
+        return raw.strip("'\"")
+
+def iter_results_file(path: Path) -> Iterator[Dict[str, Any]]:
+    """Résultats de jobs depuis un journal NDJSON, un batch_summary.json ou un <id>_summary.json."""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.suffix.lower() in (".ndjson", ".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        data = json.load(f)
+    yield from data["jobs"] if "jobs" in data else [data]
+
+def format_rows(rows: List[Dict[str, Any]]) -> str:
+    if not rows:
+        return "(aucune ligne)"
+    cols = list(rows[0])
+    cells = [[("" if v is None else f"{v:.4g}" if isinstance(v, float) else str(v)) for v in r.values()] for r in rows]
+    widths = [max(len(c), *(len(row[i]) for row in cells)) for i, c in enumerate(cols)]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(cols, widths)), "  ".join("-" * w for w in widths)]
+    lines += ["  ".join(v.ljust(w) for v, w in zip(row, widths)) for row in cells]
+    return "\n".join(lines)
+
+def main(argv: Sequence[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Requêtes sur la table de résultats de l'orchestrateur.")
+    ap.add_argument("db", type=str, help=f"Base de résultats (ex. backend/outputs/{RESULTS_NAME}).")
+    ap.add_argument("--where", action="append", default=[], help='Filtre "col<op>valeur", op: = != < <= > >= ~ (LIKE).')
+    ap.add_argument("--select", type=str, default=None, help="Colonnes séparées par des virgules.")
+    ap.add_argument("--agg", type=str, default=None, help='Agrégats, ex. "count,mean(max),max(max)".')
+    ap.add_argument("--group-by", type=str, default=None, help="Colonnes de regroupement pour --agg.")
+    ap.add_argument("--order", type=str, default=None, help='Tri, ex. "-max,image_id".')
+    ap.add_argument("--limit", type=int, default=None)
+    ap.add_argument("--json", action="store_true", help="Sortie JSON (une ligne par résultat).")
+    ap.add_argument("--import", dest="imports", action="append", default=[], metavar="FILE",
+                    help="Importe d'abord des résultats existants (journal.ndjson, batch_summary.json…).")
+    args = ap.parse_args(argv)
+
+    split = lambda s: [x for x in (s or "").split(",") if x.strip()]
+    store = ResultsStore(args.db)
+    try:
+        for f in args.imports:
+            n, batch = 0, []
+            for res in iter_results_file(Path(f)):
+                batch.append(res)
+                if len(batch) >= 500:
+                    n += store.add(batch)
+                    batch = []
+            n += store.add(batch)
+            print(f"{f}: {n} lignes importées", file=sys.stderr)
+        t0 = time.perf_counter()
+        rows = store.query(args.where, split(args.select) or None, split(args.agg), split(args.group_by),
+                           split(args.order), args.limit)
+        elapsed = (time.perf_counter() - t0) * 1000
+    except ValueError as e:
+        print(f"Erreur: {e}", file=sys.stderr)
+        return 2
+    finally:
+        store.close()
+    if args.json:
+        for r in rows:
+            print(json.dumps(r, ensure_ascii=False))
+    else:
+        print(format_rows(rows))
+        print(f"({len(rows)} lignes, {elapsed:.1f} ms)", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
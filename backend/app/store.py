@@ -1,22 +1,109 @@
 from __future__ import annotations
-import json
+import json, threading, uuid
+from bisect import bisect_right
+from collections import deque
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Callable
 
 DATA = Path(__file__).resolve().parent.parent / 'data'
 ANN = DATA / 'annotations.json'
 DATA.mkdir(parents=True, exist_ok=True)
 if not ANN.exists(): ANN.write_text('[]', encoding='utf-8')
 
+# Cache de lecture: (mtime_ns, taille) → liste parsée + ids triés
+_cache: Dict[str, Any] = {"key": None, "items": [], "ids": []}
+
+# Flux de changements: journal borné en mémoire + abonnés (SSE)
+EPOCH = uuid.uuid4().hex[:8]  # change à chaque démarrage → invalide les vieux jetons
+_feed_lock = threading.Lock()
+_write_lock = threading.Lock()  # écriture + publication indivisibles (cf. snapshot)
+_feed: Dict[str, Any] = {"seq": 0, "log": deque(maxlen=1024)}
+_subscribers: List[Callable[[Dict[str, Any]], None]] = []
+
+def _publish(kind: str, item: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    with _feed_lock:
+        _feed["seq"] += 1
+        ev = {"seq": _feed["seq"], "token": f"{EPOCH}:{_feed['seq']}", "type": kind, "item": item}
+        _feed["log"].append(ev)
+        subs = list(_subscribers)
+    for cb in subs:
+        cb(ev)
+    return ev
+
+def subscribe(callback: Callable[[Dict[str, Any]], None]) -> Callable[[], None]:
+    """Enregistre un abonné aux événements insert/clear; renvoie la fonction de désabonnement."""
+    with _feed_lock:
+        _subscribers.append(callback)
+    def unsubscribe() -> None:
+        with _feed_lock:
+            if callback in _subscribers:
+                _subscribers.remove(callback)
+    return unsubscribe
+
+def events_since(token: str | None) -> List[Dict[str, Any]] | None:
+    """Événements postérieurs au jeton de reprise; None si le client doit se resynchroniser."""
+    if not token:
+        return None
+    epoch, _, seq = token.partition(':')
+    if epoch != EPOCH or not seq.isdigit():
+        return None
+    seq_i = int(seq)
+    with _feed_lock:
+        log = list(_feed["log"])
+        current = _feed["seq"]
+    if seq_i > current or (log and seq_i < log[0]["seq"] - 1) or (not log and seq_i != current):
+        return None
+    return [ev for ev in log if ev["seq"] > seq_i]
+
+def current_token() -> str:
+    with _feed_lock:
+        return f"{EPOCH}:{_feed['seq']}"
+
+def snapshot() -> tuple[List[Dict[str, Any]], str]:
+    """Liste complète + jeton correspondant, lus sans écriture intercalée."""
+    with _write_lock:
+        return load_annotations(), current_token()
+
+def _read_items() -> List[Dict[str, Any]]:
+    """Relit le fichier seulement s'il a changé depuis la dernière lecture."""
+    st = ANN.stat()
+    key = (st.st_mtime_ns, st.st_size)
+    if _cache["key"] != key:
+        items = json.loads(ANN.read_text(encoding='utf-8'))
+        _cache.update(key=key, items=items, ids=[it.get('id', 0) for it in items])
+    return _cache["items"]
+
+def _write_items(items: List[Dict[str, Any]]) -> None:
+    ANN.write_text(json.dumps(items, ensure_ascii=False, indent=2), encoding='utf-8')
+    st = ANN.stat()
+    _cache.update(key=(st.st_mtime_ns, st.st_size), items=items, ids=[it.get('id', 0) for it in items])
+
 def load_annotations() -> List[Dict[str, Any]]:
-    return json.loads(ANN.read_text(encoding='utf-8'))
+    return list(_read_items())
+
+def load_annotations_page(after: int | None = None, limit: int | None = None,
+                          fields: Iterable[str] | None = None) -> tuple[List[Dict[str, Any]], int | None]:
+    """Page d'annotations (curseur = dernier id vu) + curseur suivant (None si fin)."""
+    items = _read_items()
+    start = 0 if after is None else bisect_right(_cache["ids"], after)
+    stop = len(items) if limit is None else min(len(items), start + max(0, limit))
+    page = items[start:stop]
+    if fields is not None:
+        keep = set(fields)
+        page = [{k: v for k, v in it.items() if k in keep} for it in page]
+    next_cursor = _cache["ids"][stop - 1] if stop < len(items) and stop > start else None
+    return page, next_cursor
 
 def save_annotation(item: Dict[str, Any]) -> Dict[str, Any]:
-    items = load_annotations()
-    item['id'] = len(items) + 1
-    items.append(item)
-    ANN.write_text(json.dumps(items, ensure_ascii=False, indent=2), encoding='utf-8')
+    with _write_lock:
+        items = load_annotations()
+        item['id'] = len(items) + 1
+        items.append(item)
+        _write_items(items)
+        _publish("insert", item)
     return item
 
 def clear_annotations() -> None:
-    ANN.write_text('[]', encoding='utf-8')
+    with _write_lock:
+        _write_items([])
+        _publish("clear")
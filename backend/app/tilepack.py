@@ -0,0 +1,150 @@
+from __future__ import annotations
+import hashlib, json, mmap, os, shutil, struct, threading
+from pathlib import Path
+from typing import Any, Dict
+
+from .pyramides import MANIFEST_NAME, PyramidManifest, dzi_xml, level_grid, max_level, read_dzi, \
+    source_fingerprint, write_dzi
+
+# Archive de tuiles « .dzpack »: un seul fichier par pyramide.
+#   [MAGIC][tuiles concaténées][index JSON][trailer: offset index, taille index, MAGIC]
+# L'index contient le descripteur DZI, le manifeste de génération et, par tuile
+# "niveau/col_ligne", [offset, taille]; les tuiles identiques pointent sur la même tranche.
+MAGIC = b"DZPACK01"
+_TRAILER = struct.Struct("<QQ8s")
+PACK_SUFFIX = ".dzpack"
+
+def pack_pyramid(output_basename, remove_files: bool = False) -> Path:
+    """Regroupe <base>.dzi + <base>_files/ dans <base>.dzpack (écriture atomique).
+
+    `remove_files`: supprime ensuite le dossier de tuiles et le .dzi libre, qui
+    pointerait sinon vers des tuiles absentes; le manifeste voyage dans l'archive.
+    """
+    base = Path(output_basename)
+    info = read_dzi(f"{base}.dzi")
+    files_dir = Path(f"{base}_files")
+    manifest = PyramidManifest.load(files_dir).data if (files_dir / MANIFEST_NAME).exists() else None
+    ext = "." + info["format"]
+    pack = base.with_name(base.name + PACK_SUFFIX)
+    tmp = pack.with_name(pack.name + ".tmp")
+    tiles: Dict[str, list] = {}
+    seen: Dict[bytes, list] = {}  # empreinte → [offset, taille]: tuiles identiques stockées une fois
+    with open(tmp, "wb") as out:
+        out.write(MAGIC)
+        for lvl_dir in sorted((d for d in files_dir.iterdir() if d.is_dir() and d.name.isdigit()), key=lambda d: int(d.name)):
+            for entry in sorted(os.scandir(lvl_dir), key=lambda e: e.name):
+                if not entry.name.endswith(ext) or entry.name.startswith("."):
+                    continue
+                with open(entry.path, "rb") as f:
+                    data = f.read()
+                digest = hashlib.blake2b(data, digest_size=16).digest()
+                if digest not in seen:
+                    seen[digest] = [out.tell(), len(data)]
+                    out.write(data)
+                tiles[f"{lvl_dir.name}/{entry.name[:-len(ext)]}"] = seen[digest]
+        index = json.dumps({"dzi": info, "manifest": manifest, "tiles": tiles}, separators=(",", ":")).encode("utf-8")
+        index_offset = out.tell()
+        out.write(index)
+        out.write(_TRAILER.pack(index_offset, len(index), MAGIC))
+    os.replace(tmp, pack)
+    if remove_files:
+        os.remove(f"{base}.dzi")
+        shutil.rmtree(files_dir)
+    return pack
+
+def pack_is_current(output_basename, input_path, tile_size=256, overlap=0, suffix=".jpg") -> bool:
+    """L'archive <base>.dzpack est-elle complète et à jour pour cette source et ces paramètres?"""
+    path = Path(f"{output_basename}{PACK_SUFFIX}")
+    if not path.exists():
+        return False
+    try:
+        pack = open_pack(path)
+    except ValueError:
+        return False
+    m = pack.manifest
+    if not m or m.get("source") != source_fingerprint(input_path):
+        return False
+    params = {"tile_size": tile_size, "overlap": overlap, "suffix": suffix}
+    w, h = m["width"], m["height"]
+    counts: Dict[str, int] = {}
+    for key in pack.tiles:
+        lv = key.partition("/")[0]
+        counts[lv] = counts.get(lv, 0) + 1
+    for lv in range(max_level(w, h) + 1):
+        rec = m["levels"].get(str(lv))
+        cols, rows = level_grid(w, h, lv, tile_size)
+        if not rec or not rec.get("done") or rec.get("params") != params or (rec.get("cols"), rec.get("rows")) != (cols, rows):
+            return False
+        if counts.get(str(lv), 0) < cols * rows:
+            return False
+    return True
+
+class TilePack:
+    """Lecture d'un .dzpack: index chargé une fois, tuiles lues par tranche du mmap."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        if self.path.stat().st_size < len(MAGIC) + _TRAILER.size:
+            raise ValueError(f"Archive de tuiles invalide (tronquée): {path}")
+        self._file = open(self.path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        index_offset, index_len, magic = _TRAILER.unpack(self._mm[-_TRAILER.size:])
+        if magic != MAGIC or self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"Archive de tuiles invalide: {path}")
+        data = json.loads(self._mm[index_offset:index_offset + index_len])
+        self.dzi: Dict[str, Any] = data["dzi"]
+        self.manifest: Dict[str, Any] | None = data.get("manifest")
+        self.tiles: Dict[str, list] = data["tiles"]
+
+    def get(self, level: int, col: int, row: int) -> memoryview | None:
+        """Vue sur les octets de la tuile (une seule recherche dans l'index), None si absente."""
+        entry = self.tiles.get(f"{level}/{col}_{row}")
+        if entry is None:
+            return None
+        offset, length = entry
+        return memoryview(self._mm)[offset:offset + length]
+
+    def dzi_xml(self) -> str:
+        d = self.dzi
+        return dzi_xml(d["width"], d["height"], d["tile_size"], d["overlap"], d["format"])
+
+    def close(self) -> None:
+        try:
+            self._mm.close()
+        finally:
+            self._file.close()
+
+# Cache des archives ouvertes, invalidé si le fichier change (mtime/taille)
+_open_packs: Dict[str, tuple] = {}
+_lock = threading.Lock()
+
+def open_pack(path) -> TilePack:
+    p = str(Path(path).resolve())
+    st = os.stat(p)
+    key = (st.st_mtime_ns, st.st_size)
+    with _lock:
+        cached = _open_packs.get(p)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        pack = TilePack(p)
+        _open_packs[p] = (key, pack)
+        # l'ancienne instance peut encore servir une requête en cours: on laisse le GC la fermer
+        return pack
+
+def unpack_pyramid(pack_path, output_basename) -> None:
+    """Opération inverse: restaure <base>.dzi + <base>_files/ depuis une archive."""
+    pack = TilePack(pack_path)
+    try:
+        d = pack.dzi
+        write_dzi(output_basename, d["width"], d["height"], d["tile_size"], d["overlap"], d["format"])
+        for key in pack.tiles:
+            level, name = key.split("/")
+            col, row = (int(v) for v in name.split("_"))
+            target = Path(f"{output_basename}_files") / level / f"{name}.{d['format']}"
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(pack.get(int(level), col, row))
+        if pack.manifest:
+            PyramidManifest(Path(f"{output_basename}_files"), pack.manifest).save()
+    finally:
+        pack.close()
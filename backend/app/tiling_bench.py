@@ -0,0 +1,131 @@
+from __future__ import annotations
+import argparse, json, math, os, shutil, tempfile, time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Sequence, Set, Tuple
+import numpy as np
+from PIL import Image
+
+from .pyramides import TILING_PRESETS, generate_deepzoom, level_size, max_level, tiling_preset
+
+# Banc d'essai des préréglages de tuilage: temps de génération, octets, nombre de
+# fichiers et requêtes d'un viewer simulé sur des parcours pan/zoom types.
+
+DEFAULT_VIEWPORT = (1280, 800)
+
+def standard_traces(steps: int = 8) -> Dict[str, List[Tuple[float, float, float]]]:
+    """Parcours (zoom, cx, cy): zoom = pixels écran par pixel source, centre normalisé 0..1.
+
+    zoom <= 0 signifie « image entière à l'écran » (résolu d'après la taille de l'image).
+    """
+    zoom_in = [(0.0, 0.5, 0.5)] + [(1.0 / 2 ** k, 0.5, 0.5) for k in range(steps - 1, -1, -1)]
+    pan = [(1.0, 0.1 + 0.8 * i / (steps - 1), 0.5) for i in range(steps)]
+    # zoom sur une zone côtière puis balayage à pleine résolution
+    explore = ([(0.0, 0.5, 0.5), (0.25, 0.7, 0.4), (0.5, 0.72, 0.42)]
+               + [(1.0, 0.72 + 0.02 * i, 0.42 + 0.01 * i) for i in range(steps)])
+    return {"zoom_in": zoom_in, "pan": pan, "explore": explore}
+
+def tiles_for_view(width: int, height: int, tile_size: int, zoom: float, cx: float, cy: float,
+                   viewport: Tuple[int, int] = DEFAULT_VIEWPORT) -> Set[Tuple[int, int, int]]:
+    """Tuiles (niveau, col, ligne) qu'un viewer DZI charge pour cette vue.
+
+    Comme OpenSeadragon: plus petit niveau dont la résolution couvre celle de l'écran.
+    """
+    vw, vh = viewport
+    if zoom <= 0:
+        zoom = min(vw / width, vh / height)
+    top = max_level(width, height)
+    level = min(top, max(0, top - int(math.floor(math.log2(1.0 / zoom)))) if zoom < 1 else top)
+    lw, lh = level_size(width, height, level)
+    f = lw / width  # pixels du niveau par pixel source
+    # fenêtre visible en pixels du niveau
+    half_w, half_h = vw / zoom * f / 2, vh / zoom * f / 2
+    x0, x1 = max(0.0, cx * lw - half_w), min(lw, cx * lw + half_w)
+    y0, y1 = max(0.0, cy * lh - half_h), min(lh, cy * lh + half_h)
+    if x1 <= x0 or y1 <= y0:
+        return set()
+    c0, c1 = int(x0 // tile_size), int(math.ceil(x1 / tile_size)) - 1
+    r0, r1 = int(y0 // tile_size), int(math.ceil(y1 / tile_size)) - 1
+    return {(level, c, r) for c in range(c0, c1 + 1) for r in range(r0, r1 + 1)}
+
+def simulate_trace(width: int, height: int, tile_size: int, trace: Sequence[Tuple[float, float, float]],
+                   viewport: Tuple[int, int] = DEFAULT_VIEWPORT) -> Dict[str, int]:
+    """Requêtes d'un viewer avec cache client: seules les tuiles jamais vues sont demandées."""
+    seen: Set[Tuple[int, int, int]] = set()
+    requests = 0
+    for zoom, cx, cy in trace:
+        tiles = tiles_for_view(width, height, tile_size, zoom, cx, cy, viewport)
+        requests += len(tiles - seen)
+        seen |= tiles
+    return {"requests": requests, "unique_tiles": len(seen), "views": len(trace)}
+
+def make_reference_image(path, size: Tuple[int, int] = (4096, 4096), seed: int = 0) -> Path:
+    """Scène de référence déterministe: océan uniforme, côte texturée, nuages lisses."""
+    w, h = size
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    land = (xx / w + 0.15 * np.sin(yy / h * 6.0)) > 0.6
+    img = np.empty((h, w, 3), dtype=np.uint8)
+    img[...] = (12, 40, 88)
+    tex = rng.integers(60, 200, size=(h, w), dtype=np.uint8)
+    img[land, 0], img[land, 1], img[land, 2] = tex[land], (tex[land] * 0.8).astype(np.uint8), 40
+    clouds = (np.sin(xx / 97.0) * np.cos(yy / 61.0)) > 0.8
+    img[clouds] = 235
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Image.fromarray(img).save(path)
+    return Path(path)
+
+def benchmark_presets(image_path, presets: Iterable[str] | None = None, workers: int = 1,
+                      viewport: Tuple[int, int] = DEFAULT_VIEWPORT, workdir=None) -> List[Dict[str, Any]]:
+    """Génère chaque préréglage sur l'image de référence et mesure le résultat."""
+    names = list(presets) if presets is not None else list(TILING_PRESETS)
+    with Image.open(image_path) as im:
+        width, height = im.size
+    traces = standard_traces()
+    own_dir = workdir is None
+    root = Path(tempfile.mkdtemp(prefix="tiling-bench-")) if own_dir else Path(workdir)
+    rows: List[Dict[str, Any]] = []
+    try:
+        for name in names:
+            params = tiling_preset(name)
+            base = root / name
+            t0 = time.perf_counter()
+            generate_deepzoom(str(image_path), str(base), force=True, workers=workers, **params)
+            elapsed = time.perf_counter() - t0
+            files = [p for p in Path(f"{base}_files").rglob("*") if p.is_file() and p.name != "manifest.json"]
+            rows.append({
+                "preset": name, **params,
+                "seconds": round(elapsed, 3),
+                "files": len(files),
+                "bytes": sum(p.stat().st_size for p in files),
+                "requests": {k: simulate_trace(width, height, params["tile_size"], tr, viewport)["requests"]
+                             for k, tr in traces.items()},
+            })
+    finally:
+        if own_dir:
+            shutil.rmtree(root, ignore_errors=True)
+    return rows
+
+def format_table(rows: List[Dict[str, Any]]) -> str:
+    traces = list(rows[0]["requests"]) if rows else []
+    head = f"{'preset':<10}{'tile':>6}{'ovl':>5}{'s':>8}{'files':>8}{'MB':>9}" + "".join(f"{t:>10}" for t in traces)
+    lines = [head, "-" * len(head)]
+    for r in rows:
+        lines.append(f"{r['preset']:<10}{r['tile_size']:>6}{r['overlap']:>5}{r['seconds']:>8.2f}{r['files']:>8}"
+                     f"{r['bytes'] / 1e6:>9.2f}" + "".join(f"{r['requests'][t]:>10}" for t in traces))
+    return "\n".join(lines)
+
+def main():
+    ap = argparse.ArgumentParser(description="Banc d'essai des préréglages de tuilage DZI.")
+    ap.add_argument("--image", type=str, default=None, help="Image de référence (sinon scène synthétique).")
+    ap.add_argument("--size", type=int, default=4096, help="Côté de la scène synthétique.")
+    ap.add_argument("--presets", type=str, default=",".join(TILING_PRESETS), help="Liste séparée par des virgules.")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processus d'encodage.")
+    ap.add_argument("--json", action="store_true", help="Sortie JSON au lieu du tableau.")
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        image = args.image or make_reference_image(Path(tmp) / "reference.png", (args.size, args.size))
+        rows = benchmark_presets(image, [p for p in args.presets.split(",") if p], workers=args.workers)
+    print(json.dumps(rows, indent=2) if args.json else format_table(rows))
+
+if __name__ == "__main__":
+    main()
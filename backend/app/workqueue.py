@@ -0,0 +1,194 @@
+from __future__ import annotations
+import json, os, socket, sqlite3, threading, time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+
+# File de travail partagée entre plusieurs hôtes (même système de fichiers): une base
+# SQLite dans le dossier de sortie. Chaque entrée est réservée par un bail à durée
+# limitée, renouvelé tant que le worker travaille; un bail expiré (worker mort, nœud
+# perdu) remet l'entrée en file. Les horloges des hôtes sont supposées synchronisées.
+QUEUE_NAME = "queue.sqlite"
+DEFAULT_LEASE_S = 300.0
+MAX_ATTEMPTS = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    idx         INTEGER PRIMARY KEY,  -- position dans le manifeste
+    key         TEXT NOT NULL,
+    payload     TEXT NOT NULL,
+    state       TEXT NOT NULL DEFAULT 'queued',  -- queued | leased | done | failed
+    owner       TEXT,
+    lease_until REAL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    result      TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, idx);
+"""
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class WorkQueue:
+    """File d'entrées (clé, charge JSON) à bail, ordonnée par position dans le manifeste."""
+
+    def __init__(self, path, timeout: float = 60.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # journal "delete" (pas de WAL): seul mode fiable sur un système de fichiers partagé
+        self._db = sqlite3.connect(str(self.path), timeout=timeout, isolation_level=None)
+        with self._tx():
+            for stmt in _SCHEMA.split(";"):
+                if stmt.strip():
+                    self._db.execute(stmt)
+
+    def _tx(self):
+        return _Immediate(self._db)
+
+    def enqueue(self, entries: Iterable[Tuple[str, Dict[str, Any]]], chunk: int = 1000) -> int:
+        """Ajoute les entrées absentes (idempotent: chaque hôte peut amorcer le même manifeste).
+
+        Renvoie le nombre d'entrées ajoutées. Lève ValueError si la file contient déjà
+        une autre clé à la même position (file issue d'un autre manifeste).
+        """
+        added = 0
+        buf: List[Tuple[int, str, str]] = []
+
+        def flush() -> None:
+            nonlocal added
+            with self._tx():
+                for idx, key, payload in buf:
+                    cur = self._db.execute("INSERT OR IGNORE INTO jobs (idx, key, payload) VALUES (?, ?, ?)",
+                                           (idx, key, payload))
+                    if cur.rowcount:
+                        added += 1
+                        continue
+                    (old,) = self._db.execute("SELECT key FROM jobs WHERE idx = ?", (idx,)).fetchone()
+                    if old != key:
+                        raise ValueError(f"File incompatible avec le manifeste (entrée {idx}: {old} ≠ {key})")
+            buf.clear()
+
+        for idx, (key, payload) in enumerate(entries):
+            buf.append((idx, key, json.dumps(payload, ensure_ascii=False)))
+            if len(buf) >= chunk:
+                flush()
+        if buf:
+            flush()
+        return added
+
+    def claim(self, owner: str, lease_s: float = DEFAULT_LEASE_S, limit: int = 1,
+              max_attempts: int = MAX_ATTEMPTS) -> List[Tuple[int, Dict[str, Any]]]:
+        """Réserve jusqu'à `limit` entrées libres ou à bail expiré: [(position, charge)].
+
+        Une entrée dont le bail a expiré `max_attempts` fois passe à l'état failed
+        (entrée qui tue son worker) au lieu d'être redistribuée indéfiniment.
+        """
+        now = time.time()
+        with self._tx():
+            self._db.execute("UPDATE jobs SET state = 'failed', owner = NULL "
+                             "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?", (now, max_attempts))
+            rows = self._db.execute(
+                "SELECT idx, payload FROM jobs WHERE state = 'queued' OR (state = 'leased' AND lease_until < ?) "
+                "ORDER BY idx LIMIT ?", (now, limit)).fetchall()
+            self._db.executemany("UPDATE jobs SET state = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1 "
+                                 "WHERE idx = ?", [(owner, now + lease_s, idx) for idx, _ in rows])
+        return [(idx, json.loads(payload)) for idx, payload in rows]
+
+    def renew(self, owner: str, idxs: Iterable[int], lease_s: float = DEFAULT_LEASE_S) -> Set[int]:
+        """Prolonge les baux encore détenus par `owner`; renvoie les positions perdues."""
+        idxs = list(idxs)
+        lost: Set[int] = set()
+        with self._tx():
+            for idx in idxs:
+                cur = self._db.execute("UPDATE jobs SET lease_until = ? WHERE idx = ? AND owner = ? AND state = 'leased'",
+                                       (time.time() + lease_s, idx, owner))
+                if not cur.rowcount:
+                    lost.add(idx)
+        return lost
+
+    def complete(self, owner: str, idx: int, result: Dict[str, Any]) -> bool:
+        """Marque l'entrée terminée. Accepté même après perte du bail (sorties idempotentes),
+        sauf si un autre worker l'a déjà terminée; renvoie False dans ce cas."""
+        with self._tx():
+            cur = self._db.execute("UPDATE jobs SET state = 'done', owner = ?, lease_until = NULL, result = ? "
+                                   "WHERE idx = ? AND state != 'done'",
+                                   (owner, json.dumps(result, ensure_ascii=False), idx))
+        return bool(cur.rowcount)
+
+    def release(self, owner: str, idx: int) -> None:
+        """Rend une entrée réservée (arrêt propre du worker)."""
+        with self._tx():
+            self._db.execute("UPDATE jobs SET state = 'queued', owner = NULL, lease_until = NULL "
+                             "WHERE idx = ? AND owner = ? AND state = 'leased'", (idx, owner))
+
+    def counts(self) -> Dict[str, int]:
+        counts = {"queued": 0, "leased": 0, "done": 0, "failed": 0}
+        for state, n in self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"):
+            counts[state] = n
+        return counts
+
+    def unfinished(self) -> int:
+        """Entrées encore en file ou réservées."""
+        return self._db.execute("SELECT COUNT(*) FROM jobs WHERE state IN ('queued', 'leased')").fetchone()[0]
+
+    def results(self) -> Iterator[Dict[str, Any]]:
+        """Résultats terminés dans l'ordre du manifeste (lus par lots)."""
+        last = -1
+        while True:
+            rows = self._db.execute("SELECT idx, result FROM jobs WHERE state = 'done' AND idx > ? "
+                                    "ORDER BY idx LIMIT 500", (last,)).fetchall()
+            if not rows:
+                return
+            for idx, result in rows:
+                yield json.loads(result)
+            last = rows[-1][0]
+
+    def close(self) -> None:
+        self._db.close()
+
+class _Immediate:
+    """Transaction BEGIN IMMEDIATE: verrou d'écriture pris d'emblée (pas d'interblocage
+    lecture → écriture entre hôtes), COMMIT ou ROLLBACK en sortie."""
+
+    def __init__(self, db: sqlite3.Connection):
+        self._db = db
+
+    def __enter__(self):
+        self._db.execute("BEGIN IMMEDIATE")
+        return self._db
+
+    def __exit__(self, exc_type, *exc) -> None:
+        self._db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+class LeaseKeeper(threading.Thread):
+    """Renouvelle en tâche de fond les baux des entrées en cours (connexion dédiée)."""
+
+    def __init__(self, path, owner: str, lease_s: float = DEFAULT_LEASE_S):
+        super().__init__(daemon=True)
+        self._path, self._owner, self._lease_s = path, owner, lease_s
+        self._held: Set[int] = set()
+        self._mutex = threading.Lock()
+        self._halt = threading.Event()
+        self.lost: Set[int] = set()
+
+    def hold(self, idx: int) -> None:
+        with self._mutex:
+            self._held.add(idx)
+
+    def drop(self, idx: int) -> None:
+        with self._mutex:
+            self._held.discard(idx)
+
+    def run(self) -> None:
+        q = WorkQueue(self._path)
+        try:
+            while not self._halt.wait(self._lease_s / 3):
+                with self._mutex:
+                    held = set(self._held)
+                if held:
+                    self.lost |= q.renew(self._owner, held, self._lease_s)
+        finally:
+            q.close()
+
+    def stop(self) -> None:
+        self._halt.set()
+        self.join()
@@ -0,0 +1,96 @@
+import io
+import json
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from fastapi.testclient import TestClient
+from app import compare, main
+from app.compare import change_tile, compare_tile
+from app.lazytiles import prepare_lazy_pyramid
+from app.pyramides import generate_deepzoom
+from app.tilepack import pack_pyramid
+
+def _scenes(tmp_path, packed_b=False):
+    before = np.full((200, 300, 3), 90, dtype=np.uint8)
+    after = before.copy()
+    after[20:60, 30:90] = 220  # zone inondée dans la tuile (0, 0) du niveau max
+    for name, arr in (("before", before), ("after", after)):
+        src = tmp_path / f"{name}.png"
+        Image.fromarray(arr).save(src)
+        generate_deepzoom(str(src), str(tmp_path / name), tile_size=128, suffix=".png")
+    if packed_b:
+        pack_pyramid(tmp_path / "after", remove_files=True)
+    return tmp_path
+
+def test_change_tile_stats():
+    a = np.zeros((10, 10, 3), dtype=np.uint8)
+    b = a.copy()
+    b[:5] = 255
+    rgba, stats = change_tile(a, b, threshold=0.5)
+    assert stats["changed_fraction"] == pytest.approx(0.5)
+    assert stats["max_abs_diff"] == pytest.approx(1.0) and stats["mean_signed_diff"] > 0
+    assert (rgba[:5, :, 3] > 0).all() and (rgba[5:, :, 3] == 0).all()
+    diff, _ = change_tile(a, b, mode="diff")
+    assert (diff[:5, :, :3] == 255).all() and (diff[5:, :, :3] == 0).all()
+
+@pytest.mark.parametrize("packed_b", [False, True])
+def test_compare_tile_cached(tmp_path, packed_b):
+    tiles = _scenes(tmp_path, packed_b)
+    png, stats = compare_tile(tiles, "before", "after", 9, 0, 0)
+    assert 0 < stats["changed_fraction"] < 1 and Image.open(io.BytesIO(png)).mode == "RGBA"
+    _, untouched = compare_tile(tiles, "before", "after", 9, 2, 1)
+    assert untouched["changed_fraction"] == 0.0
+    cached = list((tiles / ".compare" / "before~after" / "9").glob("0_0.change.*"))
+    assert len(cached) == 2
+    assert compare_tile(tiles, "before", "after", 9, 0, 0) == (png, stats)
+    assert compare_tile(tiles, "before", "after", 9, 99, 0) is None
+    with pytest.raises(ValueError):
+        compare_tile(tiles, "before", "after", 9, 0, 0, mode="xor")
+
+def test_compare_endpoint(tmp_path, monkeypatch):
+    tiles = _scenes(tmp_path)
+    monkeypatch.setattr(main, "TILES_DIR", tiles)
+    client = TestClient(main.app)
+    r = client.get("/compare/before/after/9/0_0.png?mode=diff")
+    assert r.status_code == 200 and r.headers["content-type"] == "image/png"
+    assert json.loads(r.headers["x-change-stats"])["changed_fraction"] > 0
+    assert client.get("/compare/before/after/9/0_0.json").json()["changed_fraction"] > 0
+    assert client.get("/compare/before/missing/9/0_0.png").status_code == 404
+    assert client.get("/compare/before/after/9/0_0.png?threshold=2").status_code == 422
+
+def test_compare_lazy_source_gone(tmp_path, monkeypatch):
+    """Source d'une pyramide paresseuse supprimée: 404, pas 500"""
+    tiles = _scenes(tmp_path)
+    src = tmp_path / "gone.png"
+    Image.fromarray(np.full((200, 300, 3), 10, dtype=np.uint8)).save(src)
+    prepare_lazy_pyramid(str(src), str(tiles / "gone"), tile_size=128, suffix=".png", eager_size=64)
+    src.unlink()
+    assert compare_tile(tiles, "before", "gone", 9, 0, 0) is None
+    monkeypatch.setattr(main, "TILES_DIR", tiles)
+    assert TestClient(main.app).get("/compare/before/gone/9/0_0.png").status_code == 404
+
+def test_compare_cache_is_bounded(tmp_path, monkeypatch):
+    tiles = _scenes(tmp_path)
+    monkeypatch.setattr(compare, "_cache_bytes", {})
+    png, _ = compare_tile(tiles, "before", "after", 9, 0, 0)
+    entry = len(png) + (tiles / ".compare" / "before~after" / "9" / "0_0.change.json").stat().st_size
+    monkeypatch.setattr(compare, "CACHE_MAX_BYTES", 3 * entry)
+    monkeypatch.setattr(compare, "CACHE_LOW_BYTES", 2 * entry)
+    for col in range(3):
+        for row in range(2):
+            compare_tile(tiles, "before", "after", 9, col, row)
+    cached = [p for p in (tiles / ".compare").rglob("*") if p.is_file()]
+    assert sum(p.stat().st_size for p in cached) <= 3 * entry
+    assert len(cached) < 12
+
+def test_compare_cache_follows_regeneration(tmp_path, monkeypatch):
+    tiles = _scenes(tmp_path)
+    _, stats = compare_tile(tiles, "before", "after", 9, 0, 0)
+    key = json.loads((tiles / ".compare" / "before~after" / "9" / "0_0.change.json").read_text())["key"]
+    # pyramide régénérée (nouveau .dzi), tuiles inchangées sur disque
+    dzi = tiles / "after.dzi"
+    st = dzi.stat()
+    os.utime(dzi, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert compare_tile(tiles, "before", "after", 9, 0, 0)[1] == stats
+    assert json.loads((tiles / ".compare" / "before~after" / "9" / "0_0.change.json").read_text())["key"] != key
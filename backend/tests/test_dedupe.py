@@ -0,0 +1,87 @@
+import os
+import tempfile
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from app.pyramides import generate_deepzoom, dedupe_pyramid, prune_blob_store
+from app.tilepack import pack_pyramid, TilePack
+
+def _coastal_scene(path):
+    """Scène majoritairement uniforme (océan) avec une bande de côte texturée"""
+    arr = np.zeros((256, 512, 3), dtype=np.uint8)
+    arr[...] = (10, 40, 90)
+    arr[:, 448:] = np.random.default_rng(0).integers(0, 255, size=(256, 64, 3), dtype=np.uint8)
+    Image.fromarray(arr).save(path)
+
+def test_generation_links_identical_tiles():
+    """Les tuiles identiques partagent un même blob (lien dur)"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, 'coast.png')
+        _coastal_scene(src)
+        store = Path(tmpdir, 'blobs')
+        base = os.path.join(tmpdir, 'coast')
+        report = generate_deepzoom(src, base, tile_size=64, suffix=".png", dedupe_store=store)
+        assert report["tiles_deduplicated"] > 0
+        assert report["bytes_deduplicated"] > 0
+        a, b = Path(f"{base}_files/9/0_0.png"), Path(f"{base}_files/9/1_1.png")
+        assert os.path.samefile(a, b)
+        assert not os.path.samefile(a, Path(f"{base}_files/9/7_0.png"))
+
+        # deuxième pyramide de la même scène: tout est déjà dans le magasin
+        other = os.path.join(tmpdir, 'coast_copy')
+        report = generate_deepzoom(src, other, tile_size=64, suffix=".png", dedupe_store=store)
+        assert report["tiles_deduplicated"] == report["tiles_written"]
+        assert os.path.samefile(Path(f"{other}_files/9/7_0.png"), Path(f"{base}_files/9/7_0.png"))
+
+def test_dedupe_existing_pyramid_and_prune():
+    """Déduplication a posteriori puis nettoyage des blobs orphelins"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, 'coast.png')
+        _coastal_scene(src)
+        base = os.path.join(tmpdir, 'coast')
+        generate_deepzoom(src, base, tile_size=64, suffix=".png")
+        store = Path(tmpdir, 'blobs')
+        stats = dedupe_pyramid(base, store)
+        assert stats["duplicates"] > 0 and stats["bytes_saved"] > 0
+        assert dedupe_pyramid(base, store)["bytes_saved"] == 0  # idempotent
+
+        import shutil
+        shutil.rmtree(f"{base}_files")
+        assert prune_blob_store(store) > 0
+        assert not [f for _, _, fs in os.walk(store) for f in fs]
+
+def test_pack_stores_duplicates_once():
+    """Dans une archive, les doublons pointent sur la même tranche"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, 'coast.png')
+        _coastal_scene(src)
+        base = os.path.join(tmpdir, 'coast')
+        generate_deepzoom(src, base, tile_size=64, suffix=".png")
+        total = sum(p.stat().st_size for p in Path(f"{base}_files").rglob("*.png"))
+        pack = TilePack(pack_pyramid(base))
+        try:
+            assert pack.tiles["9/0_0"] == pack.tiles["9/1_1"]
+            assert bytes(pack.get(9, 0, 0)) == Path(f"{base}_files/9/1_1.png").read_bytes()
+            assert pack.path.stat().st_size < total
+        finally:
+            pack.close()
+
+def test_store_on_other_filesystem_falls_back_to_plain_tiles(monkeypatch):
+    """Liens impossibles (EXDEV): génération menée à bien, tuiles ordinaires"""
+    import errno
+
+    def no_link(src, dst):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, 'coast.png')
+        _coastal_scene(src)
+        store, base = Path(tmpdir, 'blobs'), os.path.join(tmpdir, 'coast')
+        generate_deepzoom(src, base, tile_size=64, suffix=".png", dedupe_store=store)  # magasin déjà rempli
+        monkeypatch.setattr(os, "link", no_link)
+        other = os.path.join(tmpdir, 'coast_copy')
+        report = generate_deepzoom(src, other, tile_size=64, suffix=".png", dedupe_store=store)
+        assert report["tiles_deduplicated"] == 0 and report["tiles_written"] > 0
+        a = Path(f"{other}_files/9/0_0.png")
+        assert a.read_bytes() == Path(f"{base}_files/9/0_0.png").read_bytes() and a.stat().st_nlink == 1
+        assert not [n for _, _, fs in os.walk(f"{other}_files") for n in fs if ".part" in n or ".lnk" in n]
+        assert dedupe_pyramid(other, store)["bytes_saved"] == 0
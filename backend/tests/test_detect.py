@@ -121,3 +121,70 @@ def test_run_detector_with_scaling():
     finally:
         import os
         os.unlink(tmp_path)
+
+def test_to_gray_keeps_16bit_precision():
+    """Écarts < 256 niveaux en 16 bits conservés, NaN → 0"""
+    arr = np.array([[1000, 1100], [1200, 1300]], dtype=np.uint16)
+    gray = to_gray(arr)
+    assert np.allclose(gray, [[0, 1/3], [2/3, 1]], atol=1e-5)
+    multi = np.stack([arr, arr * 0, arr * 0, arr * 0, arr * 0], axis=-1)
+    assert np.allclose(to_gray(multi, bands=[0]), gray, atol=1e-5)
+    f = np.array([[np.nan, 0.0], [1.0, 2.0]], dtype=np.float32)
+    assert to_gray(f)[0, 0] == 0.0 and to_gray(f)[1, 1] == pytest.approx(1.0)
+
+def test_stage_hook_reports_each_stage():
+    """Le hook reçoit une durée par étape, sans changer le résultat"""
+    import tempfile, os
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'scene.png')
+        Image.new('RGB', (120, 80), color=(30, 90, 200)).save(path)
+        calls = []
+        heat, stats = run_detector_on_image_path(path, level_scale=2.0, hook=lambda s, dt: calls.append((s, dt)))
+        _, ref = run_detector_on_image_path(path, level_scale=2.0)
+        assert stats == ref
+        assert [s for s, _ in calls] == ["decode", "resize", "gray", "gaussian", "laplacian", "normalize", "colorize"]
+        assert all(dt >= 0 for _, dt in calls)
+
+def test_tiled_detector_matches_full_frame():
+    """Détection par bandes: mêmes stats et heatmap (à l'arrondi près), mémoire prévue plus faible"""
+    import tempfile, os
+    from app.detect import estimate_detection_memory, run_detector_tiled
+    rng = np.random.default_rng(3)
+    yy, xx = np.mgrid[0:300, 0:420]
+    base = np.clip(np.sin(xx / 20) * np.cos(yy / 13) * 90 + 128 + rng.normal(0, 15, xx.shape), 0, 255)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        rgb = os.path.join(tmpdir, 'rgb.png')
+        Image.fromarray(np.stack([base, base / 2, 255 - base], -1).astype(np.uint8)).save(rgb)
+        deep = os.path.join(tmpdir, 'deep.png')
+        Image.fromarray((base * 250).astype(np.uint16)).save(deep)
+        for path in (rgb, deep):
+            for scale in (1.0, 2.0):
+                h1, s1 = run_detector_on_image_path(path, level_scale=scale)
+                h2, s2 = run_detector_tiled(path, level_scale=scale, tile_rows=40)
+                assert (s1['width'], s1['height']) == (s2['width'], s2['height'])
+                for k in ('min', 'max', 'mean', 'std'):
+                    assert abs(s1[k] - s2[k]) < 1e-5
+                diff = np.abs(np.asarray(h1).astype(int) - np.asarray(h2).astype(int))
+                assert diff.max() <= 1
+        est = estimate_detection_memory(rgb, 1.0, tile_rows=40)
+        assert (est['level_width'], est['level_height']) == (420, 300)
+        assert 0 < est['tiled_mb'] < est['full_mb']
+
+def test_tiled_float_source_decoded_once(tmp_path, monkeypatch):
+    """Source flottante avec NaN: une seule passe de décodage, NaN → minimum comme to_gray"""
+    from app import detect
+    from app.detect import run_detector_tiled
+    yy, xx = np.mgrid[0:120, 0:160]
+    arr = (np.sin(xx / 9) * np.cos(yy / 7) * 50 + 300).astype(np.float32)
+    arr[30:60, 40:90] = np.nan
+    path = tmp_path / 'dem.tif'
+    Image.fromarray(arr, mode='F').save(path)
+    h1, s1 = run_detector_on_image_path(str(path), level_scale=2.0)
+    reads = []
+    original = detect.read_resampled
+    monkeypatch.setattr(detect, "read_resampled", lambda *a, **k: (reads.append(a[1]), original(*a, **k))[1])
+    h2, s2 = run_detector_tiled(str(path), level_scale=2.0, tile_rows=16)
+    assert len(reads) == 4  # 60 lignes de niveau / 16
+    for k in ('min', 'max', 'mean', 'std'):
+        assert abs(s1[k] - s2[k]) < 1e-5
+    assert np.abs(np.asarray(h1).astype(int) - np.asarray(h2).astype(int)).max() <= 1
@@ -0,0 +1,60 @@
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from app import detect_bench, orchestrator
+from app.detect_bench import MICRO_STAGES, compare_to_baseline, main, run_benchmarks
+
+
+def test_run_benchmarks_micro_and_macro():
+    """Une ligne par étape et par (taille, niveau), débit et pic renseignés"""
+    report = run_benchmarks(sizes=[64, 128], levels=[0, 1], reps=1, min_time=0)
+    keys = set(report["results"])
+    assert {f"{s}@{n}" for s in MICRO_STAGES for n in (64, 128)} <= keys
+    assert {f"run_detector@{n}/L{lv}" for n in (64, 128) for lv in (0, 1)} <= keys
+    for row in report["results"].values():
+        assert row["mpx_per_s"] > 0 and row["peak_mb"] >= 0 and row["reps"] >= 1
+    assert report["meta"]["host"] and report["skipped"] == {}
+
+    only = run_benchmarks(sizes=[64, 128], levels=[0, 1], reps=1, min_time=0, only={"run_detector@128/L1"})
+    assert list(only["results"]) == ["run_detector@128/L1"]
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/meminfo") and not hasattr(os, "sysconf"),
+                    reason="ni /proc/meminfo ni sysconf")
+def test_oversized_scene_skipped_without_psutil(monkeypatch):
+    """Sans psutil, la garde mémoire lit le système et saute les scènes trop grosses"""
+    monkeypatch.setitem(sys.modules, "psutil", None)
+    monkeypatch.setattr(orchestrator, "psutil", None)
+    assert detect_bench._available_mb() > 0
+    report = run_benchmarks(sizes=[1 << 20], levels=[0], reps=1, min_time=0)
+    assert list(report["skipped"]) == [str(1 << 20)] and report["results"] == {}
+
+def test_compare_flags_throughput_and_memory():
+    base = {"results": {"a": {"mpx_per_s": 10.0, "peak_mb": 20.0}, "b": {"mpx_per_s": 10.0, "peak_mb": 0.2}}}
+    cur = {"results": {"a": {"mpx_per_s": 8.0, "peak_mb": 30.0}, "b": {"mpx_per_s": 9.5, "peak_mb": 0.9},
+                       "new": {"mpx_per_s": 1.0, "peak_mb": 99.0}}}
+    found = {(r["key"], r["metric"]) for r in compare_to_baseline(cur, base, threshold=0.15)}
+    assert found == {("a", "mpx_per_s"), ("a", "peak_mb")}
+    assert compare_to_baseline(cur, base, threshold=0.25, mem_threshold=0.6) == []
+
+
+def test_cli_saves_baseline_and_fails_on_regression(capsys):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ref = Path(tmpdir) / "baseline.json"
+        common = ["--sizes", "64", "--levels", "0", "--reps", "1"]
+        assert main(common + ["--save-baseline", str(ref)]) == 0
+        capsys.readouterr()
+        assert main(common + ["--baseline", str(ref), "--threshold", "100", "--json"]) == 0
+        assert json.loads(capsys.readouterr().out)["regressions"] == []
+
+        data = json.loads(ref.read_text())
+        for row in data["results"].values():
+            row["mpx_per_s"] *= 10
+        ref.write_text(json.dumps(data))
+        assert main(common + ["--baseline", str(ref), "--confirm", "1"]) == 1
+        assert "régression" in capsys.readouterr().err
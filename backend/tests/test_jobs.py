@@ -0,0 +1,95 @@
+import time
+from app.jobs import submit, get_job
+
+def _wait(job, timeout=5.0):
+    t0 = time.time()
+    while job.status in ("queued", "running") and time.time() - t0 < timeout:
+        time.sleep(0.01)
+    return job
+
+def test_submit_reports_progress_and_result():
+    """Une tâche d'arrière-plan publie sa progression et son résultat"""
+    def work(n, progress):
+        for i in range(1, n + 1):
+            progress({"tiles_written": i, "tiles_total": n, "levels_done": list(range(i))})
+        return {"tiles_written": n}
+
+    job = _wait(submit("test", work, n=4))
+    assert job.status == "done"
+    assert job.result == {"tiles_written": 4}
+    assert job.progress["tiles_written"] == 4
+    assert job.progress["eta_s"] == 0
+    assert get_job(job.job_id) is job
+
+def test_submit_captures_errors():
+    """Une exception passe la tâche en erreur sans la propager"""
+    def boom(progress):
+        raise RuntimeError("pyvips manquant")
+
+    job = _wait(submit("test", boom))
+    assert job.status == "error"
+    assert "pyvips manquant" in job.error
+    assert job.finished_at is not None
+
+def test_job_status_endpoint():
+    """Statut via l'API et 404 pour un identifiant inconnu"""
+    from fastapi.testclient import TestClient
+    from app.main import app
+    client = TestClient(app)
+    job = _wait(submit("test", lambda progress: {"ok": True}))
+    response = client.get(f"/jobs/{job.job_id}")
+    assert response.status_code == 200
+    assert response.json()["status"] == "done"
+    assert client.get("/jobs/unknown").status_code == 404
+
+def test_same_key_returns_running_job_and_finished_jobs_expire(monkeypatch):
+    """Une seule tâche active par clé; les tâches terminées sont oubliées après le TTL"""
+    import threading
+    from app import jobs
+    release = threading.Event()
+
+    def slow(progress):
+        release.wait(5)
+        return {"ok": True}
+
+    first = submit("test", slow, key="tiles/scene")
+    assert submit("test", slow, key="tiles/scene") is first
+    other = submit("test", lambda progress: {}, key="tiles/other")
+    assert other is not first
+    release.set()
+    _wait(first)
+    assert submit("test", lambda progress: {}, key="tiles/scene") is not first
+
+    monkeypatch.setattr(jobs, "JOB_TTL_S", 0.0)
+    first.finished_at -= 1
+    submit("test", lambda progress: {})
+    assert get_job(first.job_id) is None
+
+def test_sync_run_shares_key_with_background_jobs(tmp_path, monkeypatch):
+    """Exécution synchrone et tâche de fond sur une même pyramide: jamais en même temps"""
+    import threading
+    import pytest
+    from fastapi.testclient import TestClient
+    from PIL import Image
+    from app import main
+    from app.jobs import JobBusy, exclusive
+    release = threading.Event()
+    busy = submit("generate-tiles", lambda progress: release.wait(5) and {}, key=str(tmp_path / "scene"))
+    with pytest.raises(JobBusy):
+        with exclusive("generate-tiles", str(tmp_path / "scene")):
+            pass
+
+    monkeypatch.setattr(main, "TILES_DIR", tmp_path)
+    src = tmp_path / "scene.png"
+    Image.new("RGB", (64, 64), "gray").save(src)
+    client = TestClient(main.app)
+    for extra in ({}, {"lazy": True}):
+        response = client.post("/generate-tiles", json={"image_path": str(src), **extra})
+        assert response.status_code == 409 and busy.job_id in response.json()["detail"]
+    release.set()
+    _wait(busy)
+    assert client.post("/generate-tiles", json={"image_path": str(src)}).status_code == 200
+
+    with exclusive("generate-tiles", str(tmp_path / "scene")) as job:
+        assert submit("generate-tiles", lambda progress: {}, key=str(tmp_path / "scene")) is job
+    assert job.status == "done" and submit("test", lambda progress: {}, key=str(tmp_path / "scene")) is not job
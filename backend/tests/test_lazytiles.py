@@ -0,0 +1,115 @@
+import os
+import sys
+import tempfile
+import threading
+from pathlib import Path
+import numpy as np
+import pytest
+from PIL import Image
+from app import lazytiles
+from app.lazytiles import prepare_lazy_pyramid, lazy_tile
+from app.pyramides import generate_deepzoom, read_dzi
+
+def _source(tmpdir, size=(1500, 700)):
+    yy, xx = np.mgrid[0:size[1], 0:size[0]]
+    arr = np.stack([xx % 256, yy % 256, (xx + yy) % 256], axis=-1).astype(np.uint8)
+    src = os.path.join(tmpdir, 'src.png')
+    Image.fromarray(arr).save(src)
+    return src
+
+def test_prepare_writes_only_coarse_levels():
+    """Niveaux ≤ 1024 px écrits d'emblée, niveau max (1500 px) absent jusqu'à la demande"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src, base = _source(tmpdir), os.path.join(tmpdir, 'scene')
+        report = prepare_lazy_pyramid(src, base, tile_size=256, suffix=".png")
+        assert report["eager_levels"] == list(range(11))
+        assert read_dzi(f"{base}.dzi")["width"] == 1500
+        assert not os.path.exists(f"{base}_files/11")
+        assert prepare_lazy_pyramid(src, base, tile_size=256, suffix=".png")["up_to_date"]
+
+        path = lazy_tile(base, 11, 2, 1)
+        assert path == Path(f"{base}_files/11/2_1.png")
+        # rendu fenêtré identique à la pyramide complète au niveau pleine résolution
+        full = os.path.join(tmpdir, 'full')
+        generate_deepzoom(src, full, tile_size=256, suffix=".png")
+        assert np.array_equal(np.asarray(Image.open(path)), np.asarray(Image.open(f"{full}_files/11/2_1.png")))
+        assert lazy_tile(base, 11, 99, 0) is None
+        assert lazy_tile(base, 42, 0, 0) is None
+
+def test_concurrent_requests_render_once(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src, base = _source(tmpdir), os.path.join(tmpdir, 'scene')
+        prepare_lazy_pyramid(src, base, tile_size=256, suffix=".png")
+        calls = []
+        original = lazytiles._write_tile
+        monkeypatch.setattr(lazytiles, "_write_tile", lambda *a: (calls.append(a[1]), original(*a)))
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(lazy_tile(base, 11, 0, 0))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(set(results)) == 1 and len(calls) == 1
+
+def test_source_change_invalidates_rendered_tiles():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src, base = _source(tmpdir), os.path.join(tmpdir, 'scene')
+        prepare_lazy_pyramid(src, base, tile_size=256, suffix=".png")
+        lazy_tile(base, 11, 0, 0)
+        Image.new('RGB', (1500, 700), 'red').save(src)
+        try:
+            lazy_tile(base, 11, 1, 0)
+            assert False, "source modifiée non détectée"
+        except ValueError:
+            pass
+        assert not prepare_lazy_pyramid(src, base, tile_size=256, suffix=".png")["up_to_date"]
+        assert not os.path.exists(f"{base}_files/11/0_0.png")
+
+def _eager_and_lazy(tmpdir, size):
+    src = _source(tmpdir, size)
+    lazy, full = os.path.join(tmpdir, 'lazy'), os.path.join(tmpdir, 'full')
+    prepare_lazy_pyramid(src, lazy, tile_size=256, suffix=".png", eager_size=256)
+    generate_deepzoom(src, full, tile_size=256, suffix=".png")
+    return lazy, full
+
+def _tiles(lazy, full, level, col, row):
+    a = np.asarray(Image.open(lazy_tile(lazy, level, col, row))).astype(int)
+    b = np.asarray(Image.open(f"{full}_files/{level}/{col}_{row}.png")).astype(int)
+    assert a.shape == b.shape
+    return np.abs(a - b).max()
+
+def test_lazy_levels_match_eager_pyramid(monkeypatch):
+    """Sans pyvips: niveaux intermédiaires identiques au moteur NumPy (bords impairs compris)"""
+    monkeypatch.setitem(sys.modules, "pyvips", None)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        lazy, full = _eager_and_lazy(tmpdir, (1501, 703))
+        for level, col, row in ((11, 5, 2), (10, 2, 1), (9, 1, 0), (9, 0, 0)):
+            assert _tiles(lazy, full, level, col, row) == 0
+
+def test_oversized_source_is_decoded_once(monkeypatch):
+    """Source décodée plus grosse que le budget: convertie une fois en .npy, tuiles lues
+    par fenêtres (paquets de lignes) sans redécodage ni épinglage"""
+    monkeypatch.setitem(sys.modules, "pyvips", None)
+    monkeypatch.setattr(lazytiles, "SOURCE_CACHE_BYTES", 1024)
+    monkeypatch.setattr(lazytiles, "WINDOW_BYTES", 64 * 1024)
+    lazytiles._sources.clear()
+    monkeypatch.setattr(lazytiles, "_sources_bytes", 0)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        lazy, full = _eager_and_lazy(tmpdir, (1501, 703))
+        assert (Path(f"{lazy}_files") / lazytiles.INTERMEDIATE).is_file()
+
+        def decode(_):
+            raise AssertionError("source redécodée")
+        monkeypatch.setattr(lazytiles, "_decoded_source", decode)
+        for level, col, row in ((11, 5, 2), (10, 2, 1), (9, 0, 0)):
+            assert _tiles(lazy, full, level, col, row) == 0
+        assert len(lazytiles._sources) == 0 and lazytiles._sources_bytes == 0
+
+def test_lazy_vips_matches_eager_pyramid():
+    """Avec pyvips: même géométrie et même noyau que dzsave (arrondi ±1 par réduction)"""
+    pytest.importorskip("pyvips")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        lazy, full = _eager_and_lazy(tmpdir, (1501, 703))
+        assert _tiles(lazy, full, 11, 5, 2) == 0
+        assert _tiles(lazy, full, 10, 2, 1) <= 1
+        assert _tiles(lazy, full, 9, 1, 0) <= 2
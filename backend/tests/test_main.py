@@ -1,3 +1,4 @@
+import asyncio
 import pytest
 import io
 from fastapi.testclient import TestClient
@@ -90,3 +91,128 @@ def test_upload_invalid_file():
     files = {"file": ("test.txt", io.BytesIO(text_content.encode()), "text/plain")}
     response = client.post("/upload", files=files)
     assert response.status_code == 400
+
+def test_annotations_pagination_and_projection():
+    """Test pagination par curseur et projection des champs"""
+    client.delete("/annotations")
+    for i in range(5):
+        client.post("/annotations", json={"type": "point", "x": i / 10, "y": 0.5})
+
+    response = client.get("/annotations?limit=2")
+    assert response.status_code == 200
+    assert [a["id"] for a in response.json()] == [1, 2]
+    assert response.headers["x-next-cursor"] == "2"
+
+    response = client.get("/annotations?after=4&limit=2")
+    assert [a["id"] for a in response.json()] == [5]
+    assert "x-next-cursor" not in response.headers
+
+    response = client.get("/annotations?after=1&limit=1&fields=id,x")
+    assert response.json() == [{"x": 0.1, "id": 2}]
+
+    assert client.get("/annotations?limit=0").status_code == 422
+    client.delete("/annotations")
+
+def test_detect_on_path_annotated(tmp_path):
+    """Test de la heatmap annotée"""
+    client.delete("/annotations")
+    client.post("/annotations", json={"type": "rect", "x": 0.1, "y": 0.1, "w": 0.5, "h": 0.5})
+    src = tmp_path / "src.png"
+    Image.new('RGB', (64, 64), color='gray').save(src)
+    response = client.post("/detect-on-path/annotated?level=0&fill=true", json={"image_path": str(src)})
+    assert response.status_code == 200
+    img = np.array(Image.open(io.BytesIO(response.content)))
+    assert tuple(img[20, 20]) == (0, 255, 0, 255)
+    client.delete("/annotations")
+
+def test_annotations_stream_snapshot_then_live(monkeypatch):
+    """Snapshot puis insertions en direct, sans doublon; abonné retiré à la fin du flux"""
+    import json
+    from starlette.requests import Request
+    from app import store
+    client.delete("/annotations")
+    client.post("/annotations", json={"type": "point", "x": 0.1, "y": 0.1})
+    subscribers = len(store._subscribers)
+    checks = []
+
+    async def is_disconnected(self):
+        # 1er passage: une insertion arrive après le snapshot; 2e passage: client parti
+        checks.append(1)
+        if len(checks) == 1:
+            store.save_annotation({"type": "point", "x": 0.2, "y": 0.2})
+        return len(checks) > 1
+    monkeypatch.setattr(Request, "is_disconnected", is_disconnected)
+
+    with client.stream("GET", "/annotations/stream?token=stale") as response:
+        assert response.status_code == 200
+        events = [block for block in response.read().decode().split("\n\n") if block.startswith("id:")]
+    kinds = [b.split("\n")[1] for b in events]
+    assert kinds == ["event: snapshot", "event: insert"]
+    snap = json.loads(events[0].split("data: ", 1)[1])
+    assert [a["id"] for a in snap["items"]] == [1]
+    assert json.loads(events[1].split("data: ", 1)[1])["item"]["id"] == 2
+    assert len(store._subscribers) == subscribers
+    client.delete("/annotations")
+
+def test_annotations_stream_resyncs_slow_client(monkeypatch):
+    """File saturée (client lent): snapshot de resynchronisation, pas de file sans fin"""
+    import json
+    from starlette.requests import Request
+    from app import main, store
+    client.delete("/annotations")
+    monkeypatch.setattr(main, "STREAM_QUEUE_MAX", 2)
+    checks = []
+
+    async def is_disconnected(self):
+        checks.append(1)
+        if len(checks) == 1:
+            for i in range(5):
+                store.save_annotation({"type": "point", "x": 0.1 * i, "y": 0.1})
+            await asyncio.sleep(0.05)  # laisse les rappels remplir la file
+        return len(checks) > 1
+    monkeypatch.setattr(Request, "is_disconnected", is_disconnected)
+
+    with client.stream("GET", "/annotations/stream?token=stale") as response:
+        events = [block for block in response.read().decode().split("\n\n") if block.startswith("id:")]
+    kinds = [b.split("\n")[1] for b in events]
+    assert kinds == ["event: snapshot", "event: snapshot"]
+    assert len(json.loads(events[1].split("data: ", 1)[1])["items"]) == 5
+    client.delete("/annotations")
+
+def test_annotations_stream_not_iterated_does_not_subscribe():
+    """Réponse jamais itérée: aucun abonné laissé derrière"""
+    import asyncio
+    from starlette.requests import Request
+    from app import store
+    from app.main import stream_annotations
+    before = len(store._subscribers)
+    request = Request({"type": "http", "method": "GET", "path": "/annotations/stream", "headers": [],
+                       "query_string": b""})
+    asyncio.run(stream_annotations(request))
+    assert len(store._subscribers) == before
+
+def test_tiles_endpoints_reject_non_integer_fields(tmp_path, monkeypatch):
+    """workers/quality non numériques → 400, pas 500"""
+    from app import main
+    from app.pyramides import generate_deepzoom
+    monkeypatch.setattr(main, "TILES_DIR", tmp_path)
+    src = tmp_path / "src.png"
+    Image.new('RGB', (32, 32), color='gray').save(src)
+    for workers in ("x", None, [2]):
+        response = client.post("/generate-tiles", json={"image_path": str(src), "workers": workers})
+        assert response.status_code == 400 and "workers" in response.json()["detail"]
+    generate_deepzoom(str(src), str(tmp_path / "src"), tile_size=16)
+    response = client.post("/recompress-tiles", json={"stem": "src", "quality": "high"})
+    assert response.status_code == 400 and "quality" in response.json()["detail"]
+
+def test_static_hides_dot_entries(tmp_path, monkeypatch):
+    """Dossiers de travail et fichiers cachés sous tiles/ non servis"""
+    from app import main
+    (tmp_path / "a_files" / ".staging-x").mkdir(parents=True)
+    (tmp_path / "a_files" / ".staging-x" / "t.png").write_bytes(b"x")
+    (tmp_path / "a_files" / "0").mkdir()
+    (tmp_path / "a_files" / "0" / "0_0.png").write_bytes(b"y")
+    static = next(r.app for r in main.app.routes if getattr(r, "path", None) == "/static")
+    monkeypatch.setattr(static, "all_directories", [str(tmp_path)])
+    assert client.get("/static/a_files/0/0_0.png").status_code == 200
+    assert client.get("/static/a_files/.staging-x/t.png").status_code == 404
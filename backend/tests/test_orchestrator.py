@@ -2,6 +2,7 @@ import pytest
 import json
 import tempfile
 import os
+import numpy as np
 from pathlib import Path
 from PIL import Image
 from app.orchestrator import Job, load_manifest, estimate_level_scale, run_job
@@ -160,3 +161,169 @@ def test_run_job_different_levels():
                 prev_height = results["levels"][i-1]["stats"]["height"]
                 curr_height = level_result["stats"]["height"]
                 assert curr_height <= prev_height
+
+def test_run_batch_parallel_matches_sequential():
+    """Pool de processus: mêmes sorties que le mode séquentiel, ordre du manifeste conservé"""
+    from app.orchestrator import run_batch
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sources = []
+        for i, size in enumerate([(120, 90), (64, 64), (150, 100)]):
+            p = os.path.join(tmpdir, f'img{i}.png')
+            Image.new('RGB', size, color=(40 * i, 80, 120)).save(p)
+            sources.append(p)
+
+        def jobs():
+            return [Job(image_id=f"img{i}", source=Path(p), levels=[2, 0, 1], base_scale=None, save_png=False)
+                    for i, p in enumerate(sources)] + [Job("broken", Path("missing.png"), [0], None, False)]
+
+        seq = run_batch(jobs(), Path(tmpdir) / "seq", retries=0, workers=1)
+        par = run_batch(jobs(), Path(tmpdir) / "par", retries=0, workers=2)
+        assert [j["image_id"] for j in par["jobs"]] == ["img0", "img1", "img2", "broken"]
+        for a, b in zip(seq["jobs"], par["jobs"]):
+            assert [lv["level"] for lv in b["levels"]] == [lv["level"] for lv in a["levels"]]
+            assert [lv.get("stats") for lv in b["levels"]] == [lv.get("stats") for lv in a["levels"]]
+        assert "error" in par["jobs"][3]["levels"][0]
+        assert par["throughput"]["images"] == 4 and par["throughput"]["levels"] == 10
+        assert par["throughput"]["images_per_s"] > 0
+        for i in range(3):
+            summary = json.loads((Path(tmpdir) / "par" / f"img{i}" / f"img{i}_summary.json").read_text())
+            assert [lv["level"] for lv in summary["levels"]] == [2, 0, 1]
+            assert (Path(tmpdir) / "par" / f"img{i}" / f"img{i}_L1.json").exists()
+
+def test_rerun_skips_current_levels():
+    """Relance: niveaux à jour sautés; source modifiée ou --force → recalcul"""
+    from app.orchestrator import run_batch
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, 'scene.png')
+        Image.new('RGB', (80, 60), color='white').save(src)
+        out = Path(tmpdir) / "out"
+
+        def jobs():
+            return [Job("scene", Path(src), [0, 1], None, True)]
+
+        first = run_batch(jobs(), out)
+        assert (first["levels_computed"], first["levels_skipped"]) == (2, 0)
+        again = run_batch(jobs(), out)
+        assert (again["levels_computed"], again["levels_skipped"]) == (0, 2)
+        assert again["jobs"][0]["levels"][1]["stats"] == first["jobs"][0]["levels"][1]["stats"]
+        assert run_batch(jobs(), out, checksum=True)["levels_computed"] == 2  # autre type d'empreinte
+        assert run_batch(jobs(), out, force=True)["levels_skipped"] == 0
+
+        os.remove(out / "scene" / "scene_L1.png")  # sortie incomplète
+        assert run_batch(jobs(), out)["levels_computed"] == 1
+        Image.new('RGB', (80, 60), color='black').save(src)
+        os.utime(src, ns=(1, 1))
+        assert run_batch(jobs(), out)["levels_computed"] == 2
+
+def test_journal_resume_after_crash():
+    """Crash au 3e job: le journal garde les 2 premiers; --resume ne relance que la suite"""
+    from app.orchestrator import Journal, run_batch
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, 'scene.png')
+        Image.new('RGB', (64, 48), color='white').save(src)
+        out = Path(tmpdir) / "out"
+        all_jobs = [Job(f"img{i}", Path(src), [0], None, False) for i in range(5)]
+
+        def crashing():
+            for i, job in enumerate(all_jobs):
+                if i == 2:
+                    raise KeyboardInterrupt
+                yield job
+
+        journal = Journal(out / "journal.ndjson")
+        with pytest.raises(KeyboardInterrupt):
+            run_batch(crashing(), out, journal=journal)
+        journal.close()
+        with open(out / "journal.ndjson", "a") as f:
+            f.write('{"index": 2, "image_id": "img2", "lev')  # ligne tronquée par le crash
+        probe = Journal(out / "journal.ndjson", resume=True)
+        assert probe.resume_point() == (2, "img1")
+        probe.close()
+
+        journal = Journal(out / "journal.ndjson", resume=True)
+        summary = run_batch(iter(all_jobs), out, journal=journal)
+        journal.close()
+        assert summary["throughput"]["images"] == 3 and summary["throughput"]["images_resumed"] == 2
+        assert [j["image_id"] for j in journal.results()] == [f"img{i}" for i in range(5)]
+        lines = (out / "journal.ndjson").read_text().splitlines()
+        assert len(lines) == 5 and all(json.loads(l) for l in lines)
+
+def test_ndjson_manifest_streamed_to_summary():
+    """Manifeste NDJSON lu en flux; batch_summary.json écrit en flux depuis le journal"""
+    from app.orchestrator import Journal, open_manifest, run_batch, write_batch_summary
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, 'scene.png')
+        Image.new('RGB', (64, 48), color='white').save(src)
+        manifest = Path(tmpdir) / "m.ndjson"
+        lines = [json.dumps({"base_level": 3})] + [json.dumps({"id": f"img{i}", "source": src, "levels": [0, 1]})
+                                                  for i in range(6)]
+        manifest.write_text("\n".join(lines) + "\n")
+        settings, images = open_manifest(manifest)
+        assert settings == {"base_level": 3}
+        assert load_manifest(manifest)["images"][5]["id"] == "img5"
+
+        out = Path(tmpdir) / "out"
+        journal = Journal(out / "journal.ndjson")
+        jobs = (Job(it["id"], Path(it["source"]), it["levels"], settings["base_level"], False) for it in images)
+        run = run_batch(jobs, out, workers=2, journal=journal)
+        journal.close()
+        assert "jobs" not in run and run["levels_computed"] == 12
+        tail = write_batch_summary(out / "batch_summary.json", journal.results(), {"throughput": run["throughput"]})
+        summary = json.loads((out / "batch_summary.json").read_text())
+        assert [j["image_id"] for j in summary["jobs"]] == [f"img{i}" for i in range(6)]
+        assert summary["levels_computed"] == tail["levels_computed"] == 12
+        assert summary["throughput"]["images"] == 6
+
+def test_level_records_stage_profile_and_peak_memory():
+    """Chaque niveau recalculé porte ses durées par étape et son pic mémoire; le résumé les agrège"""
+    from app.orchestrator import PeakMemory, run_batch, write_batch_summary
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, 'scene.png')
+        Image.new('RGB', (160, 120), color='white').save(src)
+        out = Path(tmpdir) / "out"
+        run = run_batch([Job("scene", Path(src), [0, 1], None, True)], out)
+        rec = run["jobs"][0]["levels"][0]
+        assert {"decode", "gray", "gaussian", "laplacian", "normalize", "colorize",
+                "png_encode", "json_write"} <= set(rec["stages_ms"])
+        assert rec["peak_mem_mb"] > 0 and rec["peak_mem_method"] in ("vmhwm", "tracemalloc")
+        assert "resize" in run["jobs"][0]["levels"][1]["stages_ms"]
+
+        tail = write_batch_summary(out / "batch_summary.json", run["jobs"], {})
+        prof = json.loads((out / "batch_summary.json").read_text())["profile"]
+        assert prof == tail["profile"]
+        assert set(prof["stages_ms"]) == set(rec["stages_ms"]) | {"resize"}
+        assert abs(sum(prof["stages_pct"].values()) - 100) < 1
+        assert prof["peak_mem_mb_max"] >= rec["peak_mem_mb"]
+
+        # niveaux à jour: ni étapes ni pic
+        again = run_batch([Job("scene", Path(src), [0, 1], None, True)], out)
+        assert again["profile"]["stages_ms"] == {} and again["profile"]["peak_mem_mb_max"] is None
+
+        with PeakMemory() as peak:
+            blob = bytearray(64 * 2 ** 20)
+            blob[::4096] = b"\x01" * len(blob[::4096])
+        assert peak.mb >= 64
+
+def test_memory_budget_routes_large_levels_to_tiled_path():
+    """--mem-budget: niveaux trop gros en détection par bandes, budget minuscule sans interblocage"""
+    from app.orchestrator import plan_level_memory, run_batch
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, 'scene.png')
+        arr = (np.random.default_rng(1).random((300, 400, 3)) * 255).astype(np.uint8)
+        Image.fromarray(arr).save(src)
+        job = Job("scene", Path(src), [0, 1], None, False)
+        tiled, cost = plan_level_memory(job, 0, 1.0)
+        assert tiled and 0 < cost
+        assert plan_level_memory(job, 0, None)[0] is False
+        assert plan_level_memory(Job("x", Path("missing.png"), [0], None, False), 0, 1.0) == (False, 0.0)
+
+        ref = run_batch([job], Path(tmpdir) / "ref")
+        jobs = [Job(f"img{i}", Path(src), [0, 1], None, False) for i in range(3)]
+        run = run_batch(jobs, Path(tmpdir) / "budget", workers=2, mem_budget_mb=0.5)
+        assert run["levels_tiled"] == 6 and run["levels_failed"] == 0
+        for res in run["jobs"]:
+            for a, b in zip(res["levels"], ref["jobs"][0]["levels"]):
+                assert a["tiled"] and not b["tiled"]
+                assert abs(a["stats"]["mean"] - b["stats"]["mean"]) < 1e-5
+        roomy = run_batch(jobs[:1], Path(tmpdir) / "roomy", workers=2, mem_budget_mb=10_000)
+        assert roomy["levels_tiled"] == 0
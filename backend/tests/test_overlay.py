@@ -0,0 +1,75 @@
+import io
+import numpy as np
+from PIL import Image
+from app.overlay import annotation_boxes, rasterize_annotations, composite_annotations, annotation_tile
+
+def test_annotation_boxes_scaling():
+    """Test de la conversion coordonnées viewport → pixels"""
+    anns = [
+        {"type": "rect", "x": 0.1, "y": 0.2, "w": 0.2, "h": 0.1},
+        {"type": "point", "x": 0.5, "y": 0.5},
+    ]
+    boxes, is_pt = annotation_boxes(anns, scale=100, point_radius=2)
+    assert boxes.tolist() == [[10, 20, 30, 30], [48, 48, 53, 53]]
+    assert is_pt.tolist() == [False, True]
+
+def test_rasterize_filled_matches_slices():
+    """Le masque rempli correspond à l'affectation par tranches"""
+    rng = np.random.default_rng(0)
+    anns = []
+    expected = np.zeros((64, 80), dtype=bool)
+    for _ in range(200):
+        x, y = rng.integers(-10, 80), rng.integers(-10, 64)
+        w, h = rng.integers(1, 20), rng.integers(1, 20)
+        anns.append({"type": "rect", "x": x / 100, "y": y / 100, "w": w / 100, "h": h / 100})
+        expected[max(0, y):max(0, y + h), max(0, x):max(0, x + w)] = True
+    mask = rasterize_annotations(anns, (80, 64), scale=100, thickness=None)
+    assert mask.shape == (64, 80)
+    assert np.array_equal(mask, expected)
+
+def test_rasterize_outline_and_window():
+    """Contour d'un rectangle et décalage de fenêtre (tuile)"""
+    anns = [{"type": "rect", "x": 0.1, "y": 0.1, "w": 0.2, "h": 0.2}]
+    mask = rasterize_annotations(anns, (40, 40), scale=100, thickness=1)
+    assert mask[10, 10:30].all() and mask[29, 10:30].all()
+    assert not mask[15:25, 15:25].any()
+
+    win = rasterize_annotations(anns, (10, 10), scale=100, origin=(25, 25), thickness=None)
+    assert win[:5, :5].all() and not win[5:, 5:].any()
+
+def test_composite_and_tile():
+    """Incrustation dans une heatmap et tuile transparente"""
+    anns = [{"type": "point", "x": 0.5, "y": 0.5}]
+    heat = Image.new('RGBA', (20, 20), (0, 0, 255, 160))
+    mask = rasterize_annotations(anns, heat.size, scale=20)
+    out = np.array(composite_annotations(heat, mask))
+    assert tuple(out[10, 10]) == (0, 255, 0, 255)
+    assert tuple(out[0, 0]) == (0, 0, 255, 160)
+
+    tile = np.array(annotation_tile(anns, (8, 8, 4, 4), scale=20))
+    assert tile.shape == (4, 4, 4)
+    assert tile[..., 3].max() == 255
+
+def test_rasterize_empty():
+    """Aucune annotation → masque vide"""
+    assert not rasterize_annotations([], (5, 5), scale=5).any()
+
+def test_overlay_tile_endpoint(tmp_path, monkeypatch):
+    """Tuile d'annotations servie sur la grille DZI"""
+    from fastapi.testclient import TestClient
+    from app import main
+    monkeypatch.setattr(main, "TILES_DIR", tmp_path)
+    (tmp_path / "scene.dzi").write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="jpg" Overlap="0" TileSize="256">'
+        '<Size Width="512" Height="256"/></Image>')
+    monkeypatch.setattr(main, "load_annotations", lambda: [{"type": "point", "x": 0.75, "y": 0.25}])
+    client = TestClient(main.app)
+    response = client.get("/overlay/scene/9/1_0.png")
+    assert response.status_code == 200
+    tile = np.array(Image.open(io.BytesIO(response.content)))
+    assert tile.shape == (256, 256, 4)
+    assert tile[128, 128, 3] == 255
+    assert client.get("/overlay/missing/9/0_0.png").status_code == 404
+    for bad in ("40/0_0", "-1/0_0", "9/-2_0", "9/2_0", "9/0_1", "8/1_0"):
+        assert client.get(f"/overlay/scene/{bad}.png").status_code == 404
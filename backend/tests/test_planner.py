@@ -0,0 +1,57 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from PIL import Image
+
+from app.orchestrator import Job, run_batch
+from app.planner import calibrate, format_plan, load_or_calibrate, makespan, plan_batch
+
+
+def test_calibration_is_cached_per_host_and_code():
+    """Micro-benchmark: coûts positifs, réutilisés depuis le cache, recalculés sur demande"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "cost_model.json"
+        model = load_or_calibrate(path, size=128, reps=1)
+        for key in ("decode_s_per_mpx", "detect_s_per_mpx", "png_s_per_mpx", "png_bytes_per_px"):
+            assert model[key] > 0
+        assert model["tiled_factor"] >= 1.0
+        assert load_or_calibrate(path) == model
+        stale = dict(model, code="autre")
+        path.write_text(json.dumps(stale))
+        assert load_or_calibrate(path, size=128, reps=1)["code"] == model["code"]
+
+
+def test_plan_predicts_levels_without_running_them():
+    """Plan à blanc: en-têtes seuls, niveaux à jour sautés, entrées pathologiques signalées"""
+    model = calibrate(size=128, reps=1)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, 'scene.png')
+        Image.new('RGB', (400, 300), color=(10, 80, 160)).save(src)
+        out = Path(tmpdir) / "out"
+        jobs = [Job("scene", Path(src), [0, 1, 3], 2, True), Job("lost", Path("missing.png"), [0], 2, True)]
+
+        plan = plan_batch(jobs, model, workers=2, mem_budget_mb=2.0, out_root=out)
+        assert not out.exists()
+        rows = {(r["image_id"], r["level"]): r for r in plan["levels"]}
+        assert rows[("scene", 0)]["output_px"] == [100, 75] and rows[("scene", 1)]["output_px"] == [200, 150]
+        assert rows[("scene", 3)]["output_px"] == [800, 600] and "upsampled" in rows[("scene", 3)]["flags"]
+        assert rows[("scene", 3)]["action"] == "tiled" and "over_budget" in rows[("scene", 3)]["flags"]
+        assert rows[("lost", 0)]["action"] == "error" and rows[("lost", 0)]["flags"] == ["unreadable"]
+        assert rows[("scene", 3)]["seconds"] > rows[("scene", 0)]["seconds"] > 0
+        totals = plan["totals"]
+        assert totals["levels"] == 4 and totals["flagged"] == 2
+        assert totals["wall_seconds"]["1"] >= totals["wall_seconds"]["2"]
+        assert "workers conseillés" in format_plan(plan)
+
+        run_batch(jobs[:1], out, mem_budget_mb=2.0)
+        again = plan_batch(jobs[:1], model, out_root=out)
+        assert [r["action"] for r in again["levels"]] == ["skip"] * 3
+        assert again["totals"]["cpu_seconds"] == 0
+
+
+def test_makespan_longest_first():
+    assert makespan([4, 3, 3, 2], 2) == 6
+    assert makespan([5, 1, 1], 4) == 5
+    assert makespan([], 3) == 0
@@ -100,3 +100,228 @@ def test_generate_deepzoom_invalid_image():
         
         with pytest.raises(Exception):
             generate_deepzoom(text_file, output_name)
+
+def _fake_pyramid(tmpdir, width=100, height=60, tile_size=64, suffix=".jpg"):
+    """Construit une pyramide factice complète + manifeste, sans pyvips"""
+    from app.pyramides import (PyramidManifest, source_fingerprint, write_dzi,
+                               max_level, level_grid)
+    input_path = os.path.join(tmpdir, 'src.png')
+    Image.new('RGB', (width, height), color='white').save(input_path)
+    base = os.path.join(tmpdir, 'pyr')
+    write_dzi(base, width, height, tile_size, 0, suffix.lstrip('.'))
+    manifest = PyramidManifest(Path(f"{base}_files"))
+    manifest.reset_for(source_fingerprint(input_path), width, height)
+    params = {"tile_size": tile_size, "overlap": 0, "suffix": suffix}
+    for lv in range(max_level(width, height) + 1):
+        cols, rows = level_grid(width, height, lv, tile_size)
+        os.makedirs(f"{base}_files/{lv}", exist_ok=True)
+        manifest.start_level(lv, params, cols, rows)
+        for r in range(rows):
+            for c in range(cols):
+                Image.new('RGB', (4, 4)).save(f"{base}_files/{lv}/{c}_{r}{suffix}")
+            manifest.mark_row(lv, r)
+    manifest.save()
+    return input_path, base
+
+def test_generate_deepzoom_up_to_date_is_noop():
+    """Une pyramide complète et à jour n'est pas régénérée"""
+    from app.pyramides import pyramid_is_current
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_path, base = _fake_pyramid(tmpdir)
+        assert pyramid_is_current(input_path, base, tile_size=64)
+        report = generate_deepzoom(input_path, base, tile_size=64)
+        assert report == {"up_to_date": True, "levels_built": [], "tiles_written": 0}
+
+        # Paramètres différents ou tuile manquante → périmé
+        assert not pyramid_is_current(input_path, base, tile_size=128)
+        os.remove(f"{base}_files/7/0_0.jpg")
+        assert not pyramid_is_current(input_path, base, tile_size=64)
+        assert pyramid_is_current(input_path, base, tile_size=64, levels=[0, 1, 2])
+
+def test_manifest_resume_and_param_change():
+    """Le manifeste reprend à la dernière ligne terminée et se réinitialise si les paramètres changent"""
+    from app.pyramides import PyramidManifest
+    with tempfile.TemporaryDirectory() as tmpdir:
+        m = PyramidManifest(Path(tmpdir))
+        m.reset_for({"size": 1}, 100, 100)
+        params = {"tile_size": 32, "overlap": 0, "suffix": ".jpg"}
+        assert m.start_level(7, params, 4, 4) == 0
+        m.mark_row(7, 0); m.mark_row(7, 1)
+        m.save()
+
+        m2 = PyramidManifest.load(Path(tmpdir))
+        assert m2.start_level(7, params, 4, 4) == 2
+        assert m2.start_level(7, dict(params, overlap=1), 4, 4) == 0
+        m2.reset_for({"size": 2}, 100, 100)
+        assert m2.level(7) is None
+
+def test_numpy_engine_matches_box_reduction():
+    """Le moteur NumPy/Pillow produit la grille DZI et des niveaux réduits 2×2"""
+    import numpy as np
+    from app.pyramides import read_dzi, level_size, level_grid, max_level, _box_reduce
+    rng = np.random.default_rng(1)
+    src = rng.integers(0, 255, size=(150, 301, 3), dtype=np.uint8)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_path = os.path.join(tmpdir, 'src.png')
+        Image.fromarray(src).save(input_path)
+        base = os.path.join(tmpdir, 'out')
+        report = generate_deepzoom(input_path, base, tile_size=64, overlap=1, suffix=".png")
+        top = max_level(301, 150)
+        assert report["levels_built"] == list(range(top + 1))
+        assert read_dzi(f"{base}.dzi") == {"width": 301, "height": 150, "tile_size": 64,
+                                           "overlap": 1, "format": "png"}
+        for lv in range(top + 1):
+            cols, rows = level_grid(301, 150, lv, 64)
+            names = {n for n in os.listdir(f"{base}_files/{lv}") if n.endswith(".png")}
+            assert names == {f"{c}_{r}.png" for c in range(cols) for r in range(rows)}
+
+        # niveau max: tuile 1_1 = source[63:129, 63:129] (recouvrement de 1)
+        tile = np.asarray(Image.open(f"{base}_files/{top}/1_1.png"))
+        assert np.array_equal(tile, src[63:129, 63:129])
+        # niveau max-1: réduction 2×2 de la source
+        lw, lh = level_size(301, 150, top - 1)
+        reduced = _box_reduce(src)
+        assert reduced.shape[:2] == (lh, lw)
+        tile = np.asarray(Image.open(f"{base}_files/{top - 1}/0_0.png"))
+        assert np.array_equal(tile, reduced[:65, :65])
+        assert np.asarray(Image.open(f"{base}_files/0/0_0.png")).shape == (1, 1, 3)
+
+def test_numpy_engine_rebuilds_only_missing_level():
+    """Après suppression d'un niveau, seul ce niveau est régénéré"""
+    import shutil
+    from app.pyramides import pyramid_is_current
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_path = os.path.join(tmpdir, 'src.png')
+        Image.new('RGB', (200, 120), color='navy').save(input_path)
+        base = os.path.join(tmpdir, 'out')
+        generate_deepzoom(input_path, base, tile_size=64)
+        shutil.rmtree(f"{base}_files/7")
+        assert not pyramid_is_current(input_path, base, tile_size=64)
+        report = generate_deepzoom(input_path, base, tile_size=64)
+        assert report["levels_built"] == [7]
+        assert pyramid_is_current(input_path, base, tile_size=64)
+
+def test_numpy_engine_workers_identical_output():
+    """L'encodage multi-processus produit exactement les mêmes tuiles"""
+    import numpy as np
+    rng = np.random.default_rng(2)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_path = os.path.join(tmpdir, 'src.png')
+        Image.fromarray(rng.integers(0, 255, size=(200, 330, 3), dtype=np.uint8)).save(input_path)
+        serial, parallel = os.path.join(tmpdir, 'a'), os.path.join(tmpdir, 'b')
+        generate_deepzoom(input_path, serial, tile_size=64, suffix=".png", workers=1)
+        report = generate_deepzoom(input_path, parallel, tile_size=64, suffix=".png", workers=2)
+        assert report["tiles_written"] > 0
+        assert report["workers"] == (2 if report["engine"] == "numpy" else 1)
+        for root, _, files in os.walk(f"{serial}_files"):
+            for name in files:
+                if name.endswith(".png"):
+                    other = os.path.join(f"{parallel}_files", os.path.relpath(root, f"{serial}_files"), name)
+                    with open(os.path.join(root, name), 'rb') as fa, open(other, 'rb') as fb:
+                        assert fa.read() == fb.read()
+        assert not [n for _, _, fs in os.walk(f"{parallel}_files") for n in fs if ".part" in n]
+
+def test_encoder_pool_is_shared_and_not_forked():
+    """Pool d'encodage réutilisé d'un appel à l'autre, démarré sans fork du serveur"""
+    from app.pyramides import shared_process_pool
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_path = os.path.join(tmpdir, 'src.png')
+        Image.new('RGB', (300, 200), 'gray').save(input_path)
+        pool = shared_process_pool(2)
+        assert pool._mp_context.get_start_method() in ("forkserver", "spawn")
+        for name in ('a', 'b'):
+            generate_deepzoom(input_path, os.path.join(tmpdir, name), tile_size=64, suffix=".png", workers=2)
+        assert shared_process_pool(2) is pool
+
+def test_cogenerated_heatmap_matches_detector():
+    """La pyramide heatmap co-générée a la même grille et égale la détection pleine résolution"""
+    import numpy as np
+    from app.pyramides import generate_deepzoom_with_heatmap, read_dzi, max_level, level_grid
+    from app.detect import run_detector_on_image_path
+    rng = np.random.default_rng(3)
+    src = rng.integers(0, 255, size=(140, 210, 3), dtype=np.uint8)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_path = os.path.join(tmpdir, 'src.png')
+        Image.fromarray(src).save(input_path)
+        img_base, heat_base = os.path.join(tmpdir, 'img'), os.path.join(tmpdir, 'heat')
+        report = generate_deepzoom_with_heatmap(input_path, img_base, heat_base, tile_size=64, suffix=".png")
+        assert report["image"]["tiles_written"] == report["heatmap"]["tiles_written"] > 0
+
+        img_info, heat_info = read_dzi(f"{img_base}.dzi"), read_dzi(f"{heat_base}.dzi")
+        assert {k: heat_info[k] for k in ("width", "height", "tile_size", "overlap")} == \
+               {k: img_info[k] for k in ("width", "height", "tile_size", "overlap")}
+        assert heat_info["format"] == "png"
+        for lv in range(max_level(210, 140) + 1):
+            assert sorted(os.listdir(f"{img_base}_files/{lv}")) == sorted(os.listdir(f"{heat_base}_files/{lv}"))
+
+        expected = np.asarray(run_detector_on_image_path(input_path)[0])
+        top = max_level(210, 140)
+        tile = np.asarray(Image.open(f"{heat_base}_files/{top}/1_1.png"))
+        assert tile.shape == (64, 64, 4)
+        assert np.abs(tile.astype(int) - expected[64:128, 64:128].astype(int)).max() <= 1
+        assert not [n for n in os.listdir(f"{heat_base}_files") if n.startswith(".")]
+
+        again = generate_deepzoom_with_heatmap(input_path, img_base, heat_base, tile_size=64, suffix=".png")
+        assert again["up_to_date"]
+
+def test_vips_engine_dzsave_is_incremental():
+    """Moteur libvips: dzsave publié tuile à tuile, manifeste complet, reprise par niveau"""
+    pytest.importorskip("pyvips")
+    import shutil
+    import numpy as np
+    from app.pyramides import PyramidManifest, level_grid, max_level, pyramid_is_current
+    rng = np.random.default_rng(4)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_path = os.path.join(tmpdir, 'src.png')
+        Image.fromarray(rng.integers(0, 255, size=(200, 300, 3), dtype=np.uint8)).save(input_path)
+        base = os.path.join(tmpdir, 'out')
+        report = generate_deepzoom(input_path, base, tile_size=64, suffix=".png")
+        top = max_level(300, 200)
+        assert report["levels_built"] == list(range(top + 1))
+        manifest = PyramidManifest.load(f"{base}_files")
+        assert all(manifest.level(lv)["done"] for lv in range(top + 1))
+        for lv in range(top + 1):
+            cols, rows = level_grid(300, 200, lv, 64)
+            names = {n for n in os.listdir(f"{base}_files/{lv}") if n.endswith(".png")}
+            assert names == {f"{c}_{r}.png" for c in range(cols) for r in range(rows)}
+        assert not [n for n in os.listdir(f"{base}_files") if n.startswith(".staging-")]
+
+        assert generate_deepzoom(input_path, base, tile_size=64, suffix=".png")["up_to_date"]
+        shutil.rmtree(f"{base}_files/{top}")
+        assert generate_deepzoom(input_path, base, tile_size=64, suffix=".png")["levels_built"] == [top]
+        assert pyramid_is_current(input_path, base, tile_size=64, suffix=".png")
+
+        # seuls des niveaux grossiers périmés: dzsave sur la source réduite, mêmes grilles
+        for lv in (0, 1, 2):
+            shutil.rmtree(f"{base}_files/{lv}")
+        assert generate_deepzoom(input_path, base, tile_size=64, suffix=".png")["levels_built"] == [0, 1, 2]
+        assert os.listdir(f"{base}_files/2") == ["0_0.png"]
+        assert Image.open(f"{base}_files/2/0_0.png").size == (3, 2)
+
+def test_stale_staging_dirs_are_swept(tmp_path):
+    """Dossiers de travail dzsave laissés par un arrêt brutal: supprimés à la génération suivante"""
+    src = tmp_path / "src.png"
+    Image.new("RGB", (100, 60), "gray").save(src)
+    base = tmp_path / "out"
+    generate_deepzoom(str(src), str(base), tile_size=64, suffix=".png")
+    stale = tmp_path / "out_files" / ".staging-crash" / "p_files" / "7"
+    stale.mkdir(parents=True)
+    generate_deepzoom(str(src), str(base), tile_size=64, suffix=".png", force=True)
+    assert not (tmp_path / "out_files" / ".staging-crash").exists()
+
+def test_cogenerated_heatmap_decodes_source_once(monkeypatch):
+    """Image + heatmap: une seule lecture de la source"""
+    import numpy as np
+    from app import pyramides
+    from app.pyramides import generate_deepzoom_with_heatmap
+    calls = []
+    original = pyramides._pil_strips
+    monkeypatch.setattr(pyramides, "_pil_strips", lambda *a: (calls.append(a), original(*a))[1])
+    rng = np.random.default_rng(5)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_path = os.path.join(tmpdir, 'src.png')
+        Image.fromarray(rng.integers(0, 255, size=(150, 200, 3), dtype=np.uint8)).save(input_path)
+        report = generate_deepzoom_with_heatmap(input_path, os.path.join(tmpdir, 'img'), os.path.join(tmpdir, 'heat'),
+                                                tile_size=64, suffix=".png")
+        assert report["heatmap"]["tiles_written"] > 0
+    assert len(calls) == 1
@@ -0,0 +1,128 @@
+import os
+import tempfile
+import numpy as np
+import pytest
+from PIL import Image
+import tracemalloc
+from app.raster import RasterReader, open_raster, read_resampled, display_strips, raster_size
+from app.detect import DETECTOR_PARAMS, detect_loglike, run_detector_on_image_path, to_gray
+from app.pyramides import generate_deepzoom, read_dzi
+
+tifffile = pytest.importorskip("tifffile")
+
+def _data(h=300, w=500, bands=3):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 65535, size=(h, w, bands), dtype=np.uint16)
+
+@pytest.mark.parametrize("layout", [{"tile": (64, 64)}, {"rowsperstrip": 16}, {"tile": (64, 64), "planarconfig": "separate"}])
+def test_windowed_read_matches_full(layout):
+    """Fenêtres lues segment par segment == découpe de l'image complète (tuilé, bandes, plans séparés)"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data = _data()
+        path = os.path.join(tmpdir, 'scene.tif')
+        planes = layout.get("planarconfig") == "separate"
+        tifffile.imwrite(path, data.transpose(2, 0, 1) if planes else data, photometric='rgb', compression='zlib',
+                         **layout)
+        with open_raster(path) as r:
+            assert (r.width, r.height, r.bands, r.dtype) == (500, 300, 3, np.uint16)
+            assert np.array_equal(r.read(37, 50, 200, 90), data[50:140, 37:237])
+            assert np.array_equal(r.read(0, 250, 500, 50, bands=[2, 0]), data[250:300][..., [2, 0]])
+            assert np.array_equal(np.concatenate(list(r.strips(70))), data)
+
+def test_resampled_is_box_mean():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data = _data(256, 128, 2)
+        path = os.path.join(tmpdir, 'ms.tif')
+        tifffile.imwrite(path, data, tile=(32, 32), planarconfig='contig')
+        with open_raster(path) as r:
+            out = read_resampled(r, (32, 64), chunk_rows=7)
+        ref = data.astype(np.float64).reshape(64, 4, 32, 4, 2).mean(axis=(1, 3))
+        assert out.shape == (64, 32, 2) and np.allclose(out, ref, rtol=1e-4)
+
+class _RowRamp(RasterReader):
+    """Source synthétique large (valeur = ligne), générée à la lecture."""
+
+    width, height, bands, dtype = 4096, 4096, 3, np.dtype(np.uint16)
+
+    def read(self, x, y, w, h, bands=None):
+        rows = np.arange(y, y + h, dtype=np.uint16)[:, None, None]
+        return np.broadcast_to(rows, (h, w, len(bands) if bands is not None else self.bands)).copy()
+
+def test_resampled_window_fits_budget():
+    """Échelle 16 sur une source large: pic mémoire ≈ résultat + budget, pas chunk × échelle × largeur"""
+    with pytest.raises(TypeError):
+        RasterReader()
+    budget = 4 * 1024 * 1024
+    tracemalloc.start()
+    try:
+        out = read_resampled(_RowRamp(), (256, 256), budget=budget)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < out.nbytes + 2 * budget
+    assert np.allclose(out[10, :, 0], 10 * 16 + 7.5)
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+def test_raster_detection_uses_box_filter(dtype):
+    """Sources raster à échelle 2: stats = détecteur sur la moyenne boîte 2×2 (pas BICUBIC)"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data = _data(128, 96, 3)
+        data = (data >> 8).astype(np.uint8) if dtype == np.uint8 else data
+        path = os.path.join(tmpdir, 'scene.tif')
+        tifffile.imwrite(path, data, photometric='rgb', tile=(32, 32))
+        _, stats = run_detector_on_image_path(path, level_scale=2.0)
+        box = data.astype(np.float64).reshape(64, 2, 48, 2, 3).mean(axis=(1, 3)).astype(np.float32)
+        ref = detect_loglike(to_gray(box), DETECTOR_PARAMS["sigma_low"], DETECTOR_PARAMS["sigma_high"])
+        for key in ("min", "max", "mean", "std"):
+            assert stats[key] == pytest.approx(float(getattr(ref, key)()), abs=1e-4)
+
+def test_16bit_detection_and_tiling():
+    """Contraste confiné au-dessus de 255: invisible après troncature 8 bits, détecté en 16 bits"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data = np.full((128, 192), 40000, dtype=np.uint16)
+        data[40:80, 60:120] = 40800
+        path = os.path.join(tmpdir, 'dem.tif')
+        tifffile.imwrite(path, data, tile=(32, 32))
+        assert raster_size(path) == (192, 128)
+        _, stats = run_detector_on_image_path(path)
+        assert stats["max"] > 0.9 and stats["width"] == 192
+        _, half = run_detector_on_image_path(path, level_scale=2.0)
+        assert (half["width"], half["height"]) == (96, 64)
+
+        strips = list(display_strips(path, 50))
+        assert strips[0].dtype == np.uint8 and strips[0].shape == (50, 192, 3)
+        assert strips[1][0, 0, 0] == 0 and strips[1][0, 80, 0] == 255  # étirement min/max
+        base = os.path.join(tmpdir, 'dem')
+        generate_deepzoom(path, base, tile_size=64, suffix=".png")
+        assert read_dzi(f"{base}.dzi")["width"] == 192
+        assert np.asarray(Image.open(f"{base}_files/8/1_1.png"))[0, 0, 0] == 255
+
+def test_band_selection():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data = np.zeros((64, 64, 5), dtype=np.uint16)
+        data[16:48, 16:48, 4] = 1000  # structure visible seulement dans la bande 4
+        path = os.path.join(tmpdir, 'ms.tif')
+        tifffile.imwrite(path, data, planarconfig='contig')
+        _, flat = run_detector_on_image_path(path, bands=[0])
+        _, nir = run_detector_on_image_path(path, bands=[4])
+        assert flat["max"] == 0.0 and nir["max"] > 0.9
+
+def test_tiff_tiling_is_windowed():
+    """TIFF tuilé: la génération ne décode jamais la source entière (fallback PNG: décodage complet prévu)"""
+    import tracemalloc
+    from app.pyramides import estimate_tiling_memory
+    with tempfile.TemporaryDirectory() as tmpdir:
+        data = np.random.default_rng(5).integers(0, 255, size=(8192, 256, 3), dtype=np.uint8)
+        tif, png = os.path.join(tmpdir, 'tall.tif'), os.path.join(tmpdir, 'tall.png')
+        tifffile.imwrite(tif, data, tile=(256, 256))
+        Image.fromarray(data).save(png)
+        tracemalloc.start()
+        try:
+            report = generate_deepzoom(tif, os.path.join(tmpdir, 'out'), tile_size=256, suffix=".png")
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert peak < data.nbytes / 2
+        assert report["memory"]["windowed"] and report["memory"]["total_mb"] < data.nbytes / 2 ** 20
+        full = estimate_tiling_memory(png, tile_size=256)
+        assert not full["windowed"] and full["decode_mb"] >= data.nbytes / 2 ** 20
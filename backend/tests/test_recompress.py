@@ -0,0 +1,83 @@
+import os
+import tempfile
+from pathlib import Path
+import numpy as np
+import pytest
+from PIL import Image
+from app.pyramides import generate_deepzoom, read_dzi, pyramid_is_current
+from app.recompress import recompress_pyramid
+
+def _pyramid(tmpdir, suffix=".png", mode="RGB"):
+    rng = np.random.default_rng(0)
+    arr = np.zeros((200, 300, 3), dtype=np.uint8)
+    arr[:, 150:] = rng.integers(0, 255, size=(200, 150, 3), dtype=np.uint8)
+    src = os.path.join(tmpdir, 'src.png')
+    Image.fromarray(arr).convert(mode).save(src)
+    base = os.path.join(tmpdir, 'scene')
+    generate_deepzoom(src, base, tile_size=64, suffix=suffix)
+    return src, base
+
+def test_same_format_keeps_only_smaller():
+    """Ré-encodage PNG: aucune tuile ne grossit, gains rapportés par niveau"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _, base = _pyramid(tmpdir, suffix=".png[compression=1]")
+        before = {p: p.stat().st_size for p in Path(f"{base}_files").rglob("*.png")}
+        report = recompress_pyramid(base, target="png", png_level=9)
+        assert report["committed"] and report["format"] == "png"
+        assert report["bytes_saved"] > 0
+        assert set(report["levels"]) == {str(lv) for lv in range(9 + 1)}
+        for p, size in before.items():
+            assert p.stat().st_size <= size
+        assert not [p for p in Path(f"{base}_files").rglob(".*recomp*")]
+
+def test_format_change_updates_dzi_and_manifest():
+    """Conversion PNG → WebP: le .dzi suit, la demande de génération d'origine reste à jour"""
+    import shutil
+    from app.pyramides import PyramidManifest
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src, base = _pyramid(tmpdir)
+        seen = []
+        report = recompress_pyramid(base, target="webp", quality=70, workers=2, progress=seen.append)
+        assert report["committed"]
+        assert seen[-1]["tiles_written"] == seen[-1]["tiles_total"] > 0
+        assert read_dzi(f"{base}.dzi")["format"] == "webp"
+        assert not list(Path(f"{base}_files").rglob("*.png"))
+        assert Path(f"{base}_files/9/0_0.webp").exists()
+        assert PyramidManifest.load(f"{base}_files").data["encoding"] == {"suffix": ".webp[Q=70]"}
+        assert pyramid_is_current(src, base, tile_size=64, suffix=".png")
+        assert generate_deepzoom(src, base, tile_size=64, suffix=".png")["up_to_date"]
+
+        # un niveau perdu est régénéré dans l'encodage de la pyramide, pas en PNG
+        shutil.rmtree(f"{base}_files/9")
+        assert generate_deepzoom(src, base, tile_size=64, suffix=".png")["levels_built"] == [9]
+        assert Path(f"{base}_files/9/0_0.webp").exists() and not list(Path(f"{base}_files").rglob("*.png"))
+        assert read_dzi(f"{base}.dzi")["format"] == "webp"
+
+def test_failed_format_change_leaves_old_pyramid(monkeypatch):
+    """Échec pendant la publication: ancien format intact, aucune tuile du nouveau format"""
+    from app import recompress
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _, base = _pyramid(tmpdir)
+        tiles = sorted(Path(f"{base}_files").rglob("*.png"))
+        real_replace, calls = os.replace, []
+
+        def flaky_replace(a, b):
+            calls.append(b)
+            if len(calls) == 5:
+                raise OSError("disque plein")
+            real_replace(a, b)
+        monkeypatch.setattr(recompress.os, "replace", flaky_replace)
+        with pytest.raises(OSError):
+            recompress_pyramid(base, target="webp")
+        assert read_dzi(f"{base}.dzi")["format"] == "png"
+        assert sorted(Path(f"{base}_files").rglob("*.png")) == tiles
+        assert not [p for p in Path(f"{base}_files").rglob("*") if p.suffix == ".webp"]
+
+def test_jpeg_refused_for_alpha_tiles():
+    """Pas de conversion JPEG pour des tuiles RGBA (heatmaps)"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _, base = _pyramid(tmpdir, mode="RGBA")
+        with pytest.raises(ValueError):
+            recompress_pyramid(base, target="jpg", workers=2)
+        assert read_dzi(f"{base}.dzi")["format"] == "png"
+        assert not [p for p in Path(f"{base}_files").rglob("*") if p.suffix == ".jpg"]
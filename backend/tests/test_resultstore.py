@@ -0,0 +1,61 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from app.resultstore import ResultsStore, main
+
+
+def _results(n=20):
+    return [{"image_id": f"img{i:02d}", "source": f"img{i:02d}.png",
+             "levels": [{"level": lv, "scale": 2.0 ** lv, "skipped": False, "error": None, "elapsed_ms": 5,
+                         "stats": {"min": 0.0, "max": i / n + lv / 10, "mean": 0.1, "std": 0.05,
+                                   "width": 64 >> lv, "height": 48 >> lv}}
+                        for lv in (0, 4)]}
+            for i in range(n)]
+
+
+def test_query_filters_aggregates_and_upserts():
+    """Filtres, agrégats groupés, tri; une relance remplace les lignes au lieu de les dupliquer"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = ResultsStore(Path(tmpdir) / "results.sqlite")
+        assert store.add(_results()) == 40
+        assert store.add(_results()) == 40
+        rows = store.query(["level=4", "max>0.92"], select=["image_id", "max"], order=["-max"])
+        assert [r["image_id"] for r in rows] == [f"img{i:02d}" for i in range(19, 10, -1)]
+        agg = store.query(aggs=["count", "mean(max)", "max(width)"], group_by=["level"], order=["-level"])
+        assert [(r["level"], r["count"], r["max(width)"]) for r in agg] == [(4, 20, 4), (0, 20, 64)]
+        assert store.query(["image_id~img1%"], aggs=["count"]) == [{"count": 20}]
+        assert store.query(aggs=["count"], group_by=["level"], order=["-count", "level"], limit=1)[0]["level"] == 0
+        for bad in (dict(where=["score>1"]), dict(where=["max ?? 1"]), dict(aggs=["median(max)"]),
+                    dict(select=["max; DROP TABLE levels"])):
+            with pytest.raises(ValueError):
+                store.query(**bad)
+        store.close()
+
+
+def test_orchestrator_fills_store_and_cli_imports_journal(capsys):
+    """run_batch alimente la table; le CLI réimporte un journal et répond en JSON"""
+    from app.orchestrator import Job, Journal, run_batch
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, 'scene.png')
+        Image.new('RGB', (96, 64), color=(30, 60, 90)).save(src)
+        out = Path(tmpdir) / "out"
+        journal = Journal(out / "journal.ndjson")
+        store = ResultsStore(out / "results.sqlite")
+        run_batch([Job(f"img{i}", Path(src), [0, 1], None, False) for i in range(3)] +
+                  [Job("broken", Path("missing.png"), [0], None, False)],
+                  out, retries=0, journal=journal, results=store)
+        journal.close()
+        rows = store.query(["level=1"], select=["image_id", "width", "skipped"])
+        store.close()
+        assert rows == [{"image_id": f"img{i}", "width": 48, "skipped": 0} for i in range(3)]
+
+        other = str(Path(tmpdir) / "copy.sqlite")
+        assert main([other, "--import", str(out / "journal.ndjson"), "--where", "error~Failed%",
+                     "--select", "image_id,level", "--json"]) == 0
+        assert [json.loads(l) for l in capsys.readouterr().out.splitlines()] == [{"image_id": "broken", "level": 0}]
+        assert main([other, "--where", "nope=1"]) == 2
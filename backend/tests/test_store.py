@@ -0,0 +1,33 @@
+from app import store
+
+def test_insert_and_clear_events():
+    """Les écritures du store publient des événements insert/clear"""
+    store.clear_annotations()
+    token = store.current_token()
+    received = []
+    unsubscribe = store.subscribe(received.append)
+    try:
+        item = store.save_annotation({"type": "point", "x": 0.1, "y": 0.2})
+        store.clear_annotations()
+    finally:
+        unsubscribe()
+    assert [ev["type"] for ev in received] == ["insert", "clear"]
+    assert received[0]["item"]["id"] == item["id"]
+
+    backlog = store.events_since(token)
+    assert [ev["type"] for ev in backlog] == ["insert", "clear"]
+    assert store.events_since(received[-1]["token"]) == []
+
+def test_events_since_invalid_tokens():
+    """Jeton absent, d'une autre époque ou futur → resynchronisation"""
+    assert store.events_since(None) is None
+    assert store.events_since("deadbeef:1") is None
+    seq = int(store.current_token().split(':')[1])
+    assert store.events_since(f"{store.EPOCH}:{seq + 5}") is None
+
+def test_unsubscribe_stops_delivery():
+    """Un abonné désinscrit ne reçoit plus rien"""
+    received = []
+    store.subscribe(received.append)()
+    store.clear_annotations()
+    assert received == []
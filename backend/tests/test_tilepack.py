@@ -0,0 +1,104 @@
+import os
+import tempfile
+from pathlib import Path
+import pytest
+from PIL import Image
+from app.pyramides import generate_deepzoom, read_dzi
+from app.tilepack import pack_pyramid, pack_is_current, unpack_pyramid, TilePack, open_pack
+
+def _pyramid(tmpdir, size=(300, 200)):
+    input_path = os.path.join(tmpdir, 'src.png')
+    Image.new('RGB', size, color='teal').save(input_path)
+    base = os.path.join(tmpdir, 'scene')
+    generate_deepzoom(input_path, base, tile_size=64, suffix=".png")
+    return base
+
+def test_pack_roundtrip():
+    """Empaquetage puis lecture: mêmes octets que les fichiers d'origine"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        base = _pyramid(tmpdir)
+        originals = {}
+        for root, _, files in os.walk(f"{base}_files"):
+            for name in files:
+                if name.endswith(".png"):
+                    originals[(int(Path(root).name), name)] = Path(root, name).read_bytes()
+
+        info = read_dzi(f"{base}.dzi")
+        pack_path = pack_pyramid(base, remove_files=True)
+        assert pack_path.name == "scene.dzpack"
+        assert not os.path.exists(f"{base}_files") and not os.path.exists(f"{base}.dzi")
+
+        pack = TilePack(pack_path)
+        try:
+            assert pack.dzi == info
+            assert len(pack.tiles) == len(originals)
+            for (level, name), data in originals.items():
+                col, row = (int(v) for v in name[:-4].split("_"))
+                assert bytes(pack.get(level, col, row)) == data
+            assert pack.get(99, 0, 0) is None
+        finally:
+            pack.close()
+
+        unpack_pyramid(pack_path, os.path.join(tmpdir, 'restored'))
+        assert Path(tmpdir, 'restored_files', '9', '0_0.png').read_bytes() == originals[(9, '0_0.png')]
+
+def test_invalid_pack_rejected():
+    """Un fichier quelconque n'est pas accepté comme archive"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bogus = Path(tmpdir, 'bogus.dzpack')
+        bogus.write_bytes(b"x" * 64)
+        with pytest.raises(ValueError):
+            TilePack(bogus)
+        for size in (0, 5):
+            bogus.write_bytes(b"D" * size)
+            with pytest.raises(ValueError):
+                TilePack(bogus)
+
+def test_packed_pyramid_stays_up_to_date(monkeypatch):
+    """Pyramide empaquetée: manifeste embarqué, nouvelle demande sans régénération"""
+    from fastapi.testclient import TestClient
+    from app import main
+    with tempfile.TemporaryDirectory() as tmpdir:
+        monkeypatch.setattr(main, "TILES_DIR", Path(tmpdir))
+        src = os.path.join(tmpdir, 'scene.png')
+        Image.new('RGB', (300, 200), color='teal').save(src)
+        client = TestClient(main.app)
+        body = {"image_path": src, "preset": "lossless", "pack": True}
+        first = client.post("/generate-tiles", json=body).json()
+        assert first["success"] and not first["up_to_date"]
+        assert not os.path.exists(os.path.join(tmpdir, 'scene.dzi'))
+        assert client.get("/lazy/scene.dzi").status_code == 404
+        assert pack_is_current(os.path.join(tmpdir, 'scene'), src, tile_size=256, suffix=".png")
+        assert not pack_is_current(os.path.join(tmpdir, 'scene'), src, tile_size=128, suffix=".png")
+        again = client.post("/generate-tiles", json=body).json()
+        assert again["up_to_date"] and again["levels_built"] == []
+
+        unpack_pyramid(Path(tmpdir, 'scene.dzpack'), os.path.join(tmpdir, 'scene'))
+        assert generate_deepzoom(src, os.path.join(tmpdir, 'scene'), tile_size=256, suffix=".png")["up_to_date"]
+
+def test_packed_routes(monkeypatch):
+    """Le .dzi et les tuiles sont servis depuis l'archive"""
+    from fastapi.testclient import TestClient
+    from app import main
+    with tempfile.TemporaryDirectory() as tmpdir:
+        monkeypatch.setattr(main, "TILES_DIR", Path(tmpdir))
+        base = _pyramid(tmpdir)
+        expected = Path(f"{base}_files/9/1_0.png").read_bytes()
+        pack_pyramid(base, remove_files=True)
+        client = TestClient(main.app)
+        r = client.get("/packed/scene.dzi")
+        assert r.status_code == 200 and 'TileSize="64"' in r.text
+        views = []
+        release = main._release_view
+        monkeypatch.setattr(main, "_release_view", lambda v: (views.append(v), release(v)))
+        r = client.get("/packed/scene_files/9/1_0.png")
+        assert r.status_code == 200
+        assert r.headers["content-type"] == "image/png"
+        assert r.content == expected
+        # corps servi depuis la vue sur le mmap, libérée après l'envoi
+        assert len(views) == 1 and isinstance(views[0], memoryview)
+        with pytest.raises(ValueError):
+            views[0].tobytes()
+        assert client.get("/packed/scene_files/9/1_0.jpg").status_code == 404
+        assert client.get("/packed/missing.dzi").status_code == 404
+        assert open_pack(Path(tmpdir, "scene.dzpack")) is open_pack(Path(tmpdir, "scene.dzpack"))
@@ -0,0 +1,34 @@
+import tempfile
+from pathlib import Path
+import pytest
+from app.pyramides import TILING_PRESETS, tiling_preset
+from app.tiling_bench import benchmark_presets, make_reference_image, simulate_trace, standard_traces, tiles_for_view
+
+def test_tiling_preset_unknown():
+    assert tiling_preset("standard") == {"tile_size": 256, "overlap": 0, "suffix": ".jpg"}
+    with pytest.raises(ValueError):
+        tiling_preset("inexistant")
+
+def test_tiles_for_view_levels():
+    """Vue d'ensemble → plus petit niveau couvrant l'écran (1024 px pour 800 px); 1:1 → niveau max"""
+    overview = tiles_for_view(4096, 4096, 256, 0.0, 0.5, 0.5, viewport=(800, 800))
+    assert {t[0] for t in overview} == {10} and len(overview) == 16
+    full = tiles_for_view(4096, 4096, 256, 1.0, 0.5, 0.5, viewport=(512, 512))
+    assert {t[0] for t in full} == {12} and len(full) == 4
+
+def test_larger_tiles_fewer_requests():
+    trace = standard_traces()["pan"]
+    small = simulate_trace(8192, 8192, 256, trace)["requests"]
+    large = simulate_trace(8192, 8192, 512, trace)["requests"]
+    assert 0 < large < small
+
+def test_benchmark_presets_reports():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        img = make_reference_image(Path(tmpdir) / "ref.png", (600, 400))
+        rows = benchmark_presets(img, ["standard", "lossless"], workdir=tmpdir)
+    assert [r["preset"] for r in rows] == ["standard", "lossless"]
+    for r in rows:
+        assert r["files"] > 0 and r["bytes"] > 0 and set(r["requests"]) == set(standard_traces())
+    assert rows[1]["bytes"] > rows[0]["bytes"]  # PNG sans perte plus lourd que JPEG
+    assert set(rows[0]) >= {"tile_size", "overlap", "suffix", "seconds"}
+    assert "standard" in TILING_PRESETS
@@ -0,0 +1,73 @@
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from app.workqueue import WorkQueue
+
+
+def test_leases_claim_renew_and_expire():
+    """Bail exclusif; renouvelé il tient, expiré l'entrée est redistribuée puis abandonnée"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        q = WorkQueue(Path(tmpdir) / "q.sqlite")
+        assert q.enqueue([(f"img{i}", {"n": i}) for i in range(3)]) == 3
+        assert q.enqueue([(f"img{i}", {"n": i}) for i in range(3)]) == 0  # second nœud: idempotent
+        with pytest.raises(ValueError):
+            q.enqueue([("autre", {})])
+
+        a = q.claim("a", lease_s=0.2)
+        assert a == [(0, {"n": 0})]
+        assert q.claim("b", lease_s=0.2) == [(1, {"n": 1})]
+        assert q.renew("a", [0], lease_s=60) == set()
+        time.sleep(0.3)
+        # bail de b expiré: repris par c; celui de a, renouvelé, reste à a
+        assert [idx for idx, _ in q.claim("c", lease_s=60, limit=5)] == [1, 2]
+        assert q.renew("b", [1]) == {1}
+        assert q.complete("a", 0, {"image_id": "img0"})
+        assert not q.complete("c", 0, {"image_id": "img0"})
+        assert q.counts() == {"queued": 0, "leased": 2, "done": 1, "failed": 0}
+
+        q.release("c", 2)
+        assert q.claim("d", lease_s=0.05, max_attempts=2) == [(2, {"n": 2})]
+        time.sleep(0.1)
+        assert q.claim("e", max_attempts=2) == []  # 2e expiration: entrée en échec
+        assert q.counts()["failed"] == 1
+        assert [r["image_id"] for r in q.results()] == ["img0"]
+        q.close()
+
+
+def test_two_nodes_share_one_manifest():
+    """Deux « nœuds » (processus) sur la même file: chaque job traité une fois, sorties complètes"""
+    from app.orchestrator import Job, run_queue, write_batch_summary
+    from concurrent.futures import ProcessPoolExecutor
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src = os.path.join(tmpdir, 'scene.png')
+        Image.new('RGB', (96, 64), color=(20, 120, 200)).save(src)
+        out = Path(tmpdir) / "out"
+        db = out / "queue.sqlite"
+        jobs = [Job(f"img{i}", Path(src), [0, 1], None, False) for i in range(8)]
+
+        with ProcessPoolExecutor(max_workers=2) as ex:
+            runs = [f.result() for f in [ex.submit(run_queue, jobs, db, out, 1, 30.0, 0, 0.0, False, False, f"node{n}")
+                                         for n in range(2)]]
+        assert sum(r["queue"]["enqueued"] for r in runs) == 8
+        assert sum(r["throughput"]["images"] for r in runs) == 8
+        assert all(r["queue"]["done"] == 8 for r in runs if r["queue"]["leased"] == 0)
+
+        q = WorkQueue(db)
+        results = list(q.results())
+        assert [r["image_id"] for r in results] == [f"img{i}" for i in range(8)]
+        tail = write_batch_summary(out / "batch_summary.json", q.results(), {})
+        q.close()
+        assert tail["levels_computed"] == 16 and tail["levels_failed"] == 0
+        for i in range(8):
+            assert (out / f"img{i}" / f"img{i}_L1.json").exists()
+            assert json.loads((out / f"img{i}" / f"img{i}_summary.json").read_text())["image_id"] == f"img{i}"
+
+        # relance sur une file vide: rien à faire
+        again = run_queue(jobs, db, out, workers=2)
+        assert again["queue"]["enqueued"] == 0 and again["throughput"]["images"] == 0
@@ -12,12 +12,21 @@ export const api = {
     return response.data;
   },
 
-  // Récupération des annotations
-  async getAnnotations() {
-    const response = await axios.get(`${API_BASE_URL}/annotations`);
+  // Récupération des annotations (pagination par curseur optionnelle)
+  async getAnnotations(params?: { after?: number; limit?: number; fields?: string }) {
+    const response = await axios.get(`${API_BASE_URL}/annotations`, { params });
     return response.data;
   },
 
+  // Flux SSE des annotations (snapshot/insert/clear); EventSource gère la reprise via Last-Event-ID
+  subscribeAnnotations(onEvent: (type: string, data: any) => void): () => void {
+    const source = new EventSource(`${API_BASE_URL}/annotations/stream`);
+    for (const type of ['snapshot', 'insert', 'clear']) {
+      source.addEventListener(type, (e) => onEvent(type, JSON.parse((e as MessageEvent).data)));
+    }
+    return () => source.close();
+  },
+
   // Ajout d'une annotation
   async addAnnotation(annotation: any) {
     const response = await axios.post(`${API_BASE_URL}/annotations`, annotation);
@@ -52,6 +61,30 @@ export const api = {
     return response.data;
   },
 
+  // Génération de tuiles en arrière-plan (retour immédiat avec job_id)
+  async generateTilesInBackground(imagePath: string) {
+    const response = await axios.post(`${API_BASE_URL}/generate-tiles`, {
+      image_path: imagePath,
+      background: true
+    });
+    return response.data;
+  },
+
+  // Pyramide paresseuse: .dzi + niveaux grossiers immédiats, à ouvrir via lazy_dzi_url
+  async generateTilesLazy(imagePath: string) {
+    const response = await axios.post(`${API_BASE_URL}/generate-tiles`, {
+      image_path: imagePath,
+      lazy: true
+    });
+    return response.data;
+  },
+
+  // Statut/progression d'une tâche d'arrière-plan
+  async getJob(jobId: string) {
+    const response = await axios.get(`${API_BASE_URL}/jobs/${jobId}`);
+    return response.data;
+  },
+
   // Détection sur un chemin donné (retourne un Blob PNG)
   async detectOnPath(imagePath: string, level: number = 0): Promise<Blob> {
     const response = await axios.post(
@@ -62,6 +95,17 @@ export const api = {
     return response.data as Blob;
   },
 
+  // Tuile de comparaison avant/après calculée côté serveur (calque 'change' ou |A - B| 'diff')
+  compareTileUrl(a: string, b: string, level: number, col: number, row: number, mode: 'change' | 'diff' = 'change') {
+    return `${API_BASE_URL}/compare/${a}/${b}/${level}/${col}_${row}.png?mode=${mode}`;
+  },
+
+  // Statistiques de changement d'une tuile (fraction changée, écart moyen, RMSE…)
+  async getCompareStats(a: string, b: string, level: number, col: number, row: number, mode: 'change' | 'diff' = 'change') {
+    const response = await axios.get(`${API_BASE_URL}/compare/${a}/${b}/${level}/${col}_${row}.json`, { params: { mode } });
+    return response.data;
+  },
+
   // Health check
   async healthCheck() {
     const response = await axios.get(`${API_BASE_URL}/health`);